@@ -0,0 +1,5 @@
+"""
+Benchmarks of compgraph engine over seeded synthetic data. Run with
+
+    python -m benchmarks --sizes 1000 10000 --output result.json --baseline baseline.json
+"""
@@ -0,0 +1,93 @@
+import datetime
+import random
+import string
+from typing import Dict, List, Tuple
+
+# 2017-10-09 is monday, same week as in tests of yandex maps graph
+START_TIME = datetime.datetime(2017, 10, 9)
+
+
+def _vocabulary(size: int, rng: random.Random) -> List[str]:
+    words = set()
+    while len(words) < size:
+        words.add("".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(2, 10))))
+    return sorted(words)
+
+
+def _zipf_weights(size: int, exponent: float) -> List[float]:
+    return [1 / (rank ** exponent) for rank in range(1, size + 1)]
+
+
+def text_corpus(docs: int, words_per_doc: int = 50, vocabulary: int = 5000, seed: int = 0) -> List[Dict]:
+    """
+    Documents with words distributed by Zipf law, with punctuation and capital letters like real text
+    :param docs: number of documents
+    :param words_per_doc: average number of words in document
+    :param vocabulary: number of distinct words
+    :param seed: seed of random generator, same seed gives same corpus
+    :return: table with columns doc_id and text
+    """
+    rng = random.Random(seed)
+    words = _vocabulary(vocabulary, rng)
+    weights = _zipf_weights(vocabulary, 1.1)
+    result = []
+    for doc_id in range(docs):
+        length = rng.randint(words_per_doc // 2, words_per_doc * 3 // 2)
+        text = rng.choices(words, weights, k=length)
+        for position in range(0, length, 12):
+            text[position] = text[position].capitalize()
+            text[min(position + 11, length - 1)] += rng.choice(".,!?")
+        result.append({"doc_id": doc_id, "text": " ".join(text)})
+    return result
+
+
+def road_graph(edges: int, seed: int = 0) -> List[Dict]:
+    """
+    Edges of road graph around Moscow
+    :param edges: number of edges
+    :param seed: seed of random generator
+    :return: table with columns edge_id, start and end like input of build_yandex_maps_graph
+    """
+    rng = random.Random(seed)
+    result = []
+    for _ in range(edges):
+        start = [37.3 + rng.random() * 0.6, 55.5 + rng.random() * 0.4]
+        end = [start[0] + (rng.random() - 0.5) * 0.002, start[1] + (rng.random() - 0.5) * 0.002]
+        result.append({"edge_id": rng.getrandbits(63), "start": start, "end": end})
+    return result
+
+
+def travel_times(rows: int, road: List[Dict], seed: int = 0) -> List[Dict]:
+    """
+    Log of passages of road edges during one week, some of passages cross borders of hours
+    :param rows: number of passages
+    :param road: edges from road_graph
+    :param seed: seed of random generator
+    :return: table with columns edge_id, enter_time and leave_time
+    """
+    rng = random.Random(seed)
+    result = []
+    for _ in range(rows):
+        enter_time = START_TIME + datetime.timedelta(seconds=rng.uniform(0, 7 * 24 * 3600 - 600))
+        leave_time = enter_time + datetime.timedelta(seconds=rng.uniform(0.5, 120))
+        result.append({"edge_id": rng.choice(road)["edge_id"],
+                       "enter_time": enter_time.strftime("%Y%m%dT%H%M%S.%f"),
+                       "leave_time": leave_time.strftime("%Y%m%dT%H%M%S.%f")})
+    return result
+
+
+def skewed_tables(rows: int, keys: int = 1000, skew: float = 1.2, seed: int = 0) -> Tuple[List[Dict], List[Dict]]:
+    """
+    Pair of tables for join, keys of big table are distributed by Zipf law, so few keys hold most of lines
+    :param rows: number of lines of big table
+    :param keys: number of distinct keys
+    :param skew: exponent of Zipf law, 0 for uniform distribution
+    :param seed: seed of random generator
+    :return: big table with columns key and value, small table with columns key and name, one line per key
+    """
+    rng = random.Random(seed)
+    weights = _zipf_weights(keys, skew)
+    big = [{"key": key, "value": rng.random()} for key in rng.choices(range(keys), weights, k=rows)]
+    small = [{"key": key, "name": "name{}".format(key)} for key in range(keys)]
+    rng.shuffle(small)
+    return big, small
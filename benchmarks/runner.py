@@ -0,0 +1,130 @@
+import argparse
+import json
+import platform
+import statistics
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from time import perf_counter
+from typing import Dict, Iterable, List, Optional
+
+try:
+    import resource
+except ImportError:  # pragma: no cover
+    resource = None
+
+from benchmarks.suite import BENCHMARKS
+
+DEFAULT_SIZES = (1000, 10000)
+DEFAULT_THRESHOLD = 0.1
+
+
+def peak_rss() -> Optional[int]:
+    """
+    Peak resident set size of current process in bytes, None if it is unknown on this platform
+    """
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return usage if sys.platform == "darwin" else usage * 1024
+
+
+def measure(name: str, size: int, repeat: int = 3, seed: int = 0) -> Dict:
+    """
+    Runs benchmark several times, generation of input is not measured
+    :param name: name of benchmark from BENCHMARKS
+    :param size: number of input lines
+    :param repeat: number of runs
+    :param seed: seed of generators of input
+    :return: times of runs, best and median time, throughput of median run in input lines per second
+    and peak RSS of process
+    """
+    run, rows = BENCHMARKS[name](size, seed)
+    times = []
+    for _ in range(repeat):
+        started = perf_counter()
+        run()
+        times.append(perf_counter() - started)
+    median = statistics.median(times)
+    return {"benchmark": name,
+            "size": size,
+            "rows": rows,
+            "times": times,
+            "best": min(times),
+            "median": median,
+            "rows_per_second": rows / median if median > 0 else None,
+            "peak_rss": peak_rss()}
+
+
+def run_benchmarks(names: Iterable[str], sizes: Iterable[int], repeat: int = 3, seed: int = 0,
+                   isolate: bool = True) -> List[Dict]:
+    """
+    :param isolate: bool True if every benchmark should be run in fresh process, so peak RSS is not shared
+    between benchmarks
+    """
+    results = []
+    for name in names:
+        for size in sizes:
+            if isolate:
+                with ProcessPoolExecutor(max_workers=1) as executor:
+                    results.append(executor.submit(measure, name, size, repeat, seed).result())
+            else:
+                results.append(measure(name, size, repeat, seed))
+    return results
+
+
+def compare(results: List[Dict], baseline: List[Dict], threshold: float = DEFAULT_THRESHOLD) -> List[Dict]:
+    """
+    Compares median times with baseline results of same benchmarks and sizes
+    :param threshold: relative slowdown that is considered regression
+    :return: ratio of median time to baseline median time for every benchmark found in baseline
+    """
+    baseline = {(result["benchmark"], result["size"]): result for result in baseline}
+    comparison = []
+    for result in results:
+        old = baseline.get((result["benchmark"], result["size"]))
+        if old is None or not old["median"]:
+            continue
+        ratio = result["median"] / old["median"]
+        comparison.append({"benchmark": result["benchmark"],
+                           "size": result["size"],
+                           "baseline_median": old["median"],
+                           "median": result["median"],
+                           "ratio": ratio,
+                           "regression": ratio > 1 + threshold})
+    return comparison
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Benchmarks of compgraph")
+    parser.add_argument("benchmarks", nargs="*", help="names of benchmarks, all by default: {}".format(
+        ", ".join(BENCHMARKS)))
+    parser.add_argument("--sizes", nargs="+", type=int, default=DEFAULT_SIZES, help="numbers of input lines")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="path of json with results, stdout by default")
+    parser.add_argument("--baseline", help="path of json with results to compare with")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD,
+                        help="relative slowdown that is considered regression")
+    parser.add_argument("--no-isolate", action="store_true", help="run all benchmarks in current process")
+    args = parser.parse_args(argv)
+
+    unknown = [name for name in args.benchmarks if name not in BENCHMARKS]
+    if unknown:
+        parser.error("unknown benchmarks: {}".format(", ".join(unknown)))
+    results = run_benchmarks(args.benchmarks or list(BENCHMARKS), args.sizes, args.repeat, args.seed,
+                             not args.no_isolate)
+    report = {"python": platform.python_version(),
+              "platform": platform.platform(),
+              "seed": args.seed,
+              "results": results}
+    if args.baseline:
+        with open(args.baseline) as file:
+            report["comparison"] = compare(results, json.load(file)["results"], args.threshold)
+
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(report, file, indent=2)
+    else:
+        json.dump(report, sys.stdout, indent=2)
+        sys.stdout.write("\n")
+    return 1 if any(item["regression"] for item in report.get("comparison", ())) else 0
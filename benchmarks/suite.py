@@ -0,0 +1,166 @@
+from typing import Callable, Dict, List, Tuple
+
+from compgraph.batch import numpy
+from compgraph.graph import ComputeGraph, run_many
+from compgraph.examples import algorithms
+
+from benchmarks import generators
+
+# benchmark takes size of input and seed and returns function that runs graph and number of input lines
+Benchmark = Callable[[int, int], Tuple[Callable[[], List[Dict]], int]]
+BENCHMARKS = {}
+
+
+def benchmark(name: str) -> Callable[[Benchmark], Benchmark]:
+    def register(function):
+        BENCHMARKS[name] = function
+        return function
+    return register
+
+
+def _runner(build, **inputs):
+    # graph is built for every run, so runs do not share state of graph
+    return lambda: build().run(**inputs)
+
+
+def _count(rows):
+    rows = list(rows)
+    yield {"key": rows[0]["key"], "count": len(rows)}
+
+
+def _double(row):
+    yield {"key": row["key"], "value": row["value"] * 2}
+
+
+def _even_key(row):
+    return row["key"] % 2 == 0
+
+
+def _total(state, row):
+    return {"total": (state["total"] if state else 0) + row["value"]}
+
+
+@benchmark("word_count")
+def word_count(size, seed):
+    docs = generators.text_corpus(size, 20, seed=seed)
+    return _runner(lambda: algorithms.build_word_count_graph("docs"), docs=docs), size
+
+
+@benchmark("inverted_index")
+def inverted_index(size, seed):
+    docs = generators.text_corpus(size, 20, seed=seed)
+    return _runner(lambda: algorithms.build_inverted_index_graph("docs"), docs=docs), size
+
+
+@benchmark("pmi")
+def pmi(size, seed):
+    docs = generators.text_corpus(size, 20, seed=seed)
+    return _runner(lambda: algorithms.build_pmi_graph("docs"), docs=docs), size
+
+
+@benchmark("text_graphs")
+def text_graphs(size, seed):
+    # word count, inverted index and pmi in one run over one corpus
+    docs = generators.text_corpus(size, 20, seed=seed)
+    builds = {"word_count": algorithms.build_word_count_graph, "inverted_index": algorithms.build_inverted_index_graph,
+              "pmi": algorithms.build_pmi_graph}
+    return lambda: run_many({name: build("docs") for name, build in builds.items()}, docs=docs), size
+
+
+@benchmark("yandex_maps")
+def yandex_maps(size, seed):
+    road = generators.road_graph(max(size // 10, 1), seed)
+    times = generators.travel_times(size, road, seed)
+    return _runner(lambda: algorithms.build_yandex_maps_graph("times", "lengths"), times=times, lengths=road), size
+
+
+@benchmark("map")
+def map_(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").map(_double), big=big), size
+
+
+@benchmark("sort")
+def sort(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").sort("value"), big=big), size
+
+
+@benchmark("sort_spilled")
+def sort_spilled(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").sort("value", max_rows=max(size // 10, 1)), big=big), size
+
+
+@benchmark("top_k")
+def top_k(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").top_k(10, "value", keys="key", reverse=True), big=big), size
+
+
+@benchmark("filter_sorted")
+def filter_sorted(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    # filter is written after sort, planner moves it before
+    return _runner(lambda: ComputeGraph("big").sort("value").filter(_even_key, columns="key"), big=big), size
+
+
+@benchmark("reduce_sorted")
+def reduce_sorted(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").sort("key").reduce(_count, "key"), big=big), size
+
+
+@benchmark("reduce_hash")
+def reduce_hash(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").reduce(_count, "key", presorted=False), big=big), size
+
+
+@benchmark("fold")
+def fold(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").fold(_total), big=big), size
+
+
+@benchmark("join_merge")
+def join_merge(size, seed):
+    big, small = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").join(ComputeGraph("small"), "key"), big=big, small=small), size
+
+
+@benchmark("join_hash")
+def join_hash(size, seed):
+    big, small = generators.skewed_tables(size, seed=seed)
+    return _runner(lambda: ComputeGraph("big").join(ComputeGraph("small"), "key", strategy="hash"),
+                   big=big, small=small), size
+
+
+@benchmark("join_skewed_parallel")
+def join_skewed_parallel(size, seed):
+    big, small = generators.skewed_tables(size, skew=2.0, seed=seed)
+    return _runner(lambda: ComputeGraph("big").join(ComputeGraph("small"), "key"), big=big, small=small,
+                   parallelism=4), size
+
+
+@benchmark("join_bloom")
+def join_bloom(size, seed):
+    big, small = generators.skewed_tables(size, skew=0.0, seed=seed)
+    # only tenth of keys of big table have pair
+    small = small[:len(small) // 10]
+    return _runner(lambda: ComputeGraph("big").join(ComputeGraph("small"), "key", bloom_filter=True),
+                   big=big, small=small), size
+
+
+@benchmark("join_broadcast")
+def join_broadcast(size, seed):
+    big, _ = generators.skewed_tables(size, seed=seed)
+    # join with result of fold by empty keys
+    return _runner(lambda: ComputeGraph("big").join(ComputeGraph("big").fold(_total)), big=big), size
+
+
+if numpy is not None:
+    @benchmark("aggregate")
+    def aggregate(size, seed):
+        big, _ = generators.skewed_tables(size, seed=seed)
+        return _runner(lambda: ComputeGraph("big").aggregate("key", {"total": ("value", "sum")}), big=big), size
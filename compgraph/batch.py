@@ -0,0 +1,114 @@
+import itertools
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+try:
+    import numpy
+except ImportError:  # pragma: no cover
+    numpy = None
+
+DEFAULT_BATCH_SIZE = 4096
+AGGREGATIONS = ("sum", "count", "mean", "min", "max")
+
+# Batch is dict of columns, every column is numpy array of same length
+Batch = Dict[str, Any]
+
+
+def require_numpy() -> None:
+    if numpy is None:
+        raise ImportError("numpy is required for batch operations, install compgraph[numpy]")
+
+
+def rows_to_batches(rows: Iterable[Dict], batch_size: int = DEFAULT_BATCH_SIZE) -> Iterator[Batch]:
+    """
+    Converts table into batches of batch_size lines. Every line in batch should have same columns as first one
+    :param rows: table
+    :param batch_size: number of lines in batch
+    :return: batches
+    """
+    require_numpy()
+    rows = iter(rows)
+    while True:
+        chunk = list(itertools.islice(rows, batch_size))
+        if not chunk:
+            break
+        yield {column: numpy.array([row[column] for row in chunk]) for column in chunk[0]}
+
+
+def batches_to_rows(batches: Iterable[Batch]) -> Iterator[Dict]:
+    """
+    Converts batches into table with python values
+    :param batches: batches
+    :return: table
+    """
+    for batch in batches:
+        columns = list(batch)
+        for values in zip(*(batch[column].tolist() for column in columns)):
+            yield dict(zip(columns, values))
+
+
+def _group(batch: Batch, keys: Sequence[str]) -> Tuple[List[Tuple], Any, Any]:
+    """
+    Finds groups of lines with same keys in batch
+    :return: keys of groups, index of first line of every group and index of group for every line
+    """
+    codes = None
+    for key in keys:
+        uniques, inverse = numpy.unique(batch[key], return_inverse=True)
+        inverse = inverse.reshape(-1)
+        codes = inverse if codes is None else codes * len(uniques) + inverse
+    _, first, inverse = numpy.unique(codes, return_index=True, return_inverse=True)
+    group_keys = list(zip(*(batch[key][first].tolist() for key in keys)))
+    return group_keys, first, inverse.reshape(-1)
+
+
+def _partial(function: str, values, first, inverse, groups: int) -> List:
+    if function == "count":
+        return numpy.bincount(inverse, minlength=groups).tolist()
+    if function in ("sum", "mean"):
+        sums = numpy.zeros(groups, dtype=values.dtype if values.dtype.kind in "iub" else float)
+        numpy.add.at(sums, inverse, values)
+        if function == "sum":
+            return sums.tolist()
+        counts = numpy.bincount(inverse, minlength=groups).tolist()
+        return list(zip(sums.tolist(), counts))
+    extremes = values[first].copy()
+    (numpy.minimum if function == "min" else numpy.maximum).at(extremes, inverse, values)
+    return extremes.tolist()
+
+
+def _merge(function: str, state, partial):
+    if function in ("sum", "count"):
+        return state + partial
+    if function == "mean":
+        return state[0] + partial[0], state[1] + partial[1]
+    return min(state, partial) if function == "min" else max(state, partial)
+
+
+def aggregate_batches(batches: Iterable[Batch], keys: Sequence[str],
+                      aggregations: Dict[str, Tuple[str, str]]) -> Iterator[Dict]:
+    """
+    Vectorized grouped aggregation. Every batch is aggregated by numpy, only partial aggregates of groups
+    are kept in memory
+    :param batches: batches
+    :param keys: sequence of strings
+    :param aggregations: dict from result column to pair of input column and function,
+    one of "sum", "count", "mean", "min", "max"
+    :return: one line per group, sorted by keys
+    """
+    states = {}
+    for batch in batches:
+        group_keys, first, inverse = _group(batch, keys)
+        partials = [_partial(function, batch[column], first, inverse, len(group_keys))
+                    for column, function in aggregations.values()]
+        for index, group_key in enumerate(group_keys):
+            state = states.get(group_key)
+            if state is None:
+                states[group_key] = [partial[index] for partial in partials]
+            else:
+                for position, (_, function) in enumerate(aggregations.values()):
+                    state[position] = _merge(function, state[position], partials[position][index])
+    for group_key in sorted(states):
+        row = dict(zip(keys, group_key))
+        for (result_column, (_, function)), value in zip(aggregations.items(), states[group_key]):
+            row[result_column] = value[0] / value[1] if function == "mean" else value
+        yield row
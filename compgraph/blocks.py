@@ -0,0 +1,159 @@
+import itertools
+import marshal
+import mmap
+import pickle
+import struct
+import zlib
+from typing import Any, BinaryIO, Iterable, Iterator, List, Optional, Tuple
+
+from compgraph.records import Record, record_type
+
+BLOCK_ROWS = 1024
+MAGIC = b"CGB1"
+_FOOTER = struct.Struct("<Q4s")
+
+# kinds of blocks: dicts and records of same schema (as tuples of values) are encoded by marshal,
+# lines with values that marshal does not support are pickled
+DICT_ROWS = 0
+RECORD_ROWS = 1
+PICKLED_ROWS = 2
+
+
+class BlockIndexEntry(object):
+    __slots__ = ("offset", "length", "kind", "compressed", "rows", "columns")
+
+    def __init__(self, offset, length, kind, compressed, rows, columns):
+        self.offset = offset
+        self.length = length
+        self.kind = kind
+        self.compressed = compressed
+        self.rows = rows
+        self.columns = columns
+
+    def __reduce__(self):
+        return BlockIndexEntry, tuple(getattr(self, attribute) for attribute in self.__slots__)
+
+
+def _encode(rows: List[Any]) -> Tuple[int, Optional[Tuple[str, ...]], bytes]:
+    first = rows[0]
+    try:
+        if isinstance(first, Record):
+            cls = first.__class__
+            if all(row.__class__ is cls for row in rows):
+                values = tuple.__getitem__
+                return RECORD_ROWS, cls._columns, marshal.dumps([values(row, slice(None)) for row in rows])
+        else:
+            # marshal rejects subclasses of dict and values of other types than builtin ones
+            return DICT_ROWS, None, marshal.dumps(rows)
+    except ValueError:
+        pass
+    return PICKLED_ROWS, None, pickle.dumps(rows, protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _decode(entry: BlockIndexEntry, payload) -> List[Any]:
+    if entry.compressed:
+        payload = zlib.decompress(payload)
+    if entry.kind == PICKLED_ROWS:
+        return pickle.loads(payload)
+    data = marshal.loads(payload)
+    if entry.kind == DICT_ROWS:
+        return data
+    return list(map(record_type(entry.columns), data))
+
+
+class BlockWriter(object):
+    """
+    Writes table into binary file of blocks. Blocks of records keep schema once and values of records as tuples,
+    file ends with index of blocks, that keeps offset and number of lines of every block
+    """
+    def __init__(self, file: BinaryIO, block_rows: int = BLOCK_ROWS, compress: bool = False):
+        """
+        :param file: empty binary file opened for writing
+        :param block_rows: number of lines in block
+        :param compress: bool True if blocks should be compressed by zlib
+        """
+        self._file = file
+        self._block_rows = block_rows
+        self._compress = compress
+        self._batch = []
+        self._index = []
+        self.rows = 0
+        file.write(MAGIC)
+
+    def write(self, row: Any) -> None:
+        self._batch.append(row)
+        self.rows += 1
+        if len(self._batch) >= self._block_rows:
+            self._flush()
+
+    def extend(self, rows: Iterable[Any]) -> None:
+        rows = iter(rows)
+        while True:
+            missing = self._block_rows - len(self._batch)
+            chunk = list(itertools.islice(rows, missing))
+            self._batch.extend(chunk)
+            self.rows += len(chunk)
+            if len(chunk) < missing:
+                break
+            self._flush()
+
+    @property
+    def bytes(self) -> int:
+        return self._file.tell()
+
+    def _flush(self):
+        batch = self._batch
+        if not batch:
+            return
+        kind, columns, payload = _encode(batch)
+        if self._compress:
+            payload = zlib.compress(payload, 1)
+        self._index.append(BlockIndexEntry(self._file.tell(), len(payload), kind, self._compress,
+                                           len(batch), columns))
+        self._file.write(payload)
+        self._batch = []
+
+    def close(self) -> None:
+        """
+        Writes rest of lines and index, file is not closed
+        """
+        self._flush()
+        index_offset = self._file.tell()
+        self._file.write(pickle.dumps(self._index, protocol=pickle.HIGHEST_PROTOCOL))
+        self._file.write(_FOOTER.pack(index_offset, MAGIC))
+        self._file.flush()
+
+
+class BlockReader(object):
+    """
+    Reads file written by BlockWriter. File is mapped into memory and blocks are decoded only when they are read
+    """
+    def __init__(self, file: BinaryIO):
+        """
+        :param file: binary file opened for reading, reader does not close it
+        """
+        self._mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mapped[:len(MAGIC)] != MAGIC:
+            self._mapped.close()
+            raise ValueError("File is not in block format")
+        index_offset, magic = _FOOTER.unpack_from(self._mapped, len(self._mapped) - _FOOTER.size)
+        if magic != MAGIC:
+            self._mapped.close()
+            raise ValueError("Block file is not finished")
+        self.index = pickle.loads(self._mapped[index_offset:len(self._mapped) - _FOOTER.size])
+
+    def __len__(self) -> int:
+        return sum(entry.rows for entry in self.index)
+
+    def _block(self, entry):
+        # decoders read straight from mapped memory without copying payload
+        with memoryview(self._mapped) as view, view[entry.offset:entry.offset + entry.length] as payload:
+            return _decode(entry, payload)
+
+    def __iter__(self) -> Iterator[Any]:
+        for entry in self.index:
+            yield from self._block(entry)
+
+    def close(self) -> None:
+        self._mapped.close()
+
@@ -0,0 +1,363 @@
+import dataclasses
+import datetime
+import decimal
+import enum
+import fractions
+import functools
+import hashlib
+import inspect
+import operator
+import os
+import re
+import sys
+import sysconfig
+import tempfile
+import types
+from typing import Any, Dict, FrozenSet, Iterable, Iterator, List, Optional, Tuple
+
+from compgraph.blocks import BlockReader, BlockWriter
+
+SUFFIX = ".blk"
+_code_fingerprints = {}
+# marks fingerprints of values that are identified only in current process, NUL never appears in repr of them
+_OPAQUE = "\0opaque:"
+_PLAIN_TYPES = {type(None), bool, int, float, complex, str, bytes, range, slice, type(Ellipsis),
+                datetime.date, datetime.datetime, datetime.time, datetime.timedelta, decimal.Decimal,
+                fractions.Fraction}
+_LIBRARY_PATHS = tuple(os.path.abspath(sysconfig.get_paths()[name])
+                       for name in ("stdlib", "platstdlib", "purelib", "platlib"))
+
+
+def _code_fingerprint(code) -> str:
+    result = _code_fingerprints.get(code)
+    if result is None:
+        try:
+            source = inspect.getsource(code)
+        except (OSError, TypeError):
+            source = ""
+        # lambdas on one line have same source, so compiled body is hashed too
+        consts = [_code_fingerprint(const) if isinstance(const, types.CodeType) else repr(const)
+                  for const in code.co_consts]
+        source += repr((code.co_code, consts, code.co_names))
+        result = hashlib.sha256(source.encode()).hexdigest()
+        _code_fingerprints[code] = result
+    return result
+
+
+def _is_library(module_name: Optional[str]) -> bool:
+    # functions and classes of standard library and installed packages are identified by their names
+    name = (module_name or "").partition(".")[0]
+    if name in sys.builtin_module_names:
+        return True
+    # modules without file, like __main__ of interactive session, are not libraries
+    path = getattr(sys.modules.get(name), "__file__", None)
+    return path is not None and os.path.abspath(path).startswith(_LIBRARY_PATHS)
+
+
+def _code_names(code, names: Optional[set] = None) -> set:
+    # global names read by function and by functions, lambdas and comprehensions defined in it
+    names = set() if names is None else names
+    names.update(code.co_names)
+    for const in code.co_consts:
+        if isinstance(const, types.CodeType):
+            _code_names(const, names)
+    return names
+
+
+def function_fingerprint(function: Any, seen: FrozenSet[int] = frozenset()) -> str:
+    """
+    Fingerprint of mapper, reducer or folder: its qualified name, hash of its source and values
+    it depends on (bound arguments of partial, defaults, closure variables and values of global names it reads,
+    attributes of modules too). Functions of libraries are identified by names, callables and values
+    that cannot be fingerprinted get fingerprint of _opaque, so results that depend on them are not cached
+    """
+    if id(function) in seen:
+        return getattr(function, "__qualname__", repr(type(function)))
+    seen = seen | {id(function)}
+    if inspect.ismethod(function):
+        return "method({}, {})".format(function_fingerprint(function.__func__, seen),
+                                       _normalize(function.__self__, seen))
+    if isinstance(function, functools.partial):
+        return "partial({}, {}, {})".format(function_fingerprint(function.func, seen),
+                                            _normalize(function.args, seen), _normalize(function.keywords, seen))
+    code = getattr(function, "__code__", None)
+    if code is None:
+        # callable object or builtin
+        call = getattr(type(function), "__call__", None)
+        state = _state(function)
+        if state is None or getattr(call, "__code__", None) is None:
+            return _opaque(function)
+        return "{}.{}({}, {})".format(type(function).__module__, type(function).__qualname__,
+                                      function_fingerprint(call, seen), _normalize(state, seen))
+    if _is_library(function.__module__):
+        return "{}.{}".format(function.__module__, function.__qualname__)
+    closure = []
+    for cell in function.__closure__ or ():
+        try:
+            closure.append(cell.cell_contents)
+        except ValueError:
+            # empty cell
+            closure.append(None)
+    names = _code_names(code)
+    referenced = {}
+    for name in sorted(names):
+        if name not in function.__globals__:
+            continue
+        value = referenced[name] = function.__globals__[name]
+        if isinstance(value, types.ModuleType) and not _is_library(value.__name__):
+            for attribute in sorted(names):
+                if attribute in vars(value):
+                    referenced["{}.{}".format(name, attribute)] = vars(value)[attribute]
+    return "{}.{}:{}:{}:{}:{}".format(function.__module__, function.__qualname__, _code_fingerprint(code),
+                                      _normalize(function.__defaults__, seen), _normalize(closure, seen),
+                                      _normalize(referenced, seen))
+
+
+def _opaque(value: Any) -> str:
+    # builtins and callables like itemgetter are identified by repr, other objects only by identity. Identity
+    # is valid only in one process, so fingerprint is marked and results that depend on it are not cached
+    if isinstance(value, types.BuiltinFunctionType) and isinstance(value.__self__, (type, types.ModuleType)):
+        # like object.__new__ or math.sqrt
+        owner = value.__self__
+        return "{}.{}".format(getattr(owner, "__qualname__", owner.__name__), value.__name__)
+    if isinstance(value, (types.BuiltinFunctionType, operator.itemgetter, operator.attrgetter,
+                          operator.methodcaller)) and "0x" not in repr(value):
+        return repr(value)
+    return "{}{}.{}@{}".format(_OPAQUE, type(value).__module__, type(value).__qualname__, id(value))
+
+
+def _state(value: Any) -> Optional[Dict[str, Any]]:
+    # attributes of object of class defined in python, None if object may keep state elsewhere
+    state = {}
+    for cls in type(value).__mro__[:-1]:
+        attributes = vars(cls)
+        if "__dict__" not in attributes and "__slots__" not in attributes:
+            return None
+        slots = attributes.get("__slots__", ())
+        for slot in (slots,) if isinstance(slots, str) else slots:
+            if slot not in ("__dict__", "__weakref__") and hasattr(value, slot):
+                state[slot] = getattr(value, slot)
+    state.update(getattr(value, "__dict__", {}))
+    return state
+
+
+def _class_fingerprint(cls: type, seen: FrozenSet[int]) -> str:
+    name = "{}.{}".format(cls.__module__, cls.__qualname__)
+    if _is_library(cls.__module__) or id(cls) in seen:
+        return name
+    seen = seen | {id(cls)}
+    members = {}
+    for attribute, value in vars(cls).items():
+        if isinstance(value, (staticmethod, classmethod)):
+            value = value.__func__
+        elif isinstance(value, property):
+            value = (value.fget, value.fset, value.fdel)
+        elif (attribute.startswith("__") and not isinstance(value, types.FunctionType)) or attribute == "_abc_impl":
+            # __dict__, __module__, __doc__ and similar, cache of abc
+            continue
+        elif hasattr(type(value), "__get__") and not isinstance(value, types.FunctionType):
+            # descriptors of slots and fields of namedtuple
+            value = type(value)
+        members[attribute] = value
+    return "{}({}, {})".format(name, [_class_fingerprint(base, seen) for base in cls.__bases__],
+                               _normalize(members, seen))
+
+
+def _buffer_fingerprint(value: Any) -> Optional[str]:
+    # arrays (numpy arrays too) and other buffers are identified by their content
+    try:
+        view = memoryview(value)
+    except TypeError:
+        return None
+    with view:
+        if "O" in view.format:
+            # buffer of pointers to objects
+            return None
+        data = view if view.c_contiguous else view.tobytes()
+        return "{}.{}({}, {}, {})".format(type(value).__module__, type(value).__qualname__, view.format, view.shape,
+                                          hashlib.sha256(data).hexdigest())
+
+
+def _normalize(value: Any, seen: FrozenSet[int] = frozenset()) -> str:
+    if type(value) in _PLAIN_TYPES:
+        return repr(value)
+    if isinstance(value, type):
+        return _class_fingerprint(value, seen)
+    if isinstance(value, types.ModuleType):
+        return "module {}".format(value.__name__)
+    if isinstance(value, enum.Enum):
+        return "{}.{}.{}".format(type(value).__module__, type(value).__qualname__, value.name)
+    if callable(value):
+        return function_fingerprint(value, seen)
+    if id(value) in seen:
+        return _opaque(value)
+    seen = seen | {id(value)}
+    if isinstance(value, dict):
+        items = sorted((_normalize(key, seen), _normalize(item, seen)) for key, item in value.items())
+        return type(value).__name__ + "{" + ", ".join("{}: {}".format(key, item) for key, item in items) + "}"
+    if isinstance(value, (list, tuple)):
+        return type(value).__name__ + "[" + ", ".join(_normalize(item, seen) for item in value) + "]"
+    if isinstance(value, (set, frozenset)):
+        return type(value).__name__ + "{" + ", ".join(sorted(_normalize(item, seen) for item in value)) + "}"
+    if isinstance(value, re.Pattern):
+        return "re.compile({!r}, {})".format(value.pattern, value.flags)
+    fingerprint = _buffer_fingerprint(value)
+    if fingerprint is not None:
+        return fingerprint
+    if type(value).__repr__ is object.__repr__ or dataclasses.is_dataclass(value):
+        # object is identified by its type and attributes
+        state = _state(value)
+        if state is not None:
+            return "{}({})".format(_class_fingerprint(type(value), seen), _normalize(state, seen))
+    # repr of other objects may omit their state
+    return _opaque(value)
+
+
+def plan_fingerprint(queue: List[Dict], input_fingerprints: Iterable[str]) -> Optional[str]:
+    """
+    Fingerprint of result of operations of ComputeGraph over inputs with given fingerprints
+    :param queue: operations of ComputeGraph
+    :param input_fingerprints: fingerprints of inputs of ComputeGraph
+    :return: hex string, None if some function or value of operations cannot be fingerprinted
+    """
+    digest = hashlib.sha256()
+    for fingerprint in input_fingerprints:
+        digest.update(fingerprint.encode())
+        digest.update(b"\0")
+    for vertex in queue:
+        normalized = _normalize(vertex)
+        if _OPAQUE in normalized:
+            return None
+        digest.update(normalized.encode())
+        digest.update(b"\0")
+    return digest.hexdigest()[:32]
+
+
+class ResultCache(object):
+    """
+    Persistent cache of results of ComputeGraph nodes in directory. Result is stored under fingerprint
+    of operations of node and of its inputs, so node is not computed again while its operations, functions
+    (with values they read) and inputs are not changed. Only inputs that have fingerprint() (for example files
+    from compgraph.readers) may be cached, and nodes whose functions read objects that cannot be fingerprinted
+    (their repr may omit their state) are always computed. When total size exceeds max_bytes, least recently used
+    results are removed
+    """
+    def __init__(self, directory: str, max_bytes: Optional[int] = None, compress: bool = False):
+        """
+        :param directory: directory of cache, created if it does not exist
+        :param max_bytes: maximum total size of cached results, None for unlimited
+        :param compress: bool True if results should be compressed
+        """
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self._runs = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, fingerprint: str) -> str:
+        return os.path.join(self.directory, fingerprint + SUFFIX)
+
+    def __contains__(self, fingerprint: str) -> bool:
+        return os.path.exists(self._path(fingerprint))
+
+    def touch(self, fingerprint: str) -> bool:
+        """
+        Marks cached result as recently used
+        :return: bool True if result is cached
+        """
+        try:
+            os.utime(self._path(fingerprint))
+        except FileNotFoundError:
+            return False
+        return True
+
+    def read(self, fingerprint: str) -> Iterator[Any]:
+        """
+        Reads cached result and marks it as recently used. File is opened at once, so FileNotFoundError is raised
+        by this call if result is not cached
+        """
+        path = self._path(fingerprint)
+        os.utime(path)
+        return self._read(open(path, "rb"))
+
+    @staticmethod
+    def _read(file) -> Iterator[Any]:
+        with file:
+            reader = BlockReader(file)
+            try:
+                yield from reader
+            finally:
+                reader.close()
+
+    def suspend_eviction(self) -> None:
+        """
+        Marks start of run, results written during runs are evicted only when the last run finishes,
+        so run does not remove results that it is going to read
+        """
+        self._runs += 1
+
+    def resume_eviction(self) -> None:
+        """
+        Marks end of run started by suspend_eviction
+        """
+        self._runs -= 1
+        if self._runs <= 0:
+            self._runs = 0
+            self.evict()
+
+    def write(self, fingerprint: str, rows: Iterable[Any]) -> Iterator[Any]:
+        """
+        Passes table through and stores it. Result is stored only if table is read to the end
+        """
+        descriptor, temporary = tempfile.mkstemp(dir=self.directory, suffix=".tmp")
+        finished = False
+        try:
+            with os.fdopen(descriptor, "wb") as file:
+                writer = BlockWriter(file, compress=self.compress)
+                for row in rows:
+                    writer.write(row)
+                    yield row
+                writer.close()
+            os.replace(temporary, self._path(fingerprint))
+            finished = True
+        finally:
+            if not finished and os.path.exists(temporary):
+                os.remove(temporary)
+        if self._runs == 0:
+            self.evict()
+
+    def entries(self) -> List[Tuple[str, int, float]]:
+        """
+        :return: fingerprint, size in bytes and time of last use of every cached result, least recently used first
+        """
+        result = []
+        for name in os.listdir(self.directory):
+            if name.endswith(SUFFIX):
+                stat = os.stat(os.path.join(self.directory, name))
+                result.append((name[:-len(SUFFIX)], stat.st_size, stat.st_mtime))
+        return sorted(result, key=lambda entry: entry[2])
+
+    def evict(self) -> None:
+        """
+        Removes least recently used results until total size is at most max_bytes
+        """
+        if self.max_bytes is None:
+            return
+        entries = self.entries()
+        total = sum(size for _, size, _ in entries)
+        for fingerprint, size, _ in entries:
+            if total <= self.max_bytes:
+                break
+            self.invalidate(fingerprint)
+            total -= size
+
+    def invalidate(self, fingerprint: Optional[str] = None) -> None:
+        """
+        Removes cached result
+        :param fingerprint: fingerprint of result, None to clear whole cache
+        """
+        fingerprints = [fingerprint] if fingerprint is not None else [entry[0] for entry in self.entries()]
+        for fingerprint in fingerprints:
+            path = self._path(fingerprint)
+            if os.path.exists(path):
+                os.remove(path)
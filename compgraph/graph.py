@@ -1,205 +1,390 @@
-import itertools
-from operator import itemgetter
-from typing import Iterable, Tuple, Dict, List, Callable, Union
+import functools
+import types
+from typing import Iterable, Iterator, Dict, List, Callable, Union, Optional, Tuple
 
+from compgraph.batch import AGGREGATIONS, DEFAULT_BATCH_SIZE, require_numpy
+from compgraph.cache import plan_fingerprint, ResultCache
+from compgraph.optimizer import optimize
+from compgraph.parallel import DEFAULT_CHUNK_SIZE
+from compgraph.plan import compile_plan
+from compgraph.profiling import Observer, ProfileReport
+from compgraph.readers import FileInput
+from compgraph.sinks import Sink
+from compgraph.store import MaterializationStore
 
-def join_dicts(product: Iterable[Tuple[Dict, Dict]], keys: Iterable[str]) -> Iterable[Dict]:
-    for left, right in product:
-        result = dict(left)
-        for right_key in right:
-            if right_key not in left:
-                result[right_key] = right[right_key]
-            elif right_key not in keys:
-                raise KeyError("Same keys in left and right table beyond join keys")
-        yield result
+
+class RunContext(object):
+    def __init__(self, parallelism=None, store=None, observer=None, cache=None):
+        self.parallelism = parallelism
+        self.store = store or MaterializationStore()
+        self.observer = observer
+        self.cache = cache
 
 
 class ComputationalNode(object):
-    def __init__(self, operation_stack, inputs):
-        self._queue = operation_stack
+    def __init__(self, pipeline, inputs, context=None, graph=0):
+        self._pipeline = pipeline
         self._inputs = inputs
+        self._context = context or RunContext()
+        self._graph = graph
 
     def _compute(self):
-        cur_generator = self._inputs[0]._compute()
-        for operation in self._queue:
-            cur_generator = self._do_operation(operation, cur_generator)
-        yield from cur_generator
-
-    def _do_operation(self, operation, generator):
-        if operation["type"] == "map":
-            return self._run_map(operation["mapper"], generator)
-        elif operation["type"] == "reduce":
-            return self._run_reduce(operation["reducer"], operation["keys"], generator)
-        elif operation["type"] == "sort":
-            return self._run_sort(operation["keys"], generator, operation["reverse"])
-        elif operation['type'] == "fold":
-            return self._run_fold(operation["folder"], generator)
-        elif operation["type"] == "join":
-            return self._run_join(operation["index"], operation["keys"], operation["join_type"], generator)
-        else:
-            return generator
-
-    def _run_join(self, index, keys, join_type, generator):
-        key_func = itemgetter(*keys) if keys else lambda x: ()
-        left = itertools.groupby(sorted(self._inputs[index]._compute(), key=key_func), key=key_func)
-        right = itertools.groupby(sorted(generator, key=key_func), key=key_func)
-        default_value = (None, None)
-        key_left, group_left = next(left, default_value)
-        key_right, group_right = next(right, default_value)
-        while group_left is not None and group_right is not None:
-            if key_left == key_right:
-                yield from join_dicts(itertools.product(group_left, group_right), keys)
-                key_left, group_left = next(left, default_value)
-                key_right, group_right = next(right, default_value)
-            elif key_left < key_right:
-                if join_type == "left" or join_type == "outer":
-                    yield from group_left
-                key_left, group_left = next(left, default_value)
-            else:
-                if join_type == "right" or join_type == "outer":
-                    yield from group_right
-                key_right, group_right = next(right, default_value)
-
-        while group_left is not None and (join_type == "outer" or join_type == "left"):
-            yield from group_left
-            key_left, group_left = next(left, default_value)
-
-        while group_right is not None and (join_type == "outer" or join_type == "right"):
-            yield from group_right
-            key_right, group_right = next(right, default_value)
-
-    def _run_reduce(self, reducer, keys, generator):
-        for key, group in itertools.groupby(generator, itemgetter(*keys)):
-            yield from reducer(group)
-
-    def _run_map(self, mapper, generator):
-        for line in generator:
-            yield from mapper(line)
-
-    def _run_fold(self, folder, generator):
-        state = None
-        for line in generator:
-            state = folder(state, line)
-        yield state
-
-    def _run_sort(self, keys, generator, reverse):
-        generator = list(generator)
-        yield from sorted(generator, key=itemgetter(*keys), reverse=reverse)
+        yield from self._pipeline(self._inputs[0]._compute(), self._inputs, self._context, self._graph)
 
 
 class ComputeGraph(object):
-    def __init__(self, input):
+    def __init__(self, input, schema: Optional[Iterable[str]] = None):
+        """
+        :param input: nickname of input table or ComputeGraph
+        :param schema: columns of input table. If given, lines are stored as compact records (tuples that behave
+        as read-only dicts), sort, reduce and join use positions of keys instead of lookups by name
+        """
         self._inputs = [input]
         self._queue = [{"type": "input",
                         "input_index": 0}]
+        if schema is not None:
+            self._queue.append({"type": "schema",
+                                "columns": tuple(schema)})
         self._kwargs = None
         self._inputs_used = None
-        self.times_used = 0
-        self.saved = None
-        self.processed_inputs = None
-
-    def _go_deeper(self, inputs_used):
-        self.processed_inputs = []
-        for i in range(len(self._inputs)):
-            if isinstance(self._inputs[i], ComputeGraph):
-                self._inputs[i]._go_deeper(inputs_used)
-                self.processed_inputs.append(self._inputs[i])
-            elif isinstance(self._inputs[i], str):
-                self.processed_inputs.append(inputs_used[self._inputs[i]])
-            self.processed_inputs[-1].times_used += 1
-
-    def run(self, **kwargs: Iterable[Dict]) -> List[Dict]:
+        self._compiled = None
+
+    def run(self, parallelism: Optional[int] = None, store: Optional[MaterializationStore] = None,
+            profile: bool = False, observer: Optional[Observer] = None, cache: Optional[ResultCache] = None,
+            **kwargs: Iterable[Dict]) -> Union[List[Dict], Tuple[List[Dict], ProfileReport]]:
         """
         Computes ComputeGraph over inputs.
+        :param parallelism: number of processes for sort followed by reduce on same keys. Table is partitioned
+        by hash of reduce keys and each partition is sorted and reduced in separate process, result is same
+        as of computation in current process. Reducers should be picklable then. Top of whole table and folds
+        with merge are computed by chunks in processes too
+        :param store: MaterializationStore for inputs and subgraphs that are used several times,
+        by default they are kept in memory
+        :param profile: bool True if every operator should be measured, then pair of result table
+        and ProfileReport is returned
+        :param observer: Observer that collects statistics of operators
+        :param cache: ResultCache, results of ComputeGraph and its subgraphs are read from it if their operations
+        and inputs are not changed and are stored to it otherwise. Only inputs with fingerprint()
+        (files from compgraph.readers) are considered unchanged
         :param kwargs: inputs of ComputeGraph. All nicknames should be resolved
         :return: list - result table
         """
-        inputs_used = {key: Opener(value) for key, value in kwargs.items()}
-        self._go_deeper(inputs_used)
-        return list(self._compute())
+        if profile and observer is None:
+            observer = Observer()
+        result = list(self.iter_run(parallelism, store, observer, cache, **kwargs))
+        return (result, observer.report()) if profile else result
 
-    def _compute(self):
-        if self.saved is None:
-            node = ComputationalNode(self._queue, self.processed_inputs)
-            cur_generator = node._compute()
-            if self.times_used > 1:
-                self.saved = list(cur_generator)
-                yield from self.saved
-            else:
-                yield from cur_generator
-        else:
-            self.times_used -= 1
-            result = self.saved
-            if self.times_used == 0:
-                del self.saved
-            yield from result
+    def iter_run(self, parallelism: Optional[int] = None, store: Optional[MaterializationStore] = None,
+                 observer: Optional[Observer] = None, cache: Optional[ResultCache] = None,
+                 **kwargs: Iterable[Dict]) -> Iterator[Dict]:
+        """
+        Computes ComputeGraph over inputs lazily, lines of result table are computed as they are read
+        :param parallelism: same as in run
+        :param store: same as in run
+        :param observer: same as in run
+        :param cache: same as in run
+        :param kwargs: inputs of ComputeGraph. All nicknames should be resolved
+        :return: iterator over result table
+        """
+        return Schedule([self], kwargs, RunContext(parallelism, store, observer, cache)).run()
+
+    def run_to(self, sink: Sink, parallelism: Optional[int] = None, store: Optional[MaterializationStore] = None,
+               observer: Optional[Observer] = None, cache: Optional[ResultCache] = None,
+               **kwargs: Iterable[Dict]) -> int:
+        """
+        Computes ComputeGraph over inputs and passes result table to sink without keeping it in memory
+        :param sink: Sink, for example JsonLinesSink or CallbackSink
+        :param parallelism: same as in run
+        :param store: same as in run
+        :param observer: same as in run
+        :param cache: same as in run
+        :param kwargs: inputs of ComputeGraph. All nicknames should be resolved
+        :return: number of lines in result table
+        """
+        return sink.consume(self.iter_run(parallelism, store, observer, cache, **kwargs))
+
+    def _plan_key(self):
+        return (len(self._queue),) + tuple(graph._plan_key() if isinstance(graph, ComputeGraph) else None
+                                           for graph in self._inputs)
+
+    def _plan(self):
+        compiled = [graph._compile() if isinstance(graph, ComputeGraph) else (None, None, None)
+                    for graph in self._inputs]
+        return optimize(self._queue, [ordering for _, ordering, _ in compiled], [schema for _, _, schema in compiled])
+
+    def _compile(self):
+        key = self._plan_key()
+        if self._compiled is None or self._compiled[0] != key:
+            queue, ordering, schema = self._plan()
+            self._compiled = (key, compile_plan(queue), ordering, schema)
+        return self._compiled[1:]
 
-    def map(self, mapper: Callable[[Dict], Iterable[Dict]]) -> "ComputeGraph":
+    def map(self, mapper: Callable[[Dict], Iterable[Dict]], workers: Optional[int] = None, ordered: bool = True,
+            chunk_size: int = DEFAULT_CHUNK_SIZE, schema: Optional[Iterable[str]] = None) -> "ComputeGraph":
         """
         Method of ComputeGraph that add map operation to computational graph. Apply mapper to every line in table
         :param mapper: generator that takes one line from table and returns
         form 1 to any number of lines of result table
+        :param workers: number of processes that apply mapper, None to apply it in current process.
+        Mapper and lines should be picklable then
+        :param ordered: bool True if result of parallel map should keep order of table
+        :param chunk_size: number of lines sent to process at once
+        :param schema: columns of lines returned by mapper, if given they are stored as compact records
         :return: ComputeGraph
         """
         vertex = {"type": "map",
-                  "mapper": mapper}
+                  "mapper": mapper,
+                  "workers": workers,
+                  "ordered": ordered,
+                  "chunk_size": chunk_size}
         self._queue.append(vertex)
+        if schema is not None:
+            self._queue.append({"type": "schema",
+                                "columns": tuple(schema)})
         return self
 
-    def reduce(self, reducer: Callable[[Iterable[Dict]], Iterable[Dict]], keys: Iterable[str]) -> "ComputeGraph":
+    def reduce(self, reducer: Callable[[Iterable[Dict]], Iterable[Dict]], keys: Iterable[str],
+               presorted: bool = True, max_rows: Optional[int] = None,
+               max_bytes: Optional[int] = None,
+               combiner: Optional[Callable[[Iterable[Dict]], Iterable[Dict]]] = None,
+               preserves_keys: bool = False) -> "ComputeGraph":
         """
         Method of ComputeGraph that add reduce operation to computational graph. Apply reducer to every subtable
         with same keys
         :param reducer: generator that takes lines from table with sames keys and returns
         form 1 to any number of lines of result table
         :param keys: tuple of strings
+        :param presorted: bool True if table is sorted by keys. Otherwise lines are grouped by hash table,
+        groups come in order of first appearance of keys while it fits in memory and in unspecified order
+        when it is partitioned to temporary files
+        :param max_rows: maximum number of lines kept in memory by hash grouping, None for unlimited
+        :param max_bytes: approximate maximum number of bytes kept in memory by hash grouping, None for unlimited
+        :param combiner: generator like reducer that partially aggregates lines with same keys and returns lines
+        that reducer accepts. It is applied to batches of COMBINE_BATCH_SIZE lines before sorts that precede reduce,
+        so reducer should be associative
+        :param preserves_keys: bool True if reducer returns lines with same keys as it takes, then order of presorted
+        table by keys is known after reduce and following sorts by them are dropped
         :return: ComputeGraph
         """
         if isinstance(keys, str):
             keys = [keys]
+        if combiner is not None:
+            position = len(self._queue)
+            while self._queue[position - 1]["type"] == "sort":
+                position -= 1
+            self._queue.insert(position, {"type": "combine",
+                                          "combiner": combiner,
+                                          "keys": keys})
         vertex = {"type": "reduce",
                   "reducer": reducer,
-                  "keys": keys}
+                  "keys": keys,
+                  "presorted": presorted,
+                  "max_rows": max_rows,
+                  "max_bytes": max_bytes,
+                  "preserves_keys": preserves_keys}
         self._queue.append(vertex)
         return self
 
-    def sort(self, *keys: Union[str, Iterable[str]], reverse: bool = False) -> "ComputeGraph":
+    def sort(self, *keys: Union[str, Iterable[str]], reverse: bool = False,
+             max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> "ComputeGraph":
         """
-        Method of ComputeGraph that sort table by keys
+        Method of ComputeGraph that sort table by keys. If memory budget is given, sorted runs are spilled
+        to temporary files and merged back, so table may be bigger than memory
         :param keys: any number of strings
         :param reverse: bool True if result table should be reversed
+        :param max_rows: maximum number of lines kept in memory, None for unlimited
+        :param max_bytes: approximate maximum number of bytes kept in memory, None for unlimited
         :return: ComputeGraph
         """
         if len(keys) == 1 and not isinstance(keys[0], str):
             keys = keys[0]
         vertex = {"type": "sort",
                   "keys": keys,
-                  "reverse": reverse}
+                  "reverse": reverse,
+                  "max_rows": max_rows,
+                  "max_bytes": max_bytes,
+                  "presorted_keys": ()}
         self._queue.append(vertex)
         return self
 
-    def fold(self, folder: Callable[[Union[Dict, None], Dict], Dict]) -> "ComputeGraph":
+    def fold(self, folder: Callable[[Union[Dict, None], Dict], Dict],
+             merge: Optional[Callable[[Dict, Dict], Dict]] = None, initial: Optional[Dict] = None,
+             chunk_size: int = DEFAULT_CHUNK_SIZE) -> "ComputeGraph":
         """
         Method of ComputeGraph that add fold operation to ComputeGraph. Apply folder function to each line in table
-        :param folder:
+        :param folder: function that takes state (initial for first line) and line and returns state
+        :param merge: function that takes states of two adjacent parts of table and returns state of both of them.
+        If given and run is parallel, chunks of table are folded in pool of processes and their states are merged
+        by tree of merges. Folder and lines should be picklable then
+        :param initial: state before first line, it is copied for every run and every chunk
+        :param chunk_size: number of lines sent to process at once
         :return: ComputeGraph
         """
         vertex = {"type": "fold",
-                  "folder": folder}
+                  "folder": folder,
+                  "merge": merge,
+                  "initial": initial,
+                  "chunk_size": chunk_size}
+        self._queue.append(vertex)
+        return self
+
+    def top_k(self, k: int, by: Union[str, Iterable[str]], keys: Union[str, Iterable[str]] = (),
+              reverse: bool = False) -> "ComputeGraph":
+        """
+        Method of ComputeGraph that keeps k first lines of table sorted by columns by, same as sort followed
+        by taking first lines, but only k lines are kept in memory. With keys, k first lines are kept
+        for every group of lines with same keys, groups keep order of table
+        :param k: number of lines
+        :param by: string or tuple of strings
+        :param keys: string or tuple of strings, empty for whole table
+        :param reverse: bool True if k last lines should be kept, in reversed order
+        :return: ComputeGraph
+        """
+        if isinstance(by, str):
+            by = [by]
+        if isinstance(keys, str):
+            keys = [keys]
+        vertex = {"type": "top_k",
+                  "k": k,
+                  "by": tuple(by),
+                  "keys": tuple(keys),
+                  "reverse": reverse,
+                  "presorted": False}
+        self._queue.append(vertex)
+        return self
+
+    def limit(self, n: int) -> "ComputeGraph":
+        """
+        Method of ComputeGraph that keeps n first lines of table. Sort followed by limit is computed as top_k
+        :param n: number of lines
+        :return: ComputeGraph
+        """
+        vertex = {"type": "limit",
+                  "n": n}
+        self._queue.append(vertex)
+        return self
+
+    def filter(self, predicate: Callable[[Dict], bool],
+               columns: Union[str, Iterable[str], None] = None) -> "ComputeGraph":
+        """
+        Method of ComputeGraph that keeps lines for which predicate is true. Filter is moved before sorts,
+        before reduces and top_k by keys that contain its columns and before joins by keys that contain
+        its columns (then lines of both tables are filtered), and is fused with adjacent maps
+        :param predicate: function that takes line and returns bool
+        :param columns: string or tuple of strings that predicate reads, None if they are unknown
+        (then filter is moved only before sorts)
+        :return: ComputeGraph
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        vertex = {"type": "filter",
+                  "predicate": predicate,
+                  "columns": tuple(columns) if columns is not None else None}
+        self._queue.append(vertex)
+        return self
+
+    def project(self, columns: Union[str, Iterable[str]]) -> "ComputeGraph":
+        """
+        Method of ComputeGraph that keeps only given columns of lines. Other columns are dropped as early
+        as possible: projection is moved before sorts, filters and top_k that read only its columns, and lines
+        of both tables of join are projected on its columns and join keys
+        :param columns: string or tuple of strings
+        :return: ComputeGraph
+        """
+        if isinstance(columns, str):
+            columns = [columns]
+        vertex = {"type": "project",
+                  "columns": tuple(columns),
+                  "strict": True}
+        self._queue.append(vertex)
+        return self
+
+    def map_batch(self, mapper: Callable[[Dict], Dict], batch_size: int = DEFAULT_BATCH_SIZE) -> "ComputeGraph":
+        """
+        Method of ComputeGraph that add vectorized map operation. Lines are converted to batches -
+        dicts of numpy arrays of batch_size lines, and back after batch operations. Requires numpy
+        :param mapper: function that takes batch and returns batch
+        :param batch_size: number of lines in batch
+        :return: ComputeGraph
+        """
+        require_numpy()
+        vertex = {"type": "map_batch",
+                  "mapper": mapper,
+                  "batch_size": batch_size}
+        self._queue.append(vertex)
+        return self
+
+    def fold_batch(self, folder: Callable[[Union[Dict, None], Dict], Dict],
+                   batch_size: int = DEFAULT_BATCH_SIZE) -> "ComputeGraph":
+        """
+        Method of ComputeGraph that add vectorized fold operation. Apply folder to each batch of table. Requires numpy
+        :param folder: function that takes state (None for first batch) and batch and returns state
+        :param batch_size: number of lines in batch
+        :return: ComputeGraph
+        """
+        require_numpy()
+        vertex = {"type": "fold_batch",
+                  "folder": folder,
+                  "batch_size": batch_size}
+        self._queue.append(vertex)
+        return self
+
+    def aggregate(self, keys: Union[str, Iterable[str]], aggregations: Dict[str, Tuple[str, str]],
+                  batch_size: int = DEFAULT_BATCH_SIZE) -> "ComputeGraph":
+        """
+        Method of ComputeGraph that add vectorized grouped aggregation. Table need not be sorted,
+        result has one line per group and is sorted by keys. Requires numpy
+        :param keys: string or tuple of strings
+        :param aggregations: dict from result column to pair of column and function,
+        one of "sum", "count", "mean", "min", "max"
+        :param batch_size: number of lines in batch
+        :return: ComputeGraph
+        """
+        require_numpy()
+        if isinstance(keys, str):
+            keys = [keys]
+        for column, function in aggregations.values():
+            if function not in AGGREGATIONS:
+                raise ValueError("Unknown aggregation {}".format(function))
+        vertex = {"type": "aggregate",
+                  "keys": keys,
+                  "aggregations": dict(aggregations),
+                  "batch_size": batch_size}
         self._queue.append(vertex)
         return self
 
     def join(self, other_input: Union[Iterable[Dict], "ComputeGraph"],
              keys: Union[Iterable[str], str, None] = None,
-             type: str = "inner") -> "ComputeGraph":
+             type: str = "inner", strategy: str = "merge", build_side: Optional[str] = None,
+             bloom_filter: bool = False, max_rows: Optional[int] = None,
+             max_bytes: Optional[int] = None) -> "ComputeGraph":
         """
         Method of ComputeGraph that do join of current table and other table or input
         :param other_input: other ComputeGraph or str (nickname of input).
         If str is given, it should be resolved in run method
         :param keys: string of tuple of strings on which do join
         :param type: type of join "inner", "left", "right", "outer"
+        :param strategy: "merge" - sort both tables and merge them, result is sorted by keys,
+        "hash" - build hash table on one table and stream other one through it, result keeps order of streamed table,
+        "auto" - hash if one of tables is not longer than HASH_JOIN_MAX_ROWS lines, merge otherwise,
+        "broadcast" - hash with other_input as build side by default, for small tables like results of fold.
+        Join by empty keys never sorts tables: smaller one (or build_side) is kept in memory and every line
+        of other one is joined with it as it is read. Lines are paired in same order as by merge join (every line
+        of other_input with every line of current table), so current table is buffered when other_input is smaller
+        :param build_side: table for hash table "left" (other_input) or "right" (current table),
+        None to choose smaller one
+        :param bloom_filter: bool True if before merge join keys of smaller table should be collected (into Bloom
+        filter if there are more than SEMI_JOIN_MAX_EXACT_KEYS of them) and lines of bigger table that have no pair
+        should be dropped before sorting. Table that keeps lines without pair (left table of left join, right table
+        of right join) is not filtered, outer join is not filtered
+        :param max_rows: maximum number of lines kept in memory by sorts of merge join, None for unlimited
+        :param max_bytes: approximate maximum number of bytes kept in memory by sorts of merge join, None for unlimited
         :return: ComputeGraph
         """
+        if strategy not in ("merge", "hash", "auto", "broadcast"):
+            raise ValueError("Unknown join strategy {}".format(strategy))
+        if strategy == "broadcast" and build_side is None:
+            build_side = "left"
         if isinstance(keys, str):
             keys = (keys, )
         if not keys:
@@ -207,28 +392,300 @@ class ComputeGraph(object):
         vertex = {"type": "join",
                   "index": len(self._inputs),
                   "keys": keys,
-                  "join_type": type}
+                  "join_type": type,
+                  "strategy": strategy,
+                  "build_side": build_side,
+                  "left_presorted_keys": (),
+                  "right_presorted_keys": (),
+                  "left_filters": (),
+                  "left_columns": None,
+                  "bloom_filter": bloom_filter,
+                  "max_rows": max_rows,
+                  "max_bytes": max_bytes}
         self._queue.append(vertex)
         self._inputs.append(other_input)
         return self
 
 
-class Opener(object):
-    def __init__(self, input):
-        self.iterator = input
-        self.times_used = 0
-        self.saved = None
+class ScheduledNode(object):
+    """
+    Input table or ComputeGraph in one run. It is computed once and its table is streamed to every consumer
+    """
+    def __init__(self, source, inputs, context):
+        self.source = source
+        self.inputs = inputs
+        self.consumers = 0
+        self.fingerprint = None
+        self.cached = False
+        self.reread = False
+        self._context = context
+        self._shared = None
+
+    def _own_fingerprint(self):
+        if isinstance(self.source, ComputeGraph):
+            inputs = [node.fingerprint for node in self.inputs]
+            return None if None in inputs else plan_fingerprint(self.source._queue, inputs)
+        fingerprint = getattr(self.source, "fingerprint", None)
+        return fingerprint() if callable(fingerprint) else None
+
+    def _rows(self):
+        graph = self.source
+        if not isinstance(graph, ComputeGraph):
+            return iter(graph)
+        cache = self._context.cache
+        if self.cached:
+            try:
+                return cache.read(self.fingerprint)
+            except FileNotFoundError:
+                # result was removed after run was scheduled, it is computed again
+                self.cached = False
+        observer = self._context.observer
+        if observer is None:
+            pipeline, _, _ = graph._compile()
+            node = ComputationalNode(pipeline, self.inputs, self._context)
+        else:
+            # observed runs measure user functions, so plan is compiled separately and not cached
+            pipeline = compile_plan(graph._plan()[0], measure_user_functions=True)
+            node = ComputationalNode(pipeline, self.inputs, self._context, observer.graph_index(graph))
+        if self.fingerprint is None:
+            return node._compute()
+        return cache.write(self.fingerprint, node._compute())
 
     def _compute(self):
-        if self.saved is None:
-            if self.times_used > 1:
-                self.saved = list(self.iterator)
-                yield from self.saved
+        # every call opens table for one consumer
+        if self.consumers <= 1 or self.reread:
+            return self._rows()
+        if self._shared is None:
+            self._shared = self._context.store.share(self._rows(), self.consumers)
+        return self._shared.read()
+
+    def release(self):
+        if self._shared is not None:
+            self._shared.release()
+
+
+class Schedule(object):
+    """
+    DAG of one run of ComputeGraphs: graphs, their subgraphs and inputs in topological order. Every node is computed
+    once, table of node with several consumers is streamed to all of them through store and released after the last one,
+    subgraphs with cached results are read from cache and their inputs are not computed
+    """
+    def __init__(self, graphs, inputs, context, share_files=False):
+        """
+        :param graphs: list of ComputeGraph
+        :param inputs: dict from nickname to input table
+        :param context: RunContext
+        :param share_files: bool True if files are read once and streamed to all consumers, otherwise every consumer
+        reads file again
+        """
+        self._inputs = inputs
+        self._context = context
+        self._share_files = share_files
+        self._nodes = {}
+        self.order = []
+        self.roots = [self._node(graph) for graph in graphs]
+        self._count_consumers()
+
+    def _node(self, source):
+        key = id(source) if isinstance(source, ComputeGraph) else ("input", source)
+        if key not in self._nodes:
+            if isinstance(source, ComputeGraph):
+                node = ScheduledNode(source, [self._node(graph) for graph in source._inputs], self._context)
             else:
-                yield from self.iterator
-        else:
-            self.times_used -= 1
-            result = self.saved
-            if self.times_used == 0:
-                del self.saved
-            yield from result
+                table = self._inputs[source]
+                node = ScheduledNode(table, [], self._context)
+                node.reread = isinstance(table, (list, tuple)) or \
+                    (isinstance(table, FileInput) and not self._share_files)
+            self._nodes[key] = node
+            # inputs of node are added before it
+            self.order.append(node)
+        return self._nodes[key]
+
+    def _count_consumers(self):
+        cache = self._context.cache
+        if cache is not None:
+            for node in self.order:
+                node.fingerprint = node._own_fingerprint()
+                node.cached = isinstance(node.source, ComputeGraph) and node.fingerprint is not None \
+                    and cache.touch(node.fingerprint)
+        for root in self.roots:
+            root.consumers += 1
+        for node in reversed(self.order):
+            if node.consumers and not node.cached:
+                for input in node.inputs:
+                    input.consumers += 1
+
+    def _start(self):
+        if self._context.cache is not None:
+            self._context.cache.suspend_eviction()
+
+    def _release(self):
+        for node in self.order:
+            node.release()
+        if self._context.cache is not None:
+            self._context.cache.resume_eviction()
+
+    def run(self):
+        """
+        :return: iterator over result of first graph
+        """
+        self._start()
+        try:
+            yield from self.roots[0]._compute()
+        finally:
+            self._release()
+
+    def run_all(self):
+        """
+        :return: list of result tables of all graphs
+        """
+        self._start()
+        try:
+            return [list(root._compute()) for root in self.roots]
+        finally:
+            self._release()
+
+
+class _Step(object):
+    # operation in prefix tree of graphs, path from root is queue of graph that ends in it
+    __slots__ = ("parent", "vertex", "other", "children", "count", "ends")
+
+    def __init__(self, parent, vertex, other):
+        self.parent = parent
+        self.vertex = vertex
+        # input of graph for root, other table for join
+        self.other = other
+        self.children = {}
+        self.count = 0
+        self.ends = 0
+
+    def is_cut(self):
+        # common prefix of several graphs ends here
+        return self.count > 1 and (self.ends > 0 or len(self.children) > 1)
+
+
+def _same_key(value, seen=frozenset()):
+    # hashable key that is equal for values that are same in this process: functions with same code, globals,
+    # defaults and closure cells, same partials and bound methods, equal hashable values, other values by identity
+    if id(value) in seen:
+        return "object", id(value)
+    seen = seen | {id(value)}
+    if isinstance(value, types.FunctionType):
+        closure = []
+        for cell in value.__closure__ or ():
+            try:
+                closure.append(_same_key(cell.cell_contents, seen))
+            except ValueError:
+                # empty cell
+                closure.append(None)
+        return ("function", value.__code__, id(value.__globals__), _same_key(value.__defaults__, seen),
+                _same_key(value.__kwdefaults__, seen), tuple(closure))
+    if isinstance(value, types.MethodType):
+        return "method", _same_key(value.__func__, seen), _same_key(value.__self__, seen)
+    if isinstance(value, functools.partial):
+        return ("partial", _same_key(value.func, seen), _same_key(value.args, seen),
+                _same_key(value.keywords, seen))
+    if isinstance(value, (list, tuple)):
+        return type(value), tuple(_same_key(item, seen) for item in value)
+    if isinstance(value, dict):
+        return type(value), tuple((_same_key(key, seen), _same_key(item, seen)) for key, item in value.items())
+    try:
+        hash(value)
+    except TypeError:
+        return "object", id(value)
+    return type(value), value
+
+
+def _graph_key(source, keys):
+    if not isinstance(source, ComputeGraph):
+        return "input", source
+    if id(source) not in keys:
+        keys[id(source)] = (_same_key(source._queue), tuple(_graph_key(graph, keys) for graph in source._inputs))
+    return keys[id(source)]
+
+
+def merge_graphs(graphs: List["ComputeGraph"]) -> List["ComputeGraph"]:
+    """
+    Merges ComputeGraphs into one DAG. Graphs with same operations (same functions and parameters) over same inputs
+    become one graph, and common prefix of operations of graphs over same input is computed by one graph that is
+    input of all of them. Functions are same if they are one object or have same code, globals, defaults
+    and closure variables; bound methods, partials and closure variables are compared by identity of objects
+    and by == of hashable values
+    :param graphs: list of ComputeGraph
+    :return: list of new ComputeGraph with same results
+    """
+    keys, roots, ends = {}, {}, {}
+
+    def insert(graph):
+        key = _graph_key(graph, keys)
+        if key in ends:
+            return
+        for other in graph._inputs:
+            if isinstance(other, ComputeGraph):
+                insert(other)
+        step = roots.setdefault(_graph_key(graph._inputs[0], keys), _Step(None, None, graph._inputs[0]))
+        step.count += 1
+        for vertex in graph._queue[1:]:
+            other = graph._inputs[vertex["index"]] if vertex["type"] == "join" else None
+            step_key = (_same_key({name: value for name, value in vertex.items() if name != "index"}),
+                        _graph_key(other, keys) if other is not None else None)
+            if step_key not in step.children:
+                step.children[step_key] = _Step(step, vertex, other)
+            step = step.children[step_key]
+            step.count += 1
+        step.ends += 1
+        ends[key] = step
+
+    merged = {}
+
+    def resolve(source):
+        return build(ends[_graph_key(source, keys)]) if isinstance(source, ComputeGraph) else source
+
+    def build(step):
+        if id(step) not in merged:
+            if step.parent is None:
+                graph = ComputeGraph(resolve(step.other))
+            else:
+                path = [step]
+                start = step.parent
+                while start.parent is not None and not start.is_cut():
+                    path.append(start)
+                    start = start.parent
+                graph = ComputeGraph(resolve(start.other) if start.parent is None else build(start))
+                for item in reversed(path):
+                    vertex = dict(item.vertex)
+                    if vertex["type"] == "join":
+                        vertex["index"] = len(graph._inputs)
+                        graph._inputs.append(resolve(item.other))
+                    graph._queue.append(vertex)
+            merged[id(step)] = graph
+        return merged[id(step)]
+
+    for graph in graphs:
+        insert(graph)
+    return [resolve(graph) for graph in graphs]
+
+
+def run_many(graphs: Dict[str, "ComputeGraph"], parallelism: Optional[int] = None,
+             store: Optional[MaterializationStore] = None, profile: bool = False, observer: Optional[Observer] = None,
+             cache: Optional[ResultCache] = None,
+             **kwargs: Iterable[Dict]) -> Union[Dict[str, List[Dict]], Tuple[Dict[str, List[Dict]], ProfileReport]]:
+    """
+    Computes several ComputeGraphs over same inputs in one run. Graphs are merged by merge_graphs, so same subgraphs
+    and common prefixes of operations are computed once, and every input is read once
+    :param graphs: dict from name to ComputeGraph
+    :param parallelism: same as in ComputeGraph.run
+    :param store: same as in ComputeGraph.run
+    :param profile: same as in ComputeGraph.run
+    :param observer: same as in ComputeGraph.run
+    :param cache: same as in ComputeGraph.run
+    :param kwargs: inputs of ComputeGraphs. All nicknames should be resolved
+    :return: dict from name to result table
+    """
+    if profile and observer is None:
+        observer = Observer()
+    names = list(graphs)
+    merged = merge_graphs([graphs[name] for name in names])
+    schedule = Schedule(merged, kwargs, RunContext(parallelism, store, observer, cache), share_files=True)
+    result = dict(zip(names, schedule.run_all()))
+    return (result, observer.report()) if profile else result
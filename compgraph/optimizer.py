@@ -0,0 +1,203 @@
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple
+
+from compgraph.records import join_schemas, projected_schema
+
+# Ordering of table is pair of sort keys and reverse flag, None if order is unknown
+Ordering = Optional[Tuple[Tuple[str, ...], bool]]
+# Schema of table is tuple of columns of its records, None if lines are dicts
+Schema = Optional[Tuple[str, ...]]
+
+
+def common_prefix(ordering: Ordering, keys: Iterable[str], reverse: bool = False) -> Tuple[str, ...]:
+    """
+    Longest prefix of keys by which table with given ordering is already sorted
+    """
+    if ordering is None or ordering[1] != reverse:
+        return ()
+    prefix = []
+    for ordered_key, key in zip(ordering[0], keys):
+        if ordered_key != key:
+            break
+        prefix.append(key)
+    return tuple(prefix)
+
+
+def satisfies(ordering: Ordering, keys: Iterable[str], reverse: bool = False) -> bool:
+    """
+    Checks that table with given ordering is sorted by keys
+    """
+    keys = tuple(keys)
+    return common_prefix(ordering, keys, reverse) == keys
+
+
+def _restrict(ordering: Ordering, keys: Iterable[str]) -> Ordering:
+    if ordering is None:
+        return None
+    keys = set(keys)
+    prefix = []
+    for key in ordering[0]:
+        if key not in keys:
+            break
+        prefix.append(key)
+    return (tuple(prefix), ordering[1]) if prefix else None
+
+
+def _join_schema(vertex: Dict, schema: Schema, left_schema: Schema) -> Schema:
+    if schema is None or left_schema is None or vertex["join_type"] != "inner":
+        return None
+    return join_schemas(left_schema, schema)
+
+
+def _can_pass(vertex: Dict, previous: Dict) -> bool:
+    # checks that filter or project gives same result when it is computed before previous operation
+    kind = previous["type"]
+    if vertex["type"] == "filter":
+        columns = vertex["columns"]
+        if kind in ("sort", "project"):
+            return True
+        if columns is None:
+            return False
+        if kind == "reduce":
+            return previous["preserves_keys"] and set(columns) <= set(previous["keys"])
+        if kind == "combine":
+            return set(columns) <= set(previous["keys"])
+        if kind == "top_k":
+            return bool(previous["keys"]) and set(columns) <= set(previous["keys"])
+        if kind == "join":
+            # lines of both tables are filtered, so lines without pair are filtered too
+            return set(columns) <= set(previous["keys"])
+        return False
+    columns = set(vertex["columns"])
+    if kind == "sort":
+        return set(previous["keys"]) <= columns
+    if kind == "filter":
+        return previous["columns"] is not None and set(previous["columns"]) <= columns
+    if kind == "top_k":
+        return set(previous["by"]) | set(previous["keys"]) <= columns
+    return kind in ("limit", "join")
+
+
+def _sink(result: List[Dict], vertex: Dict, position: int) -> None:
+    while position > 0 and _can_pass(vertex, result[position - 1]):
+        previous = result[position - 1]
+        if previous["type"] == "join":
+            if vertex["type"] == "filter":
+                previous["left_filters"] = tuple(previous["left_filters"]) + (vertex["predicate"],)
+            else:
+                # projection stays after join, both tables are projected on its columns and join keys,
+                # columns of other table are skipped in current one
+                columns = tuple(vertex["columns"]) + tuple(key for key in previous["keys"]
+                                                           if key not in vertex["columns"])
+                if previous["left_columns"] is not None:
+                    columns = tuple(column for column in columns if column in previous["left_columns"])
+                previous["left_columns"] = columns
+                result.insert(position, vertex)
+                _sink(result, {"type": "project", "columns": columns, "strict": False}, position - 1)
+                return
+        position -= 1
+    result.insert(position, vertex)
+
+
+def push_down(queue: List[Dict]) -> List[Dict]:
+    """
+    Moves filters and projections as close to input of graph as possible, so sorts, reduces and joins
+    process less lines and smaller lines
+    :param queue: operations of ComputeGraph
+    :return: operations in new order, vertices are copied
+    """
+    result = []
+    for vertex in queue:
+        vertex = dict(vertex)
+        if vertex["type"] in ("filter", "project"):
+            _sink(result, vertex, len(result))
+        else:
+            result.append(vertex)
+    return result
+
+
+def optimize(queue: List[Dict], input_orderings: Sequence[Ordering],
+             input_schemas: Optional[Sequence[Schema]] = None) -> Tuple[List[Dict], Ordering, Schema]:
+    """
+    Moves filters and projections before other operations, tracks ordering of table after every operation of graph,
+    drops sorts that are already satisfied, weakens sorts by prefix of keys that is already sorted, marks inputs
+    of merge join that are already sorted and replaces sort followed by limit with top_k.
+    Every vertex of result carries ordering of table after it in "ordering" and schema of table before it
+    in "input_schema" (and schema of other table of join before and after its projection in "left_input_schema"
+    and "left_schema")
+    :param queue: operations of ComputeGraph
+    :param input_orderings: orderings of inputs of ComputeGraph
+    :param input_schemas: schemas of inputs of ComputeGraph
+    :return: optimized operations, ordering and schema of result table
+    """
+    if input_schemas is None:
+        input_schemas = [None] * len(input_orderings)
+    ordering = input_orderings[0]
+    schema = input_schemas[0]
+    result = []
+    for vertex in push_down(queue):
+        vertex["input_schema"] = schema
+        if vertex["type"] == "schema":
+            schema = tuple(vertex["columns"])
+        elif vertex["type"] == "join":
+            vertex["left_input_schema"] = vertex["left_schema"] = input_schemas[vertex["index"]]
+            if vertex["left_columns"] is not None:
+                vertex["left_schema"] = projected_schema(vertex["left_schema"], vertex["left_columns"])
+            schema = _join_schema(vertex, schema, vertex["left_schema"])
+        elif vertex["type"] == "project":
+            schema = projected_schema(schema, vertex["columns"])
+        elif vertex["type"] not in ("input", "sort", "top_k", "limit", "filter"):
+            schema = None
+
+        if vertex["type"] in ("input", "schema", "filter"):
+            pass
+        elif vertex["type"] == "limit" and result and result[-1]["type"] == "sort":
+            # sort followed by limit keeps only first lines of sorted table
+            sort = result.pop()
+            vertex = {"type": "top_k",
+                      "k": vertex["n"],
+                      "by": tuple(sort["keys"]),
+                      "keys": (),
+                      "reverse": sort["reverse"],
+                      "presorted": False,
+                      "input_schema": sort["input_schema"]}
+        elif vertex["type"] == "limit":
+            pass
+        elif vertex["type"] == "project":
+            ordering = _restrict(ordering, vertex["columns"])
+        elif vertex["type"] == "top_k":
+            keys = tuple(vertex["keys"])
+            if not keys:
+                ordering = (tuple(vertex["by"]), vertex["reverse"])
+            elif ordering is not None and set(ordering[0][:len(keys)]) == set(keys):
+                # groups are contiguous, so they are processed one by one in order of table
+                vertex["presorted"] = True
+                ordering = (ordering[0][:len(keys)], ordering[1])
+            else:
+                ordering = None
+        elif vertex["type"] == "sort":
+            keys = tuple(vertex["keys"])
+            if satisfies(ordering, keys, vertex["reverse"]):
+                continue
+            vertex["presorted_keys"] = common_prefix(ordering, keys, vertex["reverse"])
+            ordering = (keys, vertex["reverse"])
+        elif vertex["type"] == "reduce":
+            # hash grouping returns groups in order of partitions when it spills
+            keeps_order = vertex["preserves_keys"] and vertex["presorted"]
+            ordering = _restrict(ordering, vertex["keys"]) if keeps_order else None
+        elif vertex["type"] == "join":
+            keys = tuple(vertex["keys"])
+            if vertex["strategy"] == "merge":
+                # sort by empty keys keeps table as is
+                vertex["left_presorted_keys"] = common_prefix(input_orderings[vertex["index"]], keys) if keys else ()
+                vertex["right_presorted_keys"] = common_prefix(ordering, keys) if keys else ()
+                ordering = (keys, False) if keys else None
+            elif not (vertex["strategy"] in ("hash", "broadcast") and vertex["build_side"] == "left"
+                      and vertex["join_type"] in ("inner", "right")):
+                ordering = None
+        elif vertex["type"] == "aggregate":
+            ordering = (tuple(vertex["keys"]), False)
+        else:
+            ordering = None
+        vertex["ordering"] = ordering
+        result.append(vertex)
+    return result, ordering, schema
@@ -0,0 +1,326 @@
+import collections
+import concurrent.futures
+import copy
+import heapq
+import itertools
+import os
+import shutil
+import tempfile
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from compgraph.blocks import BlockReader, BlockWriter
+from compgraph.sketch import HeavyHitters
+from compgraph.spill import external_sort, SpillFile, SPILL_BATCH_SIZE
+
+DEFAULT_CHUNK_SIZE = 1000
+# key is hot if it holds more than this share of lines of table that fall into one partition on average
+HOT_KEY_SHARE = 0.5
+
+
+def chunked(rows: Iterable[Dict], chunk_size: int) -> Iterator[List[Dict]]:
+    rows = iter(rows)
+    return iter(lambda: list(itertools.islice(rows, chunk_size)), [])
+
+
+def _map_chunk(mapper, rows):
+    result = []
+    for row in rows:
+        result.extend(mapper(row))
+    return result
+
+
+def parallel_map(mapper: Callable[[Dict], Iterable[Dict]], rows: Iterable[Dict], workers: int,
+                 ordered: bool = True, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict]:
+    """
+    Applies mapper to chunks of table in pool of processes. At most two chunks per worker are in flight,
+    so a slow consumer stops reading of table
+    :param mapper: picklable generator that takes one line of table
+    :param rows: table
+    :param workers: number of processes
+    :param ordered: bool True if result should keep order of table, otherwise chunks are returned as they are ready
+    :param chunk_size: number of lines sent to process at once
+    :return: result table
+    """
+    chunks = chunked(rows, chunk_size)
+    executor = concurrent.futures.ProcessPoolExecutor(workers)
+    pending = collections.deque()
+    try:
+        for chunk in itertools.islice(chunks, 2 * workers):
+            pending.append(executor.submit(_map_chunk, mapper, chunk))
+        while pending:
+            if ordered:
+                done = [pending.popleft()]
+            else:
+                done, _ = concurrent.futures.wait(pending, return_when=concurrent.futures.FIRST_COMPLETED)
+                for future in done:
+                    pending.remove(future)
+            for future in done:
+                result = future.result()
+                for chunk in itertools.islice(chunks, 1):
+                    pending.append(executor.submit(_map_chunk, mapper, chunk))
+                yield from result
+    finally:
+        for future in pending:
+            future.cancel()
+        executor.shutdown()
+
+
+def _reduced_groups(rows, sort_keys, reverse, reducer, keys, max_rows, max_bytes):
+    merge_key = itemgetter(*sort_keys[:len(keys)])
+    for _, group in itertools.groupby(external_sort(rows, itemgetter(*sort_keys), reverse, max_rows, max_bytes),
+                                      itemgetter(*keys)):
+        first = next(group)
+        group_key = merge_key(first)
+        for row in reducer(itertools.chain([first], group)):
+            yield group_key, row
+
+
+def _sort_reduce_shard(rows_path, result_path, sort_keys, reverse, reducer, keys, max_rows, max_bytes):
+    _write_rows(result_path, _reduced_groups(_read_rows(rows_path), sort_keys, reverse, reducer, keys,
+                                             max_rows, max_bytes))
+
+
+def parallel_sort_reduce(rows: Iterable[Dict], sort_keys: Tuple[str, ...], reverse: bool,
+                         reducer: Callable[[Iterable[Dict]], Iterable[Dict]], keys: Tuple[str, ...], workers: int,
+                         max_rows: Optional[int] = None, max_bytes: Optional[int] = None) -> Iterator[Dict]:
+    """
+    Sorts table by sort_keys and reduces it by keys in pool of processes. Table is partitioned by hash of keys
+    into temporary files, every process writes result of its partition to file and results are merged by sort keys,
+    so result is same as of serial sort and reduce and no process keeps whole table in memory.
+    Set of keys should be same as set of first len(keys) sort keys
+    :param rows: table
+    :param sort_keys: tuple of strings
+    :param reverse: bool True if table is sorted in reversed order
+    :param reducer: picklable generator that takes lines with same keys
+    :param keys: tuple of strings
+    :param workers: number of processes
+    :param max_rows: memory budget of sort in every process
+    :param max_bytes: memory budget of sort in every process
+    :return: result table
+    """
+    key_func = itemgetter(*keys)
+    directory = tempfile.mkdtemp(prefix="compgraph-")
+    try:
+        paths = [os.path.join(directory, "rows{}".format(shard)) for shard in range(workers)]
+        _split(rows, lambda row: hash(key_func(row)) % workers, paths)
+        results = [os.path.join(directory, "result{}".format(shard)) for shard in range(workers)]
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_sort_reduce_shard, rows_path, result_path, sort_keys, reverse, reducer, keys,
+                                       max_rows, max_bytes)
+                       for rows_path, result_path in zip(paths, results)]
+            for future in futures:
+                future.result()
+        # keys of partitions are disjoint, so lines of one group stay together
+        for _, row in heapq.merge(*map(_read_rows, results), key=itemgetter(0), reverse=reverse):
+            yield row
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def _hot_keys(sketches, sizes, workers):
+    # side of join whose lines of hot key are spread among partitions, lines of other side are copied
+    hot = {}
+    for side, sketch in enumerate(sketches):
+        min_count = max(workers, int(HOT_KEY_SHARE * sizes[side] / workers))
+        for key in sketch.heavy(min_count):
+            counts = [sketches[0].estimate(key), sketches[1].estimate(key)]
+            hot[key] = 0 if counts[0] >= counts[1] else 1
+    return hot
+
+
+def _read_rows(path):
+    with open(path, "rb") as file:
+        reader = BlockReader(file)
+        try:
+            yield from reader
+        finally:
+            reader.close()
+
+
+def _write_rows(path, rows):
+    with open(path, "wb") as file:
+        writer = BlockWriter(file, SPILL_BATCH_SIZE)
+        writer.extend(rows)
+        writer.close()
+
+
+def _split(rows, shard, paths):
+    files = [open(path, "wb") for path in paths]
+    try:
+        writers = [BlockWriter(file, SPILL_BATCH_SIZE) for file in files]
+        for row in rows:
+            writers[shard(row)].write(row)
+        for writer in writers:
+            writer.close()
+    finally:
+        for file in files:
+            file.close()
+
+
+def _join_shard_files(join_shard, left_path, right_path, result_path):
+    _write_rows(result_path, join_shard(_read_rows(left_path), _read_rows(right_path)))
+
+
+def _partition(table, side, key_func, hot, paths, workers):
+    files = [open(path[side], "wb") for path in paths]
+    try:
+        writers = [BlockWriter(file, SPILL_BATCH_SIZE) for file in files]
+        turns = {}
+        for position, row in enumerate(table):
+            key = key_func(row)
+            item = (position, -1, row) if side == 0 else (-1, position, row)
+            spread = hot.get(key)
+            if spread is None:
+                writers[hash(key) % workers].write(item)
+            elif spread == side:
+                turn = turns.get(key, 0)
+                writers[turn % workers].write(item)
+                turns[key] = turn + 1
+            else:
+                for writer in writers:
+                    writer.write(item)
+        for writer in writers:
+            writer.close()
+    finally:
+        for file in files:
+            file.close()
+
+
+def parallel_join(left: Iterable[Dict], right: Iterable[Dict], left_key: Callable, right_key: Callable,
+                  result_key: Callable, join_shard: Callable[[Iterable[Tuple], Iterable[Tuple]], Iterable[Tuple]],
+                  workers: int) -> Iterator[Dict]:
+    """
+    Joins tables in pool of processes. Tables are spilled to temporary files and partitioned by hash of keys,
+    every partition is joined in separate process and results are merged by keys and positions of joined lines
+    in tables, so result is same as of serial merge join. Hot keys, that hold big share of lines of one table,
+    are found by HeavyHitters sketch: their lines of that table are spread among all partitions round-robin
+    and lines of other table with same keys are copied to every partition, so one key does not make one
+    partition a straggler. Hot keys hold at least workers lines, so every partition gets some of them and copied
+    lines are never left without pair
+    :param left: table
+    :param right: table
+    :param left_key: function that returns keys of line of left table
+    :param right_key: function that returns keys of line of right table
+    :param result_key: function that returns keys of joined line
+    :param join_shard: picklable function that takes lines of left and right table of partition, tagged
+    as (position, -1, line) and (-1, position, line), and returns joined lines tagged with both positions
+    sorted by keys and positions
+    :param workers: number of processes
+    :return: joined table sorted by keys
+    """
+    key_funcs = (left_key, right_key)
+    tables = (SpillFile(), SpillFile())
+    sketches = (HeavyHitters(4 * workers), HeavyHitters(4 * workers))
+    directory = tempfile.mkdtemp(prefix="compgraph-")
+    try:
+        for rows, table, key_func, sketch in zip((left, right), tables, key_funcs, sketches):
+            add, write = sketch.add, table.write
+            for row in rows:
+                write(row)
+                add(key_func(row))
+        hot = _hot_keys(sketches, [table.rows for table in tables], workers)
+        paths = [(os.path.join(directory, "left{}".format(shard)), os.path.join(directory, "right{}".format(shard)))
+                 for shard in range(workers)]
+        for side, (table, key_func) in enumerate(zip(tables, key_funcs)):
+            _partition(table, side, key_func, hot, paths, workers)
+            table.close()
+        results = [os.path.join(directory, "result{}".format(shard)) for shard in range(workers)]
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [executor.submit(_join_shard_files, join_shard, left_path, right_path, result_path)
+                       for (left_path, right_path), result_path in zip(paths, results)]
+            for future in futures:
+                future.result()
+        merged = heapq.merge(*map(_read_rows, results), key=lambda item: (result_key(item[2]), item[0], item[1]))
+        for item in merged:
+            yield item[2]
+    finally:
+        for table in tables:
+            table.close()
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def top_rows(rows: Iterable[Dict], k: int, key: Callable, reverse: bool = False) -> List[Dict]:
+    """
+    k first lines of table sorted by key in O(k) memory, same as sorted(rows, key=key, reverse=reverse)[:k]
+    """
+    return (heapq.nlargest if reverse else heapq.nsmallest)(k, rows, key=key)
+
+
+def _top_k_chunk(rows, k, by, reverse):
+    return top_rows(rows, k, itemgetter(*by), reverse)
+
+
+def parallel_top_k(rows: Iterable[Dict], k: int, by: Tuple[str, ...], reverse: bool, workers: int,
+                   chunk_size: int = DEFAULT_CHUNK_SIZE) -> Iterator[Dict]:
+    """
+    Selects k first lines of table sorted by columns by in pool of processes. Every process selects lines
+    of its chunks, heaps of chunks are merged in order of table, so result is same as of serial selection
+    :param rows: table
+    :param k: number of lines
+    :param by: tuple of strings
+    :param reverse: bool True if k last lines should be selected
+    :param workers: number of processes
+    :param chunk_size: number of lines sent to process at once
+    :return: k lines
+    """
+    key = itemgetter(*by)
+    chunks = chunked(rows, max(chunk_size, k))
+    best = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = collections.deque(executor.submit(_top_k_chunk, chunk, k, by, reverse)
+                                    for chunk in itertools.islice(chunks, 2 * workers))
+        while pending:
+            result = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(_top_k_chunk, chunk, k, by, reverse))
+            best = top_rows(best + result, k, key, reverse)
+    yield from best
+
+
+def _fold_chunk(folder, initial, rows):
+    state = copy.deepcopy(initial)
+    for row in rows:
+        state = folder(state, row)
+    return state
+
+
+def _push_state(stack, state, merge):
+    # states of equal number of chunks are merged, so merges form balanced tree
+    level = 0
+    while stack and stack[-1][0] == level:
+        _, left = stack.pop()
+        state = merge(left, state)
+        level += 1
+    stack.append((level, state))
+
+
+def parallel_fold(rows: Iterable[Dict], folder: Callable[[Any, Dict], Any], merge: Callable[[Any, Any], Any],
+                  workers: int, initial: Any = None, chunk_size: int = DEFAULT_CHUNK_SIZE) -> Any:
+    """
+    Folds chunks of table in pool of processes, states of chunks are merged in order of table by tree of merges.
+    At most two chunks per worker are in flight
+    :param rows: table
+    :param folder: picklable function that takes state and line and returns state
+    :param merge: function that takes states of two adjacent parts of table and returns state of both of them
+    :param workers: number of processes
+    :param initial: state before first line of every chunk, it is copied for every chunk
+    :param chunk_size: number of lines sent to process at once
+    :return: state of whole table, copy of initial for empty table
+    """
+    chunks = chunked(rows, chunk_size)
+    stack = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        pending = collections.deque(executor.submit(_fold_chunk, folder, initial, chunk)
+                                    for chunk in itertools.islice(chunks, 2 * workers))
+        while pending:
+            state = pending.popleft().result()
+            for chunk in itertools.islice(chunks, 1):
+                pending.append(executor.submit(_fold_chunk, folder, initial, chunk))
+            _push_state(stack, state, merge)
+    if not stack:
+        return copy.deepcopy(initial)
+    state = stack.pop()[1]
+    while stack:
+        state = merge(stack.pop()[1], state)
+    return state
@@ -0,0 +1,780 @@
+import collections
+import copy
+import functools
+import itertools
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from compgraph.batch import aggregate_batches, batches_to_rows, rows_to_batches
+from compgraph.parallel import parallel_fold, parallel_join, parallel_map, parallel_sort_reduce, parallel_top_k, \
+    top_rows
+from compgraph.profiling import observing, record_materialized, UserFunction
+from compgraph.records import key_getter, projector, record_joiner, to_records
+from compgraph.sketch import BloomFilter
+from compgraph.spill import approx_size, external_sort, hash_groups, sort_rows, SpillFile
+
+HASH_JOIN_MAX_ROWS = 100000
+# lines of one key of one table of merge join kept in memory, bigger groups are spilled
+JOIN_GROUP_MAX_ROWS = 100000
+OBSERVE_CHUNK_SIZE = 1024
+COMBINE_BATCH_SIZE = 4096
+# semi join by smaller table up to this number of lines uses set of its keys, by bigger one - Bloom filter
+SEMI_JOIN_MAX_EXACT_KEYS = 100000
+# tables of join that may be reduced by keys of other table for every type of join
+SEMI_JOIN_SIDES = {"inner": ("left", "right"), "left": ("right",), "right": ("left",), "outer": ()}
+# python does not allow more than 20 statically nested blocks
+MAX_FUSED_MAPPERS = 16
+# operations that are fused into one loop and their functions
+FUSED_OPERATIONS = {"map": "mapper", "filter": "predicate"}
+# user functions of operations, that are measured when run is observed, and whether they return iterables
+USER_FUNCTIONS = {
+    "map": ("mapper", True),
+    "reduce": ("reducer", True),
+    "combine": ("combiner", True),
+    "fold": ("folder", False),
+    "map_batch": ("mapper", False),
+    "fold_batch": ("folder", False),
+    "filter": ("predicate", False),
+}
+
+
+def join_dicts(product: Iterable[Tuple[Dict, Dict]], keys: Iterable[str]) -> Iterable[Dict]:
+    for left, right in product:
+        result = dict(left)
+        for right_key in right:
+            if right_key not in left:
+                result[right_key] = right[right_key]
+            elif right_key not in keys:
+                raise KeyError("Same keys in left and right table beyond join keys")
+        yield result
+
+
+def observe_smaller(left: Iterable[Dict], right: Iterable[Dict], limit: Optional[int] = None):
+    """
+    Reads both tables by chunks in turn until one of them ends
+    :param left: table
+    :param right: table
+    :param limit: stop when both tables are longer than limit, None for unlimited
+    :return: "left", "right" or None (both longer than limit) and tables with already read lines
+    """
+    left, right = iter(left), iter(right)
+    heads = {"left": [], "right": []}
+    sources = {"left": left, "right": right}
+    while limit is None or len(heads["left"]) <= limit or len(heads["right"]) <= limit:
+        for side in ("left", "right"):
+            chunk = list(itertools.islice(sources[side], OBSERVE_CHUNK_SIZE))
+            heads[side].extend(chunk)
+            if len(chunk) < OBSERVE_CHUNK_SIZE:
+                if limit is not None and len(heads[side]) > limit:
+                    return None, itertools.chain(heads["left"], left), itertools.chain(heads["right"], right)
+                return side, itertools.chain(heads["left"], left), itertools.chain(heads["right"], right)
+    return None, itertools.chain(heads["left"], left), itertools.chain(heads["right"], right)
+
+
+def can_partition(sort_operation: Dict, reduce_operation: Dict) -> bool:
+    """
+    Checks that sort followed by reduce may be computed independently over partitions of table by reduce keys
+    """
+    if sort_operation["type"] != "sort" or reduce_operation["type"] != "reduce" or not reduce_operation["presorted"]:
+        return False
+    keys = tuple(reduce_operation["keys"])
+    return set(keys) == set(tuple(sort_operation["keys"])[:len(keys)])
+
+
+def fuse_mappers(stages: List[Tuple[str, Callable]]) -> Callable[[Iterable[Dict]], Iterable[Dict]]:
+    """
+    Compiles chain of mappers and filters into one generator with nested loops and conditions, so line
+    does not pass through generator of every map and filter operation
+    :param stages: list of pairs "map" and mapper or "filter" and predicate
+    :return: generator that takes table and returns result of all stages
+    """
+    lines = ["def pipeline(generator):",
+             "    for row0 in generator:"]
+    indent = "        "
+    row = 0
+    for index, (kind, _) in enumerate(stages):
+        if kind == "filter":
+            lines.append("{}if function{}(row{}):".format(indent, index, row))
+        else:
+            lines.append("{}for row{} in function{}(row{}):".format(indent, row + 1, index, row))
+            row += 1
+        indent += "    "
+    lines.append("{}yield row{}".format(indent, row))
+    namespace = {"function{}".format(index): function for index, (_, function) in enumerate(stages)}
+    exec("\n".join(lines), namespace)
+    return namespace["pipeline"]
+
+
+class Operator(object):
+    __slots__ = ()
+    # whether operator takes and returns column batches instead of lines
+    consumes_batches = False
+    produces_batches = False
+
+    def run(self, generator, inputs, context):
+        raise NotImplementedError
+
+    def describe(self) -> str:
+        """
+        Short name of operator for profiling reports, like "reduce(count_words; word)"
+        """
+        name = type(self).__name__[:-len("Operator")]
+        name = "".join("_" + char.lower() if char.isupper() else char for char in name).lstrip("_")
+        details = [_function_name(getattr(self, attribute, None))
+                   for attribute in ("mapper", "reducer", "combiner", "folder") if hasattr(self, attribute)]
+        keys = getattr(self, "keys", None)
+        if keys:
+            details.append(",".join(keys))
+        return "{}({})".format(name, "; ".join(details)) if details else name
+
+
+def _function_name(function):
+    return getattr(function, "__name__", type(function).__name__)
+
+
+class ToBatchesOperator(Operator):
+    __slots__ = ("batch_size",)
+    produces_batches = True
+
+    def __init__(self, batch_size):
+        self.batch_size = batch_size
+
+    def run(self, generator, inputs, context):
+        return rows_to_batches(generator, self.batch_size)
+
+
+class ToRowsOperator(Operator):
+    __slots__ = ()
+    consumes_batches = True
+
+    def run(self, generator, inputs, context):
+        return batches_to_rows(generator)
+
+
+class MapBatchOperator(Operator):
+    __slots__ = ("mapper", "batch_size")
+    consumes_batches = True
+    produces_batches = True
+
+    def __init__(self, vertex):
+        self.mapper = vertex["mapper"]
+        self.batch_size = vertex["batch_size"]
+
+    def run(self, generator, inputs, context):
+        mapper = self.mapper
+        for batch in generator:
+            yield mapper(batch)
+
+
+class FoldBatchOperator(Operator):
+    __slots__ = ("folder", "batch_size")
+    consumes_batches = True
+
+    def __init__(self, vertex):
+        self.folder = vertex["folder"]
+        self.batch_size = vertex["batch_size"]
+
+    def run(self, generator, inputs, context):
+        folder = self.folder
+        state = None
+        for batch in generator:
+            state = folder(state, batch)
+        yield state
+
+
+class AggregateOperator(Operator):
+    __slots__ = ("keys", "aggregations", "batch_size")
+    consumes_batches = True
+
+    def __init__(self, vertex):
+        self.keys = tuple(vertex["keys"])
+        self.aggregations = vertex["aggregations"]
+        self.batch_size = vertex["batch_size"]
+
+    def run(self, generator, inputs, context):
+        return aggregate_batches(generator, self.keys, self.aggregations)
+
+
+class SchemaOperator(Operator):
+    __slots__ = ("columns",)
+
+    def __init__(self, vertex):
+        self.columns = tuple(vertex["columns"])
+
+    def run(self, generator, inputs, context):
+        return to_records(generator, self.columns)
+
+
+class FusedMapOperator(Operator):
+    __slots__ = ("stages", "pipeline")
+
+    def __init__(self, stages):
+        self.stages = stages
+        self.pipeline = fuse_mappers(stages)
+
+    def run(self, generator, inputs, context):
+        return self.pipeline(generator)
+
+    def describe(self) -> str:
+        if all(kind == "filter" for kind, _ in self.stages):
+            return "filter({})".format(", ".join(_function_name(function) for _, function in self.stages))
+        return "map({})".format(", ".join(_function_name(function) if kind == "map"
+                                          else "filter:" + _function_name(function)
+                                          for kind, function in self.stages))
+
+
+class ProjectOperator(Operator):
+    __slots__ = ("columns", "project")
+
+    def __init__(self, vertex):
+        self.columns = tuple(vertex["columns"])
+        self.project = projector(vertex["input_schema"], self.columns, vertex["strict"])
+
+    def run(self, generator, inputs, context):
+        return map(self.project, generator)
+
+    def describe(self) -> str:
+        return "project({})".format(",".join(self.columns))
+
+
+class ParallelMapOperator(Operator):
+    __slots__ = ("mapper", "workers", "ordered", "chunk_size")
+
+    def __init__(self, vertex):
+        self.mapper = vertex["mapper"]
+        self.workers = vertex["workers"]
+        self.ordered = vertex["ordered"]
+        self.chunk_size = vertex["chunk_size"]
+
+    def run(self, generator, inputs, context):
+        return parallel_map(self.mapper, generator, self.workers, self.ordered, self.chunk_size)
+
+
+class SortOperator(Operator):
+    __slots__ = ("keys", "reverse", "presorted_keys", "max_rows", "max_bytes", "getter")
+
+    def __init__(self, vertex):
+        self.keys = tuple(vertex["keys"])
+        self.reverse = vertex["reverse"]
+        self.presorted_keys = tuple(vertex["presorted_keys"])
+        self.max_rows = vertex["max_rows"]
+        self.max_bytes = vertex["max_bytes"]
+        self.getter = key_getter(vertex["input_schema"])
+
+    def run(self, generator, inputs, context):
+        return sort_rows(generator, self.keys, self.reverse, self.presorted_keys, self.max_rows, self.max_bytes,
+                         self.getter)
+
+
+class ReduceOperator(Operator):
+    __slots__ = ("reducer", "keys", "presorted", "max_rows", "max_bytes", "key_func")
+
+    def __init__(self, vertex):
+        self.reducer = vertex["reducer"]
+        self.keys = tuple(vertex["keys"])
+        self.presorted = vertex["presorted"]
+        self.max_rows = vertex["max_rows"]
+        self.max_bytes = vertex["max_bytes"]
+        self.key_func = key_getter(vertex["input_schema"])(*self.keys)
+
+    def run(self, generator, inputs, context):
+        if self.presorted:
+            groups = itertools.groupby(generator, self.key_func)
+        else:
+            groups = hash_groups(generator, self.key_func, self.max_rows, self.max_bytes)
+        reducer = self.reducer
+        for key, group in groups:
+            yield from reducer(iter(group))
+
+
+class SortReduceOperator(Operator):
+    """
+    Sort followed by reduce by same keys, that is computed over partitions of table when run is parallel
+    """
+    __slots__ = ("sort", "reduce")
+
+    def __init__(self, sort, reduce):
+        self.sort = sort
+        self.reduce = reduce
+
+    def run(self, generator, inputs, context):
+        if context.parallelism is not None and context.parallelism > 1:
+            return parallel_sort_reduce(generator, self.sort.keys, self.sort.reverse, self.reduce.reducer,
+                                        self.reduce.keys, context.parallelism, self.sort.max_rows,
+                                        self.sort.max_bytes)
+        return self.reduce.run(self.sort.run(generator, inputs, context), inputs, context)
+
+    def describe(self) -> str:
+        return "sort_" + self.reduce.describe()
+
+
+class CombineOperator(Operator):
+    __slots__ = ("combiner", "keys", "key_func")
+
+    def __init__(self, vertex):
+        self.combiner = vertex["combiner"]
+        self.keys = tuple(vertex["keys"])
+        self.key_func = key_getter(vertex["input_schema"])(*self.keys)
+
+    def run(self, generator, inputs, context):
+        key_func = self.key_func
+        combiner = self.combiner
+        while True:
+            groups = {}
+            for row in itertools.islice(generator, COMBINE_BATCH_SIZE):
+                groups.setdefault(key_func(row), []).append(row)
+            if not groups:
+                break
+            if observing():
+                record_materialized(sum(map(len, groups.values())))
+            for group in groups.values():
+                yield from combiner(iter(group))
+
+
+class FoldOperator(Operator):
+    __slots__ = ("folder", "merge", "initial", "chunk_size")
+
+    def __init__(self, vertex):
+        self.folder = vertex["folder"]
+        self.merge = vertex["merge"]
+        self.initial = vertex["initial"]
+        self.chunk_size = vertex["chunk_size"]
+
+    def run(self, generator, inputs, context):
+        if self.merge is not None and context.parallelism is not None and context.parallelism > 1:
+            yield parallel_fold(generator, self.folder, self.merge, context.parallelism, self.initial,
+                                self.chunk_size)
+            return
+        folder = self.folder
+        state = copy.deepcopy(self.initial)
+        for line in generator:
+            state = folder(state, line)
+        yield state
+
+
+class TopKOperator(Operator):
+    __slots__ = ("k", "by", "keys", "reverse", "presorted", "by_func", "key_func")
+
+    def __init__(self, vertex):
+        self.k = vertex["k"]
+        self.by = tuple(vertex["by"])
+        self.keys = tuple(vertex["keys"])
+        self.reverse = vertex["reverse"]
+        self.presorted = vertex["presorted"]
+        getter = key_getter(vertex["input_schema"])
+        self.by_func = getter(*self.by)
+        self.key_func = getter(*self.keys) if self.keys else None
+
+    def run(self, generator, inputs, context):
+        k, by_func, reverse = self.k, self.by_func, self.reverse
+        if not self.keys:
+            if context.parallelism is not None and context.parallelism > 1:
+                return parallel_top_k(generator, k, self.by, reverse, context.parallelism)
+            return iter(top_rows(generator, k, by_func, reverse))
+        if self.presorted:
+            return (row for _, group in itertools.groupby(generator, self.key_func)
+                    for row in top_rows(group, k, by_func, reverse))
+        return self._hash_top_k(generator)
+
+    def _hash_top_k(self, generator):
+        k, by_func, reverse, key_func = self.k, self.by_func, self.reverse, self.key_func
+        groups = {}
+        for row in generator:
+            key = key_func(row)
+            group = groups.get(key)
+            if group is None:
+                groups[key] = [row]
+                continue
+            group.append(row)
+            # trimming keeps earlier of equal lines, so result is same as of stable sort
+            if len(group) >= 2 * k + 2:
+                group[:] = top_rows(group, k, by_func, reverse)
+        if observing():
+            record_materialized(sum(map(len, groups.values())))
+        for group in groups.values():
+            yield from top_rows(group, k, by_func, reverse)
+
+
+class LimitOperator(Operator):
+    __slots__ = ("n",)
+
+    def __init__(self, vertex):
+        self.n = vertex["n"]
+
+    def run(self, generator, inputs, context):
+        return itertools.islice(generator, self.n)
+
+
+class JoinOperator(Operator):
+    __slots__ = ("index", "keys", "join_type", "strategy", "build_side", "left_presorted_keys",
+                 "right_presorted_keys", "left_filters", "left_project", "bloom_filter", "max_rows", "max_bytes",
+                 "left_schema", "right_schema", "left_getter", "right_getter", "left_key_func", "right_key_func",
+                 "joiner")
+
+    def __init__(self, vertex):
+        self.index = vertex["index"]
+        self.keys = tuple(vertex["keys"])
+        self.join_type = vertex["join_type"]
+        self.strategy = vertex["strategy"]
+        self.build_side = vertex["build_side"]
+        self.left_presorted_keys = tuple(vertex["left_presorted_keys"])
+        self.right_presorted_keys = tuple(vertex["right_presorted_keys"])
+        # filters and projection moved before join are applied to lines of other table when they are read
+        self.left_filters = tuple(vertex["left_filters"])
+        self.left_project = None
+        if vertex["left_columns"] is not None:
+            self.left_project = projector(vertex["left_input_schema"], vertex["left_columns"], strict=False)
+        self.bloom_filter = vertex["bloom_filter"]
+        self.max_rows = vertex["max_rows"]
+        self.max_bytes = vertex["max_bytes"]
+        self.left_schema = vertex["left_schema"]
+        self.right_schema = vertex["input_schema"]
+        self.left_getter = key_getter(self.left_schema)
+        self.right_getter = key_getter(self.right_schema)
+        self.left_key_func = self.left_getter(*self.keys) if self.keys else lambda x: ()
+        self.right_key_func = self.right_getter(*self.keys) if self.keys else lambda x: ()
+        if vertex["left_schema"] is not None and vertex["input_schema"] is not None:
+            self.joiner = record_joiner(vertex["left_schema"], vertex["input_schema"], self.keys)
+        else:
+            self.joiner = join_dicts
+
+    def run(self, generator, inputs, context):
+        left = inputs[self.index]._compute()
+        for predicate in self.left_filters:
+            left = filter(predicate, left)
+        if self.left_project is not None:
+            left = map(self.left_project, left)
+        build_side = self.build_side
+        if not self.keys:
+            # every line is paired with every line of other table, so smaller table is broadcast
+            # to lines of bigger one instead of sorting and grouping both of them
+            if build_side is None:
+                build_side, left, generator = observe_smaller(left, generator)
+            yield from self._broadcast_join(left, generator, build_side)
+            return
+        if self.strategy != "merge" and build_side is None:
+            limit = HASH_JOIN_MAX_ROWS if self.strategy == "auto" else None
+            build_side, left, generator = observe_smaller(left, generator, limit)
+        if (self.strategy == "merge" or build_side is None) and self.bloom_filter:
+            left, generator = self._semi_join(left, generator)
+        if (self.strategy == "merge" or build_side is None) and context.parallelism is not None \
+                and context.parallelism > 1:
+            shard = functools.partial(join_shard, keys=self.keys, join_type=self.join_type,
+                                      left_schema=self.left_schema, right_schema=self.right_schema,
+                                      max_rows=self.max_rows, max_bytes=self.max_bytes)
+            yield from parallel_join(left, generator, self.left_key_func, self.right_key_func, itemgetter(*self.keys),
+                                     shard, context.parallelism)
+        elif self.strategy == "merge" or build_side is None:
+            left = sort_rows(left, self.keys, presorted_keys=self.left_presorted_keys, max_rows=self.max_rows,
+                             max_bytes=self.max_bytes, getter=self.left_getter)
+            generator = sort_rows(generator, self.keys, presorted_keys=self.right_presorted_keys,
+                                  max_rows=self.max_rows, max_bytes=self.max_bytes, getter=self.right_getter)
+            yield from self._merge_join(left, generator)
+        elif build_side == "left":
+            yield from self._hash_join(left, generator)
+        else:
+            yield from self._hash_join_build_right(left, generator)
+
+    def _semi_join(self, left, generator):
+        # smaller table is read whole anyway, bigger one is filtered lazily before sort or partitioning
+        smaller, left, generator = observe_smaller(left, generator)
+        bigger = "right" if smaller == "left" else "left"
+        if bigger not in SEMI_JOIN_SIDES[self.join_type]:
+            return left, generator
+        if smaller == "left":
+            left = list(left)
+            rows, key_func, big_key_func = left, self.left_key_func, self.right_key_func
+        else:
+            generator = list(generator)
+            rows, key_func, big_key_func = generator, self.right_key_func, self.left_key_func
+        if len(rows) <= SEMI_JOIN_MAX_EXACT_KEYS:
+            # exact set of keys of small table is faster than Bloom filter and has no false positives
+            keys = set(map(key_func, rows))
+        else:
+            keys = BloomFilter(len(rows))
+            keys.update(map(key_func, rows))
+        filtered = (row for row in (generator if smaller == "left" else left) if big_key_func(row) in keys)
+        return (left, filtered) if smaller == "left" else (filtered, generator)
+
+    def _hash_join(self, left, generator):
+        keys, join_type, joiner = self.keys, self.join_type, self.joiner
+        left_key_func, right_key_func = self.left_key_func, self.right_key_func
+        table = {}
+        for row in left:
+            table.setdefault(left_key_func(row), []).append(row)
+        if observing():
+            record_materialized(sum(map(len, table.values())))
+        matched = set()
+        for row in generator:
+            key = right_key_func(row)
+            group = table.get(key)
+            if group is not None:
+                matched.add(key)
+                yield from joiner(((left_row, row) for left_row in group), keys)
+            elif join_type == "right" or join_type == "outer":
+                yield row
+        if join_type == "left" or join_type == "outer":
+            for key, group in table.items():
+                if key not in matched:
+                    yield from group
+
+    def _hash_join_build_right(self, left, generator):
+        keys, join_type, joiner = self.keys, self.join_type, self.joiner
+        left_key_func, right_key_func = self.left_key_func, self.right_key_func
+        table = {}
+        for row in generator:
+            table.setdefault(right_key_func(row), []).append(row)
+        if observing():
+            record_materialized(sum(map(len, table.values())))
+        matched = set()
+        for row in left:
+            key = left_key_func(row)
+            group = table.get(key)
+            if group is not None:
+                matched.add(key)
+                yield from joiner(((row, right_row) for right_row in group), keys)
+            elif join_type == "left" or join_type == "outer":
+                yield row
+        if join_type == "right" or join_type == "outer":
+            for key, group in table.items():
+                if key not in matched:
+                    yield from group
+
+    def _broadcast_join(self, left, generator, build_side):
+        keys, join_type, joiner = self.keys, self.join_type, self.joiner
+        if build_side == "left":
+            table, stream, keeps_table, keeps_stream = list(left), generator, ("left", "outer"), ("right", "outer")
+        else:
+            table, stream, keeps_table, keeps_stream = list(generator), left, ("right", "outer"), ("left", "outer")
+        if observing():
+            record_materialized(len(table))
+        if not table:
+            if join_type in keeps_stream:
+                yield from stream
+            return
+        empty = True
+        if len(table) == 1 and joiner is join_dicts:
+            # columns of single line are merged into every line of other table at once
+            single = table[0]
+            columns = set(single)
+            for row in stream:
+                empty = False
+                if not columns.isdisjoint(row):
+                    raise KeyError("Same keys in left and right table beyond join keys")
+                if build_side == "left":
+                    result = dict(single)
+                    result.update(row)
+                else:
+                    result = dict(row)
+                    result.update(single)
+                yield result
+        elif build_side == "left":
+            # lines are paired in order of lines of left table, same as by merge join, so lines of stream
+            # are buffered or spilled and read again for every line of table
+            first = list(itertools.islice(stream, 1))
+            if first:
+                empty = False
+                yield from join_groups(table, itertools.chain(first, stream), joiner, keys)
+        else:
+            for row in stream:
+                empty = False
+                yield from joiner(((row, right_row) for right_row in table), keys)
+        if empty and join_type in keeps_table:
+            yield from table
+
+    def _merge_join(self, left, generator):
+        return merge_join(left, generator, self.keys, self.join_type, self.joiner, self.left_key_func,
+                          self.right_key_func)
+
+
+def join_groups(group_left: Iterable[Dict], group_right: Iterable[Dict], joiner: Callable,
+                keys: Tuple[str, ...]) -> Iterator[Dict]:
+    """
+    Joins every line of group of left table with every line of group of right table with same keys in order
+    of itertools.product, keeping at most JOIN_GROUP_MAX_ROWS lines of group in memory. Left group is streamed
+    through right one, that is kept in memory if it is smaller, and is spilled to temporary file and read again
+    for every line of left one otherwise
+    """
+    limit = JOIN_GROUP_MAX_ROWS
+    buffer_right = list(itertools.islice(group_right, limit))
+    if len(buffer_right) < limit:
+        yield from joiner(((left_row, right_row) for left_row in group_left for right_row in buffer_right), keys)
+        return
+    spilled = SpillFile()
+    try:
+        spilled.extend(buffer_right)
+        spilled.extend(group_right)
+        buffer_right = None
+        yield from joiner(((left_row, right_row) for left_row in group_left for right_row in spilled), keys)
+    finally:
+        spilled.close()
+
+
+def merge_join(left: Iterable[Dict], right: Iterable[Dict], keys: Tuple[str, ...], join_type: str,
+               joiner: Callable, left_key_func: Callable, right_key_func: Callable) -> Iterator[Dict]:
+    """
+    Joins tables sorted by keys
+    """
+    left = itertools.groupby(left, key=left_key_func)
+    right = itertools.groupby(right, key=right_key_func)
+    default_value = (None, None)
+    key_left, group_left = next(left, default_value)
+    key_right, group_right = next(right, default_value)
+    while group_left is not None and group_right is not None:
+        if key_left == key_right:
+            yield from join_groups(group_left, group_right, joiner, keys)
+            key_left, group_left = next(left, default_value)
+            key_right, group_right = next(right, default_value)
+        elif key_left < key_right:
+            if join_type == "left" or join_type == "outer":
+                yield from group_left
+            key_left, group_left = next(left, default_value)
+        else:
+            if join_type == "right" or join_type == "outer":
+                yield from group_right
+            key_right, group_right = next(right, default_value)
+
+    while group_left is not None and (join_type == "outer" or join_type == "left"):
+        yield from group_left
+        key_left, group_left = next(left, default_value)
+
+    while group_right is not None and (join_type == "outer" or join_type == "right"):
+        yield from group_right
+        key_right, group_right = next(right, default_value)
+
+
+def _positioned_joiner(joiner: Callable) -> Callable:
+    # joins lines tagged as (left position, right position, line) and keeps positions of both lines of pair
+    def join(product, keys):
+        positions = collections.deque()
+
+        def pairs():
+            for left, right in product:
+                positions.append((left[0], right[1]))
+                yield left[2], right[2]
+
+        for row in joiner(pairs(), keys):
+            left_position, right_position = positions.popleft()
+            yield left_position, right_position, row
+
+    return join
+
+
+def _item_size(item: Tuple[int, int, Dict]) -> int:
+    return approx_size(item[2])
+
+
+def join_shard(left: Iterable[Tuple[int, int, Dict]], right: Iterable[Tuple[int, int, Dict]],
+               keys: Tuple[str, ...], join_type: str, left_schema: Optional[Tuple[str, ...]],
+               right_schema: Optional[Tuple[str, ...]], max_rows: Optional[int] = None,
+               max_bytes: Optional[int] = None) -> Iterator[Tuple[int, int, Dict]]:
+    """
+    Sorts (within memory budget of sort) and merges partition of tables of parallel join in worker process.
+    Lines are tagged with their positions in tables: (position, -1, line) for left table and (-1, position, line)
+    for right one, joined lines are tagged with positions of both lines and come sorted by keys and positions
+    """
+    left_getter, right_getter = key_getter(left_schema), key_getter(right_schema)
+    if left_schema is not None and right_schema is not None:
+        joiner = record_joiner(left_schema, right_schema, keys)
+    else:
+        joiner = join_dicts
+    left_key, right_key = left_getter(*keys), right_getter(*keys)
+
+    def left_item_key(item):
+        return left_key(item[2])
+
+    def right_item_key(item):
+        return right_key(item[2])
+
+    # lines of partition come in order of positions, stable sort keeps it within keys
+    left = external_sort(left, left_item_key, max_rows=max_rows, max_bytes=max_bytes, size=_item_size)
+    right = external_sort(right, right_item_key, max_rows=max_rows, max_bytes=max_bytes, size=_item_size)
+    return merge_join(left, right, keys, join_type, _positioned_joiner(joiner), left_item_key, right_item_key)
+
+
+OPERATORS = {
+    "sort": SortOperator,
+    "reduce": ReduceOperator,
+    "combine": CombineOperator,
+    "fold": FoldOperator,
+    "join": JoinOperator,
+    "map_batch": MapBatchOperator,
+    "fold_batch": FoldBatchOperator,
+    "aggregate": AggregateOperator,
+    "schema": SchemaOperator,
+    "top_k": TopKOperator,
+    "limit": LimitOperator,
+    "project": ProjectOperator,
+}
+
+
+class Pipeline(object):
+    __slots__ = ("operators",)
+
+    def __init__(self, operators):
+        self.operators = operators
+
+    def __call__(self, generator, inputs, context, graph=0):
+        if context.observer is not None:
+            return context.observer.observe(self.operators, generator, inputs, context, graph)
+        for operator in self.operators:
+            generator = operator.run(generator, inputs, context)
+        return generator
+
+
+def compile_plan(queue: List[Dict], measure_user_functions: bool = False) -> Pipeline:
+    """
+    Turns operations of ComputeGraph into pipeline of operators. Adjacent maps and filters are fused into one loop,
+    sort followed by reduce by same keys becomes one operator that may be computed in parallel,
+    lines are converted to batches and back around batch operators
+    :param queue: optimized operations of ComputeGraph
+    :param measure_user_functions: bool True if time of mappers, reducers and folders should be measured
+    by observer of run
+    :return: Pipeline
+    """
+    if measure_user_functions:
+        queue = [_measured(vertex) for vertex in queue]
+    operators = []
+    mappers = []
+    for index, vertex in enumerate(queue):
+        parallel = vertex["type"] == "map" and vertex["workers"] is not None and vertex["workers"] > 1
+        if vertex["type"] in FUSED_OPERATIONS and not parallel:
+            mappers.append((vertex["type"], vertex[FUSED_OPERATIONS[vertex["type"]]]))
+            if len(mappers) < MAX_FUSED_MAPPERS:
+                continue
+        if mappers:
+            operators.append(FusedMapOperator(mappers))
+            mappers = []
+        if parallel:
+            operators.append(ParallelMapOperator(vertex))
+        elif vertex["type"] == "reduce" and index > 0 and can_partition(queue[index - 1], vertex):
+            operators[-1] = SortReduceOperator(operators[-1], ReduceOperator(vertex))
+        elif vertex["type"] in OPERATORS:
+            operators.append(OPERATORS[vertex["type"]](vertex))
+    if mappers:
+        operators.append(FusedMapOperator(mappers))
+    return Pipeline(_convert_batches(operators))
+
+
+def _measured(vertex):
+    if vertex["type"] not in USER_FUNCTIONS:
+        return vertex
+    attribute, iterable = USER_FUNCTIONS[vertex["type"]]
+    vertex = dict(vertex)
+    vertex[attribute] = UserFunction(vertex[attribute], iterable)
+    return vertex
+
+
+def _convert_batches(operators):
+    result = []
+    batched = False
+    for operator in operators:
+        if operator.consumes_batches and not batched:
+            result.append(ToBatchesOperator(operator.batch_size))
+        elif not operator.consumes_batches and batched:
+            result.append(ToRowsOperator())
+        result.append(operator)
+        batched = operator.produces_batches
+    if batched:
+        result.append(ToRowsOperator())
+    return result
@@ -0,0 +1,283 @@
+import json
+import threading
+from time import perf_counter, process_time
+from typing import Any, Callable, Dict, IO, Iterable, Iterator, List, Optional, Union
+
+_local = threading.local()
+
+
+def _frames() -> List["_Frame"]:
+    frames = getattr(_local, "frames", None)
+    if frames is None:
+        frames = _local.frames = []
+    return frames
+
+
+class OperatorStats(object):
+    """
+    Statistics of one operator of pipeline collected during run. Time is exclusive: time of operators
+    that produce input of operator is not counted, time spent inside user functions (mappers, reducers, folders)
+    is counted separately from time spent by engine
+    """
+    __slots__ = ("graph", "position", "name", "source", "rows_out", "engine_time", "engine_cpu_time",
+                 "user_time", "user_cpu_time", "peak_rows", "spilled_bytes", "started", "finished")
+
+    def __init__(self, graph: int, position: int, name: str, source: Optional["OperatorStats"] = None):
+        self.graph = graph
+        self.position = position
+        self.name = name
+        self.source = source
+        self.rows_out = 0
+        self.engine_time = 0.0
+        self.engine_cpu_time = 0.0
+        self.user_time = 0.0
+        self.user_cpu_time = 0.0
+        self.peak_rows = 0
+        self.spilled_bytes = 0
+        self.started = None
+        self.finished = None
+
+    @property
+    def rows_in(self) -> int:
+        return self.source.rows_out if self.source is not None else 0
+
+    @property
+    def wall_time(self) -> float:
+        return self.engine_time + self.user_time
+
+    @property
+    def cpu_time(self) -> float:
+        return self.engine_cpu_time + self.user_cpu_time
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"graph": self.graph,
+                "position": self.position,
+                "name": self.name,
+                "rows_in": self.rows_in,
+                "rows_out": self.rows_out,
+                "wall_time": self.wall_time,
+                "cpu_time": self.cpu_time,
+                "engine_time": self.engine_time,
+                "engine_cpu_time": self.engine_cpu_time,
+                "user_time": self.user_time,
+                "user_cpu_time": self.user_cpu_time,
+                "peak_rows": self.peak_rows,
+                "spilled_bytes": self.spilled_bytes}
+
+
+class _Frame(object):
+    __slots__ = ("stats", "user", "child_time", "child_cpu_time")
+
+    def __init__(self, stats, user):
+        self.stats = stats
+        self.user = user
+        self.child_time = 0.0
+        self.child_cpu_time = 0.0
+
+
+def _enter(frames, stats, user):
+    frame = _Frame(stats, user)
+    frames.append(frame)
+    return frame, perf_counter(), process_time()
+
+
+def _leave(frames, frame, started, cpu_started):
+    finished = perf_counter()
+    elapsed = finished - started
+    cpu_elapsed = process_time() - cpu_started
+    frames.pop()
+    stats = frame.stats
+    if frame.user:
+        stats.user_time += elapsed - frame.child_time
+        stats.user_cpu_time += cpu_elapsed - frame.child_cpu_time
+    else:
+        stats.engine_time += elapsed - frame.child_time
+        stats.engine_cpu_time += cpu_elapsed - frame.child_cpu_time
+    stats.finished = finished
+    if frames:
+        frames[-1].child_time += elapsed
+        frames[-1].child_cpu_time += cpu_elapsed
+
+
+def observing() -> bool:
+    """
+    Checks that code is executed inside operator of observed run
+    """
+    return bool(_frames())
+
+
+def record_materialized(rows: int) -> None:
+    """
+    Reports that operator that is executed now keeps rows lines in memory
+    """
+    frames = _frames()
+    if frames and rows > frames[-1].stats.peak_rows:
+        frames[-1].stats.peak_rows = rows
+
+
+def record_spill(size: int) -> None:
+    """
+    Reports that operator that is executed now has written size bytes to disk
+    """
+    frames = _frames()
+    if frames:
+        frames[-1].stats.spilled_bytes += size
+
+
+class ProfileReport(object):
+    """
+    Statistics of all operators of run in order they were started
+    """
+    def __init__(self, operators: List[OperatorStats], epoch: float):
+        self.operators = operators
+        self._epoch = epoch
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {"operators": [stats.as_dict() for stats in self.operators]}
+
+    def to_json(self, file: Union[str, IO[str], None] = None) -> Optional[str]:
+        """
+        :param file: path or opened text file, None to return json as string
+        """
+        return _dump(self.as_dict(), file)
+
+    def to_chrome_trace(self, file: Union[str, IO[str], None] = None) -> Optional[str]:
+        """
+        Exports report in Chrome trace event format (chrome://tracing, Perfetto). Every graph is shown as
+        separate thread, every operator as span from its first to its last line
+        :param file: path or opened text file, None to return json as string
+        """
+        events = []
+        for stats in self.operators:
+            if stats.started is None:
+                continue
+            events.append({"name": stats.name,
+                           "cat": "operator",
+                           "ph": "X",
+                           "pid": 0,
+                           "tid": stats.graph,
+                           "ts": (stats.started - self._epoch) * 1e6,
+                           "dur": (stats.finished - stats.started) * 1e6,
+                           "args": stats.as_dict()})
+        return _dump({"traceEvents": events, "displayTimeUnit": "ms"}, file)
+
+
+def _dump(value, file):
+    if file is None:
+        return json.dumps(value)
+    if isinstance(file, str):
+        with open(file, "w") as opened:
+            json.dump(value, opened)
+    else:
+        json.dump(value, file)
+    return None
+
+
+class Observer(object):
+    """
+    Collects statistics of operators during run of ComputeGraph. Subclasses may override operator_started
+    and operator_finished to watch run live
+    """
+    def __init__(self):
+        self.operators = []
+        self._graphs = {}
+        self._epoch = perf_counter()
+
+    def operator_started(self, stats: OperatorStats) -> None:
+        pass
+
+    def operator_finished(self, stats: OperatorStats) -> None:
+        pass
+
+    def graph_index(self, graph: object) -> int:
+        return self._graphs.setdefault(id(graph), len(self._graphs))
+
+    def observe(self, operators: List[Any], generator: Iterable, inputs: List[Any], context: Any,
+                graph: int) -> Iterator:
+        """
+        Chains operators of pipeline, measuring every one of them
+        :param operators: operators of pipeline
+        :param generator: input table
+        :param inputs: inputs of ComputeGraph
+        :param context: RunContext
+        :param graph: index of ComputeGraph
+        :return: result table
+        """
+        stats = OperatorStats(graph, 0, "input")
+        self.operators.append(stats)
+        generator = self._measure(generator, stats)
+        for position, operator in enumerate(operators, 1):
+            stats = OperatorStats(graph, position, operator.describe(), stats)
+            self.operators.append(stats)
+            generator = self._measure(operator.run(generator, inputs, context), stats)
+        return generator
+
+    def _measure(self, rows, stats):
+        frames = _frames()
+        iterator = iter(rows)
+        try:
+            while True:
+                frame, started, cpu_started = _enter(frames, stats, False)
+                if stats.started is None:
+                    stats.started = started
+                    self.operator_started(stats)
+                try:
+                    row = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    _leave(frames, frame, started, cpu_started)
+                stats.rows_out += 1
+                yield row
+        finally:
+            if stats.started is not None:
+                self.operator_finished(stats)
+
+    def report(self) -> ProfileReport:
+        return ProfileReport(self.operators, self._epoch)
+
+
+def _plain(function):
+    return function
+
+
+class UserFunction(object):
+    """
+    Wrapper of mapper, reducer or folder that counts time spent in it as user time of operator that calls it.
+    Pickled as wrapped function, so it is not measured in other processes
+    """
+    __slots__ = ("function", "iterable", "__name__")
+
+    def __init__(self, function: Callable, iterable: bool):
+        self.function = function
+        self.iterable = iterable
+        self.__name__ = getattr(function, "__name__", type(function).__name__)
+
+    def __call__(self, *args):
+        frames = _frames()
+        if not frames:
+            return self.function(*args)
+        stats = frames[-1].stats
+        frame, started, cpu_started = _enter(frames, stats, True)
+        try:
+            result = self.function(*args)
+        finally:
+            _leave(frames, frame, started, cpu_started)
+        return self._iterate(result, stats) if self.iterable else result
+
+    @staticmethod
+    def _iterate(rows, stats):
+        frames = _frames()
+        iterator = iter(rows)
+        while True:
+            frame, started, cpu_started = _enter(frames, stats, True)
+            try:
+                row = next(iterator)
+            except StopIteration:
+                return
+            finally:
+                _leave(frames, frame, started, cpu_started)
+            yield row
+
+    def __reduce__(self):
+        return _plain, (self.function,)
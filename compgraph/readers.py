@@ -0,0 +1,159 @@
+import csv
+import json
+import mmap
+import os
+from operator import itemgetter
+from typing import Callable, Dict, Iterator, List, Optional, Sequence
+
+DEFAULT_BLOCK_SIZE = 1 << 20
+
+
+class FileInput(object):
+    """
+    Input table stored in file. Every iteration reads file again, so input that is used several times
+    is not stored in memory
+    """
+    def __init__(self, path: str, columns: Optional[Sequence[str]] = None, block_size: int = DEFAULT_BLOCK_SIZE):
+        """
+        :param path: path of file
+        :param columns: columns that should be read, None for all columns
+        :param block_size: number of bytes read from file at once
+        """
+        self.path = path
+        self.columns = tuple(columns) if columns is not None else None
+        self.block_size = block_size
+
+    def __iter__(self) -> Iterator[Dict]:
+        raise NotImplementedError
+
+    def fingerprint(self) -> str:
+        """
+        Identifies content of input for ResultCache: path, size and modification time of file and parameters of input
+        """
+        stat = os.stat(self.path)
+        parameters = sorted((key, repr(value)) for key, value in vars(self).items())
+        return repr((type(self).__name__, os.path.abspath(self.path), stat.st_size, stat.st_mtime_ns, parameters))
+
+
+def read_blocks(path: str, block_size: int = DEFAULT_BLOCK_SIZE, use_mmap: bool = False) -> Iterator[bytes]:
+    """
+    Reads file by blocks of about block_size bytes, that end on line boundaries
+    :param path: path of file
+    :param block_size: number of bytes in block
+    :param use_mmap: bool True if file should be mapped into memory instead of read
+    :return: blocks of whole lines
+    """
+    with open(path, "rb") as file:
+        if use_mmap:
+            try:
+                mapped = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty file can not be mapped
+                return
+            with mapped:
+                start = 0
+                while start < len(mapped):
+                    end = mapped.find(b"\n", start + block_size)
+                    end = len(mapped) if end == -1 else end + 1
+                    yield mapped[start:end]
+                    start = end
+            return
+        rest = b""
+        while True:
+            block = file.read(block_size)
+            if not block:
+                break
+            end = block.rfind(b"\n")
+            if end == -1:
+                rest += block
+                continue
+            yield rest + block[:end + 1]
+            rest = block[end + 1:]
+        if rest:
+            yield rest
+
+
+class JsonLinesInput(FileInput):
+    """
+    Table stored as one json object per line. Lines are parsed in bulk by blocks, fields that are not in columns
+    are dropped right after parsing
+    """
+    def __init__(self, path: str, columns: Optional[Sequence[str]] = None, block_size: int = DEFAULT_BLOCK_SIZE,
+                 use_mmap: bool = False):
+        """
+        :param use_mmap: bool True if file should be mapped into memory instead of read
+        """
+        super().__init__(path, columns, block_size)
+        self.use_mmap = use_mmap
+
+    def __iter__(self) -> Iterator[Dict]:
+        columns = self.columns
+        for block in read_blocks(self.path, self.block_size, self.use_mmap):
+            rows = _parse_json_lines(block)
+            if columns is None:
+                yield from rows
+            else:
+                for row in rows:
+                    yield {column: row[column] for column in columns}
+
+
+def _parse_json_lines(block: bytes) -> List[Dict]:
+    lines = [line for line in block.split(b"\n") if line.strip()]
+    try:
+        # one call of decoder for whole block is much faster than call for every line
+        return json.loads(b"[" + b",".join(lines) + b"]")
+    except ValueError:
+        # find line that is not valid json
+        return [json.loads(line) for line in lines]
+
+
+class CsvInput(FileInput):
+    """
+    Table stored in CSV file with header. Values are strings unless converters are given in types,
+    only columns that are read are converted
+    """
+    delimiter = ","
+
+    def __init__(self, path: str, columns: Optional[Sequence[str]] = None, block_size: int = DEFAULT_BLOCK_SIZE,
+                 types: Optional[Dict[str, Callable[[str], object]]] = None, encoding: str = "utf-8"):
+        """
+        :param types: dict from column to function that converts its value, for example int
+        :param encoding: encoding of file
+        """
+        super().__init__(path, columns, block_size)
+        self.types = types or {}
+        self.encoding = encoding
+
+    def __iter__(self) -> Iterator[Dict]:
+        with open(self.path, newline="", encoding=self.encoding, buffering=self.block_size) as file:
+            reader = csv.reader(file, delimiter=self.delimiter)
+            header = next(reader, None)
+            if header is None:
+                return
+            columns = self.columns if self.columns is not None else tuple(header)
+            missing = [column for column in columns if column not in header]
+            if missing:
+                raise KeyError("Columns {} are not in header of {}".format(missing, self.path))
+            positions = [header.index(column) for column in columns]
+            converters = [self.types.get(column) for column in columns]
+            if len(positions) == 1:
+                getter = lambda row, position=positions[0]: (row[position],)
+            else:
+                getter = itemgetter(*positions)
+            if not any(converters):
+                for row in reader:
+                    if row:
+                        yield dict(zip(columns, getter(row)))
+                return
+            converters = [converter or str for converter in converters]
+            for row in reader:
+                if row:
+                    yield {column: converter(value)
+                           for column, converter, value in zip(columns, converters, getter(row))}
+
+
+class TsvInput(CsvInput):
+    """
+    Table stored in tab separated file with header
+    """
+    delimiter = "\t"
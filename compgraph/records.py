@@ -0,0 +1,173 @@
+from operator import itemgetter
+from typing import Callable, Dict, Iterable, Optional, Sequence, Tuple
+
+_tuple_getitem = tuple.__getitem__
+_record_types = {}
+
+
+class Record(tuple):
+    """
+    Line of table with declared schema. Values are stored in tuple in order of columns of schema,
+    but record behaves as read-only dict: record["column"], keys(), iteration over columns, dict(record)
+    """
+    __slots__ = ()
+    _columns = ()
+    _index = {}
+
+    def __getitem__(self, key):
+        if key.__class__ is str:
+            try:
+                return _tuple_getitem(self, self._index[key])
+            except KeyError:
+                raise KeyError(key) from None
+        return _tuple_getitem(self, key)
+
+    def __iter__(self):
+        return iter(self._columns)
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self._columns == other._columns and tuple.__eq__(self, other)
+        if isinstance(other, dict):
+            return dict(self) == other
+        return NotImplemented
+
+    def __ne__(self, other):
+        result = self.__eq__(other)
+        return result if result is NotImplemented else not result
+
+    __hash__ = tuple.__hash__
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def __reduce__(self):
+        return make_record, (self._columns, self.values())
+
+    def keys(self) -> Tuple[str, ...]:
+        return self._columns
+
+    def values(self) -> Tuple:
+        return _tuple_getitem(self, slice(None))
+
+    def items(self) -> Iterable[Tuple[str, object]]:
+        return zip(self._columns, self.values())
+
+    def get(self, key, default=None):
+        index = self._index.get(key)
+        return default if index is None else _tuple_getitem(self, index)
+
+
+def record_type(columns: Sequence[str]) -> type:
+    """
+    Class of records with given columns, classes are shared between same schemas
+    :param columns: sequence of strings
+    :return: subclass of Record
+    """
+    columns = tuple(columns)
+    result = _record_types.get(columns)
+    if result is None:
+        if len(set(columns)) != len(columns):
+            raise ValueError("Same columns in schema {}".format(columns))
+        result = type("Record", (Record,), {"__slots__": (), "_columns": columns,
+                                            "_index": {column: index for index, column in enumerate(columns)}})
+        _record_types[columns] = result
+    return result
+
+
+def make_record(columns: Sequence[str], values: Iterable) -> Record:
+    return tuple.__new__(record_type(columns), values)
+
+
+def to_records(rows: Iterable[Dict], columns: Sequence[str]) -> Iterable[Record]:
+    """
+    Converts lines of table into records of schema, columns that are not in schema are dropped
+    """
+    cls = record_type(columns)
+    columns = cls._columns
+    new = tuple.__new__
+    for row in rows:
+        if row.__class__ is cls:
+            yield row
+        else:
+            yield new(cls, [row[column] for column in columns])
+
+
+def key_getter(schema: Optional[Sequence[str]]) -> Callable[..., Callable]:
+    """
+    Factory of key functions like operator.itemgetter. For records with known schema keys are compiled
+    into positional indexes
+    :param schema: columns of records or None if lines are dicts
+    :return: function that takes names of keys and returns key function
+    """
+    if schema is None:
+        return itemgetter
+    index = {column: position for position, column in enumerate(schema)}
+
+    def getter(*keys):
+        positions = tuple(index[key] for key in keys)
+        if len(positions) == 1:
+            position = positions[0]
+            return lambda row: _tuple_getitem(row, position)
+        return lambda row: tuple([_tuple_getitem(row, position) for position in positions])
+
+    return getter
+
+
+def join_schemas(left: Sequence[str], right: Sequence[str]) -> Tuple[str, ...]:
+    return tuple(left) + tuple(column for column in right if column not in left)
+
+
+def record_joiner(left_schema: Sequence[str], right_schema: Sequence[str],
+                  keys: Iterable[str]) -> Callable[[Iterable[Tuple[Record, Record]], Iterable[str]], Iterable[Record]]:
+    """
+    Function with same interface as join_dicts for records with known schemas,
+    joined record is concatenation of tuples
+    """
+    keys = set(keys)
+    same_columns = any(column in left_schema and column not in keys for column in right_schema)
+    cls = record_type(join_schemas(left_schema, right_schema))
+    extra = [position for position, column in enumerate(right_schema) if column not in left_schema]
+    new = tuple.__new__
+
+    def join(product, keys):
+        for left, right in product:
+            if same_columns:
+                raise KeyError("Same keys in left and right table beyond join keys")
+            yield new(cls, _tuple_getitem(left, slice(None)) + tuple([_tuple_getitem(right, position)
+                                                                       for position in extra]))
+
+    return join
+
+
+def projector(schema: Optional[Sequence[str]], columns: Sequence[str],
+              strict: bool = True) -> Callable[[Dict], Dict]:
+    """
+    Function that keeps only given columns of line. Dicts stay dicts, records become records of projected schema
+    :param schema: columns of records or None if lines are dicts
+    :param columns: sequence of strings
+    :param strict: bool True if missing column is error, otherwise missing columns are skipped
+    :return: function that takes line and returns projected line
+    """
+    columns = tuple(columns)
+    if schema is None:
+        if strict:
+            return lambda row: {column: row[column] for column in columns}
+        return lambda row: {column: row[column] for column in columns if column in row}
+    missing = [column for column in columns if column not in schema]
+    if missing and strict:
+        raise KeyError("Columns {} are not in schema {}".format(missing, tuple(schema)))
+    present = tuple(column for column in columns if column in schema)
+    cls = record_type(present)
+    positions = [list(schema).index(column) for column in present]
+    new = tuple.__new__
+    return lambda row: new(cls, [_tuple_getitem(row, position) for position in positions])
+
+
+def projected_schema(schema: Optional[Sequence[str]], columns: Sequence[str]) -> Optional[Tuple[str, ...]]:
+    if schema is None:
+        return None
+    return tuple(column for column in columns if column in schema)
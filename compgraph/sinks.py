@@ -0,0 +1,91 @@
+import json
+from typing import Any, Callable, Dict, IO, Iterable, Optional, Union
+
+DEFAULT_BUFFER_SIZE = 1 << 20
+
+
+class Sink(object):
+    """
+    Consumer of result table of ComputeGraph
+    """
+    def consume(self, rows: Iterable[Dict]) -> int:
+        """
+        Consumes table
+        :param rows: table
+        :return: number of consumed lines
+        """
+        raise NotImplementedError
+
+
+class JsonLinesSink(Sink):
+    """
+    Writes every line of table as json object on separate line of file. Lines are encoded into buffer
+    that is written to file at once when it exceeds buffer_size characters
+    """
+    def __init__(self, file: Union[str, IO[str]], buffer_size: int = DEFAULT_BUFFER_SIZE,
+                 default: Optional[Callable[[Any], Any]] = str):
+        """
+        :param file: path or opened text file
+        :param buffer_size: number of characters that are written to file at once
+        :param default: function that returns serializable version of object that json can not serialize
+        """
+        self._file = file
+        self._buffer_size = buffer_size
+        self._encoder = json.JSONEncoder(default=default)
+
+    def consume(self, rows: Iterable[Dict]) -> int:
+        if isinstance(self._file, str):
+            with open(self._file, "w") as file:
+                return self._write(rows, file)
+        return self._write(rows, self._file)
+
+    def _write(self, rows, file):
+        encode = self._encoder.encode
+        buffer = []
+        buffered = 0
+        count = 0
+        for row in rows:
+            # records with schema are tuples, json would encode them as lists
+            line = encode(row if row.__class__ is dict else dict(row))
+            buffer.append(line)
+            buffered += len(line) + 1
+            count += 1
+            if buffered >= self._buffer_size:
+                buffer.append("")
+                file.write("\n".join(buffer))
+                buffer = []
+                buffered = 0
+        if buffer:
+            buffer.append("")
+            file.write("\n".join(buffer))
+        file.flush()
+        return count
+
+
+class CallbackSink(Sink):
+    """
+    Calls callback for every line of table or for every batch of batch_size lines
+    """
+    def __init__(self, callback: Callable, batch_size: Optional[int] = None):
+        self._callback = callback
+        self._batch_size = batch_size
+
+    def consume(self, rows: Iterable[Dict]) -> int:
+        callback = self._callback
+        count = 0
+        if self._batch_size is None:
+            for row in rows:
+                callback(row)
+                count += 1
+            return count
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) >= self._batch_size:
+                callback(batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            callback(batch)
+            count += len(batch)
+        return count
@@ -0,0 +1,103 @@
+import math
+from typing import Any, Dict, Hashable, Iterable
+
+DEFAULT_CAPACITY = 64
+DEFAULT_ERROR_RATE = 0.01
+_MIX = 0x9E3779B97F4A7C15
+_MASK = (1 << 64) - 1
+
+
+class HeavyHitters(object):
+    """
+    Misra-Gries summary of stream of keys in O(capacity) memory. Every key that occurs more than
+    total / (capacity + 1) times is kept, its count is underestimated by at most total / (capacity + 1)
+    """
+    __slots__ = ("capacity", "counts", "total")
+
+    def __init__(self, capacity: int = DEFAULT_CAPACITY):
+        """
+        :param capacity: maximum number of counted keys
+        """
+        if capacity < 1:
+            raise ValueError("Capacity of sketch should be positive")
+        self.capacity = capacity
+        self.counts = {}
+        self.total = 0
+
+    def add(self, key: Hashable) -> None:
+        self.total += 1
+        counts = self.counts
+        if key in counts:
+            counts[key] += 1
+        elif len(counts) < self.capacity:
+            counts[key] = 1
+        else:
+            # every counted key and new key lose one occurrence
+            for other in list(counts):
+                if counts[other] == 1:
+                    del counts[other]
+                else:
+                    counts[other] -= 1
+
+    def update(self, keys: Iterable[Hashable]) -> None:
+        for key in keys:
+            self.add(key)
+
+    def estimate(self, key: Hashable) -> int:
+        """
+        :return: lower bound of number of occurrences of key
+        """
+        return self.counts.get(key, 0)
+
+    def heavy(self, min_count: int) -> Dict[Any, int]:
+        """
+        :param min_count: minimum estimated number of occurrences
+        :return: dict from key to estimated number of occurrences for keys that occur at least min_count times
+        """
+        return {key: count for key, count in self.counts.items() if count >= min_count}
+
+
+class BloomFilter(object):
+    """
+    Compact set of keys without false negatives: key that was added is always found, other keys are found
+    with probability about error_rate. Keys are hashed by built-in hash, so filter is valid only in process
+    that built it
+    """
+    __slots__ = ("size", "hashes", "bits")
+
+    def __init__(self, capacity: int, error_rate: float = DEFAULT_ERROR_RATE):
+        """
+        :param capacity: expected number of keys
+        :param error_rate: probability of false positive when capacity keys are added
+        """
+        if not 0 < error_rate < 1:
+            raise ValueError("Error rate of Bloom filter should be between 0 and 1")
+        capacity = max(capacity, 1)
+        self.size = max(8, int(math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)))
+        self.hashes = max(1, int(round(self.size / capacity * math.log(2))))
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # double hashing: positions are h1 + i * h2 for two halves of mixed hash of key
+        mixed = (hash(key) * _MIX) & _MASK
+        first, second, size = mixed & 0xFFFFFFFF, (mixed >> 32) | 1, self.size
+        return [(first + index * second) % size for index in range(self.hashes)]
+
+    def add(self, key: Hashable) -> None:
+        bits = self.bits
+        for position in self._positions(key):
+            bits[position >> 3] |= 1 << (position & 7)
+
+    def update(self, keys: Iterable[Hashable]) -> None:
+        for key in keys:
+            self.add(key)
+
+    def __contains__(self, key: Hashable) -> bool:
+        # most of missing keys are rejected by first position, so positions are not computed in advance
+        mixed = (hash(key) * _MIX) & _MASK
+        first, second, size, bits = mixed & 0xFFFFFFFF, (mixed >> 32) | 1, self.size, self.bits
+        for index in range(self.hashes):
+            position = (first + index * second) % size
+            if not bits[position >> 3] >> (position & 7) & 1:
+                return False
+        return True
@@ -0,0 +1,214 @@
+import heapq
+import itertools
+import sys
+import tempfile
+from operator import itemgetter
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from compgraph.blocks import BlockReader, BlockWriter
+from compgraph.profiling import record_materialized, record_spill
+
+SPILL_BATCH_SIZE = 1024
+SPILL_PARTITIONS = 16
+MAX_SPILL_DEPTH = 4
+# maximum number of sorted runs merged at once, every run keeps open file
+MAX_MERGE_RUNS = 64
+
+
+def approx_size(row: Dict) -> int:
+    """
+    Cheap estimation of memory used by one line of table
+    :param row: line of table
+    :return: size in bytes
+    """
+    size = sys.getsizeof(row)
+    for value in row.values():
+        size += sys.getsizeof(value)
+    return size
+
+
+class SpillFile(object):
+    """
+    Temporary file that stores lines of table in binary blocks. Lines are read back in the order they were written
+    """
+    def __init__(self, batch_size: int = SPILL_BATCH_SIZE):
+        self._file = tempfile.TemporaryFile()
+        self._writer = BlockWriter(self._file, batch_size)
+        self._reader = None
+
+    @property
+    def rows(self) -> int:
+        return self._writer.rows
+
+    def write(self, row: Dict) -> None:
+        self._writer.write(row)
+
+    def extend(self, rows: Iterable[Dict]) -> None:
+        self._writer.extend(rows)
+
+    @property
+    def bytes(self) -> int:
+        return self._file.tell()
+
+    def _open(self):
+        if self._reader is None:
+            self._writer.close()
+            record_spill(self._file.tell())
+            self._reader = BlockReader(self._file)
+        return self._reader
+
+    def __iter__(self) -> Iterator[Dict]:
+        return iter(self._open())
+
+    def close(self) -> None:
+        if self._reader is not None:
+            self._reader.close()
+        self._file.close()
+
+
+def _over_budget(rows: int, size: int, max_rows: Optional[int], max_bytes: Optional[int]) -> bool:
+    return (max_rows is not None and rows >= max_rows) or (max_bytes is not None and size >= max_bytes)
+
+
+def _merge_runs(runs: List[SpillFile], key: Callable, reverse: bool) -> SpillFile:
+    merged = SpillFile()
+    try:
+        merged.extend(heapq.merge(*runs, key=key, reverse=reverse))
+    finally:
+        for run in runs:
+            run.close()
+    return merged
+
+
+def external_sort(rows: Iterable[Dict], key: Callable, reverse: bool = False,
+                  max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+                  size: Callable[[Any], int] = approx_size) -> Iterator[Dict]:
+    """
+    Stable sort of table that keeps at most max_rows lines (or max_bytes bytes) in memory.
+    Sorted runs are spilled to temporary files and merged back with heap, at most MAX_MERGE_RUNS runs at once:
+    every MAX_MERGE_RUNS adjacent runs of same level are merged into one run of next level
+    :param rows: table
+    :param key: function that returns key of line
+    :param reverse: bool True if result table should be reversed
+    :param max_rows: maximum number of lines in memory, None for unlimited
+    :param max_bytes: approximate maximum number of bytes in memory, None for unlimited
+    :param size: function that returns approximate size of line in bytes
+    :return: sorted table, same as sorted(rows, key=key, reverse=reverse)
+    """
+    if max_rows is None and max_bytes is None:
+        rows = sorted(rows, key=key, reverse=reverse)
+        record_materialized(len(rows))
+        yield from rows
+        return
+
+    # runs are consecutive chunks of input and only adjacent runs are merged, heapq.merge takes equal lines
+    # from earlier runs first, so the result is stable exactly as sorted()
+    runs = []
+    levels = []
+    buffer = []
+    buffer_size = 0
+    try:
+        for row in rows:
+            buffer.append(row)
+            if max_bytes is not None:
+                buffer_size += size(row)
+            if _over_budget(len(buffer), buffer_size, max_rows, max_bytes):
+                record_materialized(len(buffer))
+                buffer.sort(key=key, reverse=reverse)
+                run = SpillFile()
+                run.extend(buffer)
+                runs.append(run)
+                levels.append(0)
+                buffer = []
+                buffer_size = 0
+                while len(runs) >= MAX_MERGE_RUNS and len(set(levels[-MAX_MERGE_RUNS:])) == 1:
+                    level = levels[-1] + 1
+                    merged = runs[-MAX_MERGE_RUNS:]
+                    del runs[-MAX_MERGE_RUNS:], levels[-MAX_MERGE_RUNS:]
+                    runs.append(_merge_runs(merged, key, reverse))
+                    levels.append(level)
+        record_materialized(len(buffer))
+        buffer.sort(key=key, reverse=reverse)
+        if not runs:
+            yield from buffer
+            return
+        while len(runs) >= MAX_MERGE_RUNS:
+            merged = runs[:MAX_MERGE_RUNS]
+            del runs[:MAX_MERGE_RUNS]
+            runs.insert(0, _merge_runs(merged, key, reverse))
+        yield from heapq.merge(*runs, buffer, key=key, reverse=reverse)
+    finally:
+        for run in runs:
+            run.close()
+
+
+def sort_rows(rows: Iterable[Dict], keys: Sequence[str], reverse: bool = False, presorted_keys: Sequence[str] = (),
+              max_rows: Optional[int] = None, max_bytes: Optional[int] = None,
+              getter: Callable[..., Callable] = itemgetter) -> Iterator[Dict]:
+    """
+    Stable sort of table by keys, that uses knowledge that table is already sorted by prefix of keys.
+    Then only groups of lines with same presorted keys are sorted
+    :param rows: table
+    :param keys: sequence of strings
+    :param reverse: bool True if result table should be reversed
+    :param presorted_keys: prefix of keys by which table is sorted in same direction
+    :param max_rows: maximum number of lines in memory, None for unlimited
+    :param max_bytes: approximate maximum number of bytes in memory, None for unlimited
+    :param getter: factory of key functions from names of keys
+    :return: sorted table
+    """
+    keys = tuple(keys)
+    presorted_keys = tuple(presorted_keys)
+    if presorted_keys == keys:
+        yield from rows
+    elif presorted_keys:
+        for _, group in itertools.groupby(rows, getter(*presorted_keys)):
+            yield from external_sort(group, getter(*keys), reverse, max_rows, max_bytes)
+    else:
+        yield from external_sort(rows, getter(*keys), reverse, max_rows, max_bytes)
+
+
+def hash_groups(rows: Iterable[Dict], key: Callable, max_rows: Optional[int] = None,
+                max_bytes: Optional[int] = None, depth: int = 0) -> Iterator[Tuple[Any, List[Dict]]]:
+    """
+    Groups lines of table with same key by hash table, input table need not be sorted.
+    When hash table exceeds memory budget, lines are partitioned by hash of key into temporary files
+    and each partition is grouped separately
+    :param rows: table
+    :param key: function that returns key of line
+    :param max_rows: maximum number of lines in memory, None for unlimited
+    :param max_bytes: approximate maximum number of bytes in memory, None for unlimited
+    :param depth: level of partitioning, used for recursive partitioning of too big partitions
+    :return: pairs of key and list of lines with this key, lines in group keep order of input table. Groups come
+    in order of first appearance of keys if table is not partitioned, otherwise partition by partition
+    """
+    rows = iter(rows)
+    groups = {}
+    count = 0
+    size = 0
+    for row in rows:
+        groups.setdefault(key(row), []).append(row)
+        count += 1
+        if max_bytes is not None:
+            size += approx_size(row)
+        if depth < MAX_SPILL_DEPTH and _over_budget(count, size, max_rows, max_bytes):
+            break
+    else:
+        record_materialized(count)
+        yield from groups.items()
+        return
+
+    record_materialized(count)
+    partitions = [SpillFile() for _ in range(SPILL_PARTITIONS)]
+    try:
+        for group_key, group in groups.items():
+            partitions[hash((depth, group_key)) % SPILL_PARTITIONS].extend(group)
+        groups = None
+        for row in rows:
+            partitions[hash((depth, key(row))) % SPILL_PARTITIONS].write(row)
+        for partition in partitions:
+            yield from hash_groups(partition, key, max_rows, max_bytes, depth + 1)
+            partition.close()
+    finally:
+        for partition in partitions:
+            partition.close()
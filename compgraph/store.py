@@ -0,0 +1,227 @@
+import itertools
+import os
+import tempfile
+import weakref
+from typing import Dict, Iterable, Iterator, Optional
+
+from compgraph.blocks import BlockReader, BlockWriter
+from compgraph.profiling import record_materialized, record_spill
+from compgraph.spill import approx_size, SPILL_BATCH_SIZE
+
+DEFAULT_BUFFER_ROWS = 256
+_END = object()
+
+
+def _remove(path):
+    if os.path.exists(path):
+        os.remove(path)
+
+
+class MaterializedTable(object):
+    """
+    Table computed once and read by several consumers. First lines are kept in memory, the rest is written
+    to temporary file, that every consumer reads independently. Table is freed when every consumer has read it
+    """
+    def __init__(self, consumers: int, compress: bool = False):
+        self._rows = []
+        self._path = None
+        self._finalizer = None
+        self._compress = compress
+        self._references = consumers
+        self.spilled_bytes = 0
+
+    @property
+    def released(self) -> bool:
+        return self._references <= 0
+
+    def _store(self, rows: Iterable[Dict], max_rows: Optional[int], max_bytes: Optional[int]) -> None:
+        rows = iter(rows)
+        size = 0
+        for row in rows:
+            self._rows.append(row)
+            if max_bytes is not None:
+                size += approx_size(row)
+            if (max_rows is not None and len(self._rows) >= max_rows) or (max_bytes is not None and size >= max_bytes):
+                self._spill(rows)
+                break
+        record_materialized(len(self._rows))
+        record_spill(self.spilled_bytes)
+
+    def _spill(self, rows: Iterable[Dict]) -> None:
+        descriptor, self._path = tempfile.mkstemp(prefix="compgraph-")
+        self._finalizer = weakref.finalize(self, _remove, self._path)
+        with os.fdopen(descriptor, "wb") as file:
+            writer = BlockWriter(file, SPILL_BATCH_SIZE, self._compress)
+            writer.extend(rows)
+            writer.close()
+            self.spilled_bytes = file.tell()
+
+    def _read_spilled(self):
+        # every consumer maps file by itself, blocks are decoded lazily
+        with open(self._path, "rb") as file:
+            reader = BlockReader(file)
+            try:
+                yield from reader
+            finally:
+                reader.close()
+
+    def read(self) -> Iterator[Dict]:
+        """
+        Reads table by one consumer
+        :return: table
+        """
+        try:
+            yield from self._rows
+            if self._path is not None:
+                yield from self._read_spilled()
+        finally:
+            self.release()
+
+    def release(self) -> None:
+        """
+        Marks that one consumer does not need table anymore
+        """
+        self._references -= 1
+        if self._references <= 0:
+            self._rows = []
+            if self._finalizer is not None:
+                self._finalizer()
+
+
+class SharedTable(object):
+    """
+    Table computed once and streamed to several consumers. While consumers read it in step, lines are kept
+    in bounded buffer until every consumer has read them. When one consumer gets ahead of others (or of consumer
+    that has not started) by more than buffer_rows lines, the rest of table is materialized by store and every
+    consumer continues from its position. Table is freed when every consumer has read it
+    """
+    def __init__(self, rows: Iterable[Dict], consumers: int, store: "MaterializationStore", buffer_rows: int):
+        self._rows = iter(rows)
+        self._store = store
+        self._buffer_rows = buffer_rows
+        self._buffer = []
+        # position in table of first line of buffer
+        self._base = 0
+        self._positions = {}
+        self._opened = 0
+        self._waiting = consumers
+        self._finished = False
+        self._table = None
+        self._table_base = 0
+
+    @property
+    def materialized(self) -> bool:
+        return self._table is not None
+
+    def _trim(self) -> None:
+        # lines are dropped only when every consumer has started, late consumer reads table from the beginning
+        if self._waiting > 0:
+            return
+        lowest = min(self._positions.values(), default=self._base + len(self._buffer))
+        del self._buffer[:lowest - self._base]
+        self._base = lowest
+
+    def _materialize(self) -> None:
+        consumers = len(self._positions) + self._waiting
+        self._table = self._store.materialize(itertools.chain(self._buffer, self._rows), consumers)
+        self._table_base = self._base
+        self._buffer = []
+
+    def _read_table(self, position: int) -> Iterator[Dict]:
+        rows = self._table.read()
+        try:
+            yield from itertools.islice(rows, position - self._table_base, None)
+        finally:
+            rows.close()
+
+    def read(self) -> Iterator[Dict]:
+        """
+        Reads table by one consumer
+        :return: table
+        """
+        self._waiting -= 1
+        self._opened += 1
+        consumer = self._opened
+        position = 0
+        self._positions[consumer] = position
+        reading_table = False
+        try:
+            while self._table is None:
+                offset = position - self._base
+                if offset < len(self._buffer):
+                    row = self._buffer[offset]
+                elif self._finished:
+                    return
+                else:
+                    if len(self._buffer) >= self._buffer_rows:
+                        self._trim()
+                    if len(self._buffer) >= self._buffer_rows:
+                        # consumers diverged
+                        self._materialize()
+                        break
+                    row = next(self._rows, _END)
+                    if row is _END:
+                        self._finished = True
+                        return
+                    self._buffer.append(row)
+                position += 1
+                self._positions[consumer] = position
+                yield row
+            reading_table = True
+            yield from self._read_table(position)
+        finally:
+            del self._positions[consumer]
+            if self._table is None:
+                self._trim()
+            elif not reading_table:
+                self._table.release()
+            if not self._positions and self._waiting <= 0:
+                self.release()
+
+    def release(self) -> None:
+        """
+        Frees table, even if some consumers have not read it
+        """
+        self._buffer = []
+        close = getattr(self._rows, "close", None)
+        if close is not None:
+            close()
+        if self._table is not None:
+            for _ in range(max(self._waiting, 0)):
+                self._table.release()
+        self._waiting = 0
+
+
+class MaterializationStore(object):
+    """
+    Storage of results of ComputeGraph that are used by several consumers. At most max_rows lines
+    (or approximately max_bytes bytes) of every result are kept in memory, the rest is written to temporary file,
+    that is compressed if compress is True. Consumers that read result in step share buffer of buffer_rows lines
+    instead. Subclasses may override materialize to store results elsewhere
+    """
+    def __init__(self, max_rows: Optional[int] = None, max_bytes: Optional[int] = None, compress: bool = False,
+                 buffer_rows: int = DEFAULT_BUFFER_ROWS):
+        self.max_rows = max_rows
+        self.max_bytes = max_bytes
+        self.compress = compress
+        self.buffer_rows = buffer_rows
+
+    def materialize(self, rows: Iterable[Dict], consumers: int) -> MaterializedTable:
+        """
+        Stores table
+        :param rows: table
+        :param consumers: number of consumers that will read table
+        :return: MaterializedTable
+        """
+        table = MaterializedTable(consumers, self.compress)
+        table._store(rows, self.max_rows, self.max_bytes)
+        return table
+
+    def share(self, rows: Iterable[Dict], consumers: int) -> SharedTable:
+        """
+        Streams table to several consumers, it is materialized only if they do not read it in step
+        :param rows: table
+        :param consumers: number of consumers that will read table
+        :return: SharedTable
+        """
+        return SharedTable(rows, consumers, self, self.buffer_rows)
@@ -1,8 +1,6 @@
-from operator import itemgetter
 import math
 import datetime
 import string
-import heapq
 from compgraph.graph import ComputeGraph
 
 
@@ -42,6 +40,10 @@ def count_rows(state, record):
     return {'docs_count': state['docs_count'] + 1}
 
 
+def merge_counts(left, right):
+    return {'docs_count': left['docs_count'] + right['docs_count']}
+
+
 def unique(records):
     for record in records:
         yield {"doc_id": record["doc_id"], "word": record["word"]}
@@ -63,11 +65,14 @@ def tf(records):
         yield {"word": word, "tf": count/len(records), "doc_id": record["doc_id"]}
 
 
+def is_long_word(record):
+    return len(record["word"]) > 4
+
+
 def tf_with_sift(records):
     word_counts = {}
     for record in records:
-        if len(record["word"]) > 4:
-            word_counts[record["word"]] = word_counts.get(record["word"], 0) + 1
+        word_counts[record["word"]] = word_counts.get(record["word"], 0) + 1
     total_count = 0
     for word in word_counts:
         if word_counts[word] > 1:
@@ -83,8 +88,8 @@ def culc_tf_idf(record):
     return {"text": record["word"], "doc_id": record["doc_id"], "tf_idf": record["tf"] * math.log(record["idf"])}
 
 
-def invert_index(records):
-    yield from heapq.nlargest(3, (culc_tf_idf(record) for record in records), key=itemgetter("tf_idf"))
+def emit_tf_idf(record):
+    yield culc_tf_idf(record)
 
 
 def frequency_of_word_in_doc(records):
@@ -102,6 +107,10 @@ def sum_words(state, record):
     return state
 
 
+def merge_words(left, right):
+    return {"words_count": left["words_count"] + right["words_count"]}
+
+
 def calc_pmi(records):
     for record in records:
         yield {"doc_id": record["doc_id"], "text": record["word"],
@@ -115,12 +124,9 @@ def collect_words_pmi(records):
     yield {'word': record['word'], "count": count_sum}
 
 
-def get_top_10(records):
-    yield from sorted(records, key=lambda x: x["pmi"], reverse=True)[:10]
-
-
 def build_word_count_graph(input_stream, text_column='text', count_column='count'):
-    return ComputeGraph(input_stream).map(emit_words).sort("word").reduce(collect_counts, "word").sort(count_column)
+    return ComputeGraph(input_stream).map(emit_words).sort("word")\
+        .reduce(collect_counts, "word", combiner=collect_words).sort(count_column)
 
 
 def build_inverted_index_graph(input_stream, doc_column='doc_id', text_column='text'):
@@ -128,36 +134,53 @@ def build_inverted_index_graph(input_stream, doc_column='doc_id', text_column='t
     TFIDF(word_i, doc_i) = (frequency of word_i in doc_i) * log((total number of docs) / (docs where word_i is present))
     Result should look like {'term': 'word', 'index': [(doc_id_1, tf_idf_1)...]}"""
     split_word = ComputeGraph(input_stream).map(emit_words)
-    count_docs = ComputeGraph(input_stream).fold(count_rows)
-    count_idf = ComputeGraph(split_word).sort("doc_id", "word").reduce(unique, keys=("doc_id", "word"))\
-        .join(count_docs, type='inner').sort('word').reduce(calc_idf, keys=('word'))
-    calc_index = ComputeGraph(split_word).sort('doc_id').reduce(tf, keys='doc_id')\
-        .join(count_idf, keys=('word', "doc_id"), type='left').sort('word').reduce(invert_index, keys='word')
+    count_docs = ComputeGraph(input_stream).fold(count_rows, merge=merge_counts)
+    count_idf = ComputeGraph(split_word).sort("doc_id", "word")\
+        .reduce(unique, keys=("doc_id", "word"), preserves_keys=True)\
+        .join(count_docs, type='inner', strategy='broadcast').sort('word')\
+        .reduce(calc_idf, keys=('word'), preserves_keys=True)
+    calc_index = ComputeGraph(split_word).reduce(tf, keys='doc_id', presorted=False)\
+        .join(count_idf, keys=('word', "doc_id"), type='left').sort('word')\
+        .map(emit_tf_idf).top_k(3, "tf_idf", keys="text", reverse=True)
 
     return calc_index
 
 
 def build_pmi_graph(input_stream, doc_column='doc_id', text_column='text'):
-    word_count_pre_doc = ComputeGraph(input_stream).map(emit_words).sort("doc_id").reduce(tf_with_sift, "doc_id")
+    word_count_pre_doc = ComputeGraph(input_stream).map(emit_words).filter(is_long_word, columns="word")\
+        .reduce(tf_with_sift, "doc_id", presorted=False)
 
-    total_word_count = ComputeGraph(word_count_pre_doc).fold(sum_words)
+    total_word_count = ComputeGraph(word_count_pre_doc).fold(sum_words, merge=merge_words)
 
-    word_count = ComputeGraph(word_count_pre_doc).sort("word").reduce(collect_words_pmi, "word")
+    word_count = ComputeGraph(word_count_pre_doc).reduce(collect_words_pmi, "word", presorted=False)
 
-    calc_index = ComputeGraph(word_count_pre_doc).join(total_word_count)\
-        .join(word_count, keys="word", type="left").sort(("word", "doc_id"))\
-        .reduce(calc_pmi, keys=("word", "doc_id")).sort("doc_id").reduce(get_top_10, "doc_id")
+    calc_index = ComputeGraph(word_count_pre_doc).join(total_word_count, strategy="broadcast")\
+        .join(word_count, keys="word", type="left", strategy="auto").sort(("word", "doc_id"))\
+        .reduce(calc_pmi, keys=("word", "doc_id")).sort("doc_id")\
+        .top_k(10, "pmi", keys="doc_id", reverse=True)
 
     return calc_index
 
 
 def build_yandex_maps_graph(input_stream, input_stream_length):
     lengths = ComputeGraph(input_stream_length).map(add_distance)
-    speed = ComputeGraph(input_stream).map(add_weekday).map(add_hour).map(add_delta_time).join(lengths, keys="edge_id")\
+    speed = ComputeGraph(input_stream).map(add_weekday).map(add_hour).map(add_delta_time)\
+        .join(lengths, keys="edge_id", bloom_filter=True)\
         .sort("weekday", "hour").reduce(culc_speed, keys=("weekday", "hour"))
     return speed
 
 
+def build_yandex_maps_batch_graph(input_stream, input_stream_length):
+    """Same as build_yandex_maps_graph, but speed is aggregated by numpy"""
+    lengths = ComputeGraph(input_stream_length).map(add_distance)
+    speed = ComputeGraph(input_stream).map(add_weekday).map(add_hour).map(add_delta_time)\
+        .join(lengths, keys="edge_id", bloom_filter=True)\
+        .map_batch(weight_by_part)\
+        .aggregate(("weekday", "hour"), {"distance": ("weighted_distance", "sum"), "time": ("weighted_time", "sum")})\
+        .map(speed_from_sums)
+    return speed
+
+
 def parse_date(date):
     return datetime.datetime.strptime(date, "%Y%m%dT%H%M%S.%f")
 
@@ -249,3 +272,13 @@ def culc_speed(records):
         distance += record["distance"] * record["part"]
         time += record["time"] * record["part"]
     yield {"hour": record["hour"], "speed": distance/time, "weekday": record["weekday"]}
+
+
+def weight_by_part(batch):
+    batch["weighted_distance"] = batch["distance"] * batch["part"]
+    batch["weighted_time"] = batch["time"] * batch["part"]
+    return batch
+
+
+def speed_from_sums(record):
+    yield {"hour": record["hour"], "speed": record["distance"] / record["time"], "weekday": record["weekday"]}
@@ -14,5 +14,6 @@ setup(
     author="Ivan Shkurak",
     author_email="shkurakivan@gmail.com",
     packages=packages,
-    package_dir=packages
+    package_dir=packages,
+    extras_require={"numpy": ["numpy"]}
 )
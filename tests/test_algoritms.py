@@ -1,7 +1,12 @@
+import json
 from itertools import cycle, islice
+import pytest
 from pytest import approx
 
 from compgraph.examples import algorithms
+from compgraph.graph import run_many
+from compgraph.readers import JsonLinesInput
+from compgraph.store import MaterializationStore
 
 
 def sorted_eq(tb1, tb2, key):
@@ -169,3 +174,75 @@ def test_yandex_maps():
     assert sorted(result,
                   key=lambda x: (x['weekday'], x['hour'])) == sorted(etalon,
                                                                      key=lambda x: (x['weekday'], x['hour']))
+
+
+def test_parallel_run():
+    docs = [{'doc_id': i, 'text': ' '.join('word{}'.format(j * i % 17) for j in range(i % 9 + 2))}
+            for i in range(1, 60)]
+    for build in (algorithms.build_word_count_graph, algorithms.build_inverted_index_graph,
+                  algorithms.build_pmi_graph):
+        assert build('docs').run(docs=docs) == build('docs').run(docs=docs, parallelism=3)
+
+
+def test_spilled_shared_results():
+    docs = [{'doc_id': i, 'text': ' '.join('word{}'.format(j * i % 13) for j in range(i % 7 + 2))}
+            for i in range(1, 40)]
+    for build in (algorithms.build_inverted_index_graph, algorithms.build_pmi_graph):
+        etalon = build('docs').run(docs=docs)
+        for compress in (False, True):
+            store = MaterializationStore(max_rows=10, compress=compress)
+            assert etalon == build('docs').run(docs=docs, store=store)
+
+
+def test_yandex_maps_batch():
+    pytest.importorskip("numpy")
+    lengths = [
+        {"start": [37.84870228730142, 55.73853974696249], "end": [37.8490418381989, 55.73832445777953],
+         "edge_id": 8414926848168493057},
+        {"start": [37.524768467992544, 55.88785375468433], "end": [37.52415172755718, 55.88807155843824],
+         "edge_id": 5342768494149337085},
+    ]
+
+    times = [
+        {"leave_time": "20171020T112238.723000", "enter_time": "20171020T112237.427000",
+         "edge_id": 8414926848168493057},
+        {"leave_time": "20171011T145553.040000", "enter_time": "20171011T145551.957000",
+         "edge_id": 8414926848168493057},
+        {"leave_time": "20171024T144101.879000", "enter_time": "20171024T144059.102000",
+         "edge_id": 8414926848168493057},
+        {"leave_time": "20171022T131828.330000", "enter_time": "20171022T131820.842000",
+         "edge_id": 5342768494149337085},
+        {"leave_time": "20171010T060609.897000", "enter_time": "20171010T060608.344000",
+         "edge_id": 5342768494149337085},
+        {"leave_time": "20171027T082600.201000", "enter_time": "20171027T082557.571000",
+         "edge_id": 5342768494149337085}
+    ]
+
+    etalon = algorithms.build_yandex_maps_graph('travel_times', 'lengths')\
+        .run(travel_times=times * 100, lengths=lengths)
+    result = algorithms.build_yandex_maps_batch_graph('travel_times', 'lengths')\
+        .run(travel_times=times * 100, lengths=lengths)
+    assert [(row['weekday'], row['hour']) for row in etalon] == [(row['weekday'], row['hour']) for row in result]
+    assert [row['speed'] for row in etalon] == approx([row['speed'] for row in result])
+
+
+def test_run_many(tmpdir):
+    docs = [{'doc_id': i, 'text': ' '.join('word{}'.format(j * i % 13) for j in range(i % 7 + 2))}
+            for i in range(1, 40)]
+    path = str(tmpdir.join('docs.jsonl'))
+    with open(path, 'w') as file:
+        file.writelines(json.dumps(row) + '\n' for row in docs)
+
+    class CountingInput(JsonLinesInput):
+        scans = 0
+
+        def __iter__(self):
+            CountingInput.scans += 1
+            return super().__iter__()
+
+    builds = {'word_count': algorithms.build_word_count_graph, 'inverted_index': algorithms.build_inverted_index_graph,
+              'pmi': algorithms.build_pmi_graph}
+    etalon = {name: build('docs').run(docs=docs) for name, build in builds.items()}
+    graphs = {name: build('docs') for name, build in builds.items()}
+    assert run_many(graphs, docs=CountingInput(path)) == etalon
+    assert CountingInput.scans == 1
@@ -0,0 +1,26 @@
+from benchmarks import generators
+from benchmarks.runner import compare, run_benchmarks
+from benchmarks.suite import BENCHMARKS
+
+
+def test_generators_are_seeded():
+    assert generators.text_corpus(20, seed=1) == generators.text_corpus(20, seed=1)
+    assert generators.text_corpus(20, seed=1) != generators.text_corpus(20, seed=2)
+    road = generators.road_graph(5, seed=3)
+    assert generators.travel_times(50, road, seed=3) == generators.travel_times(50, road, seed=3)
+    big, small = generators.skewed_tables(1000, keys=10, seed=4)
+    assert len(small) == 10 and len(big) == 1000
+    counts = sorted((sum(row['key'] == key for row in big) for key in range(10)), reverse=True)
+    assert counts[0] > 3 * counts[-1]
+
+
+def test_run_and_compare():
+    results = run_benchmarks(list(BENCHMARKS), [50], repeat=1, isolate=False)
+    assert [result['benchmark'] for result in results] == list(BENCHMARKS)
+    assert all(result['rows'] == 50 and result['median'] > 0 for result in results)
+
+    slower = [dict(result, median=result['median'] / 2) for result in results]
+    comparison = compare(results, slower, threshold=0.5)
+    assert len(comparison) == len(results)
+    assert all(item['ratio'] > 1.9 and item['regression'] for item in comparison)
+    assert not any(item['regression'] for item in compare(results, results))
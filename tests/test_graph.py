@@ -1,5 +1,18 @@
+import itertools
+import json
+import os
+import pytest
+import sys
+import tempfile
 from operator import itemgetter
-from compgraph.graph import ComputeGraph
+from compgraph import plan, spill
+from compgraph.cache import function_fingerprint, plan_fingerprint, ResultCache
+from compgraph.graph import ComputeGraph, merge_graphs, run_many
+from compgraph.profiling import Observer
+from compgraph.readers import CsvInput, JsonLinesInput, TsvInput
+from compgraph.sketch import BloomFilter, HeavyHitters
+from compgraph.store import MaterializationStore
+from compgraph.sinks import CallbackSink, JsonLinesSink
 from compgraph.examples import algorithms
 
 
@@ -92,6 +105,45 @@ def test_fold():
     assert etalon == result
 
 
+def collect_ids(state, row):
+    state["ids"].append(row["id"])
+    return state
+
+
+def concat_ids(left, right):
+    return {"ids": left["ids"] + right["ids"]}
+
+
+def test_parallel_fold():
+    rows = [{'id': i} for i in range(1000)]
+    initial = {"ids": []}
+    for parallelism in (None, 1, 3):
+        for chunk_size in (1, 7, 5000):
+            graph = ComputeGraph('rows').fold(collect_ids, merge=concat_ids, initial=initial, chunk_size=chunk_size)
+            # merges keep order of chunks, so result is same as of serial fold even if merge is not commutative
+            assert graph.run(rows=rows, parallelism=parallelism) == [{"ids": list(range(1000))}]
+            assert graph.run(rows=[], parallelism=parallelism) == [{"ids": []}]
+    assert initial == {"ids": []}
+    assert ComputeGraph('rows').fold(collect_ids, initial=initial).run(rows=rows, parallelism=3) == \
+        [{"ids": list(range(1000))}]
+
+
+def number_group(rows):
+    for number, row in enumerate(rows):
+        yield {**row, 'number': number}
+
+
+def test_parallel_sort_reduce(tmpdir, monkeypatch):
+    docs = [{'doc_id': i % 7, 'word': 'w{}'.format(i * 13 % 50), 'pos': i} for i in range(3000)]
+    monkeypatch.setattr(tempfile, 'tempdir', str(tmpdir))
+    for reverse in (False, True):
+        graph = ComputeGraph('docs').sort('word', 'doc_id', reverse=reverse, max_rows=100)\
+            .reduce(number_group, 'word')
+        assert graph.run(docs=docs) == graph.run(docs=docs, parallelism=3)
+    # partitions and results of processes are written to temporary files, that are removed after run
+    assert os.listdir(str(tmpdir)) == []
+
+
 employee_table = [{"LastName": "Rafferty", "DepartmentID": 31},
                   {"LastName": "Jones", "DepartmentID": 33},
                   {"LastName": "Heisenberg", "DepartmentID": 33},
@@ -160,3 +212,816 @@ def test_join_outer():
     graph_outer = ComputeGraph('employee_table').join("department_table", keys="DepartmentID", type="outer")
     result = graph_outer.run(employee_table=employee_table, department_table=department_table)
     assert etalon_outer == result
+
+
+def test_sort_with_memory_budget():
+    docs = [{'doc_id': i % 7, 'word': 'w{}'.format(i % 5), 'pos': i} for i in range(100)]
+    for reverse in (False, True):
+        etalon = sorted(docs, key=itemgetter('doc_id', 'word'), reverse=reverse)
+        by_rows = ComputeGraph('docs').sort("doc_id", "word", reverse=reverse, max_rows=8)
+        assert etalon == by_rows.run(docs=docs)
+        by_bytes = ComputeGraph('docs').sort("doc_id", "word", reverse=reverse, max_bytes=2000)
+        assert etalon == by_bytes.run(docs=docs)
+
+
+def test_sort_merges_bounded_runs(monkeypatch):
+    opened = []
+
+    class CountingSpillFile(spill.SpillFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            opened.append(self)
+
+    monkeypatch.setattr(spill, 'SpillFile', CountingSpillFile)
+    monkeypatch.setattr(spill, 'MAX_MERGE_RUNS', 4)
+    original_merge = spill.heapq.merge
+    fan_in = []
+
+    def merge(*runs, **kwargs):
+        fan_in.append(len(runs))
+        return original_merge(*runs, **kwargs)
+
+    monkeypatch.setattr(spill.heapq, 'merge', merge)
+    docs = [{'key': i * 7919 % 101, 'pos': i} for i in range(500)]
+    for reverse in (False, True):
+        etalon = sorted(docs, key=itemgetter('key'), reverse=reverse)
+        assert etalon == ComputeGraph('docs').sort('key', reverse=reverse, max_rows=3).run(docs=docs)
+    # hundreds of runs are merged in several passes, at most 4 runs (and buffer) at once
+    assert len(opened) > 300 and max(fan_in) <= 5
+    assert all(run._file.closed for run in opened)
+
+
+def test_merge_join_with_memory_budget(monkeypatch):
+    spilled = []
+
+    class CountingSpillFile(spill.SpillFile):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            spilled.append(self)
+
+    monkeypatch.setattr(spill, 'SpillFile', CountingSpillFile)
+    left = [{'key': i * 37 % 100, 'name': i} for i in range(300)]
+    right = [{'key': i * 13 % 120, 'value': i} for i in range(500)]
+    for join_type in ('inner', 'outer'):
+        etalon = ComputeGraph('right').join('left', 'key', type=join_type).run(left=left, right=right)
+        for budget in ({'max_rows': 20}, {'max_bytes': 3000}):
+            del spilled[:]
+            graph = ComputeGraph('right').join('left', 'key', type=join_type, **budget)
+            assert graph.run(left=left, right=right) == etalon
+            # both unsorted tables are sorted in runs that are spilled
+            assert len(spilled) > 10
+            assert graph.run(left=left, right=right, parallelism=2) == etalon
+
+
+def test_hash_join():
+    etalons = {
+        "inner": [{'DepartmentID': 31, 'DepartmentName': 'Sales', 'LastName': 'Rafferty'},
+                  {'DepartmentID': 33, 'DepartmentName': 'Enginnering', 'LastName': 'Jones'},
+                  {'DepartmentID': 33, 'DepartmentName': 'Enginnering', 'LastName': 'Heisenberg'},
+                  {'DepartmentID': 34, 'DepartmentName': 'Clerical', 'LastName': 'Robinson'},
+                  {'DepartmentID': 34, 'DepartmentName': 'Clerical', 'LastName': 'Smith'}]
+    }
+    etalons["left"] = etalons["inner"] + [{'DepartmentID': 35, 'DepartmentName': 'Marketing'}]
+    etalons["right"] = etalons["inner"] + [{'LastName': 'Williams', 'DepartmentID': 0}]
+    etalons["outer"] = etalons["right"] + [{'DepartmentID': 35, 'DepartmentName': 'Marketing'}]
+    for join_type, etalon in etalons.items():
+        for strategy, build_side in (("hash", "left"), ("hash", "right"), ("hash", None), ("auto", None)):
+            graph = ComputeGraph('employee_table').join("department_table", keys="DepartmentID", type=join_type,
+                                                        strategy=strategy, build_side=build_side)
+            result = graph.run(employee_table=employee_table, department_table=department_table)
+            assert sorted(etalon, key=lambda x: (x['DepartmentID'], x.get('LastName', ''))) == \
+                sorted(result, key=lambda x: (x['DepartmentID'], x.get('LastName', '')))
+
+
+def test_hash_join_keeps_streamed_order():
+    graph = ComputeGraph('employee_table').join("department_table", keys="DepartmentID", type="right",
+                                                strategy="hash", build_side="left")
+    result = graph.run(employee_table=employee_table, department_table=department_table)
+    assert [row["LastName"] for row in result] == [row["LastName"] for row in employee_table]
+
+
+def test_broadcast_join(monkeypatch):
+    rows = [{'id': i, 'value': i % 7} for i in range(3000)]
+    total = [{'total': 42}]
+    pairs = [{'first': 1}, {'first': 2}]
+    cross = [{'total': 42, **row} for row in rows]
+    for strategy in ('merge', 'hash', 'auto', 'broadcast'):
+        for build_side in (None, 'left', 'right'):
+            graph = ComputeGraph('rows').join('total', strategy=strategy, build_side=build_side)
+            assert sorted(graph.run(rows=rows, total=total), key=itemgetter('id')) == cross
+    graph = ComputeGraph('rows').sort('id').join('total', strategy='broadcast')
+    assert graph._plan()[1] == (('id',), False)
+    assert graph.run(rows=rows, total=total) == cross
+    assert list(graph.run(rows=rows, total=total)[0].keys()) == ['total', 'id', 'value']
+
+    result = ComputeGraph('rows').join('pairs').run(rows=rows[:3], pairs=pairs)
+    assert sorted(result, key=itemgetter('id', 'first')) == [{**row, **pair} for row in rows[:3] for pair in pairs]
+    graph = ComputeGraph('rows', schema=('id', 'value')).join(ComputeGraph('pairs', schema=('first',)))
+    assert len(graph.run(rows=rows[:3], pairs=pairs)) == 6
+
+    # lines are paired in order of lines of other table, as by merge join, whichever table is kept in memory
+    etalon = [{**row, **pair} for pair in pairs for row in rows[:50]]
+    for strategy in ('merge', 'broadcast'):
+        for build_side in (None, 'left', 'right'):
+            graph = ComputeGraph('rows').join('pairs', strategy=strategy, build_side=build_side)
+            assert graph.run(rows=rows[:50], pairs=pairs) == etalon
+    monkeypatch.setattr(plan, 'JOIN_GROUP_MAX_ROWS', 7)
+    assert ComputeGraph('rows').join('pairs').run(rows=rows[:50], pairs=pairs) == etalon
+
+    for join_type, etalon in (('inner', []), ('left', total), ('right', []), ('outer', total)):
+        assert ComputeGraph('rows').join('total', type=join_type).run(rows=[], total=total) == etalon
+    for join_type, etalon in (('inner', []), ('left', []), ('right', rows[:3]), ('outer', rows[:3])):
+        assert ComputeGraph('rows').join('total', type=join_type).run(rows=rows[:3], total=[]) == etalon
+
+    with pytest.raises(KeyError):
+        ComputeGraph('rows').join('total', strategy='broadcast').run(rows=rows, total=[{'id': 1}])
+
+
+def test_heavy_hitters():
+    sketch = HeavyHitters(4)
+    keys = ['hot'] * 300 + ['warm'] * 150 + ['cold{}'.format(i) for i in range(550)]
+    sketch.update(sorted(keys, key=lambda key: hash(key) % 7))
+    assert sketch.total == 1000
+    # keys that occur more than total / (capacity + 1) times are kept with bounded underestimation
+    assert 300 - 200 <= sketch.estimate('hot') <= 300
+    assert sketch.estimate('warm') <= 150
+    assert 'hot' in sketch.heavy(100)
+    with pytest.raises(ValueError):
+        HeavyHitters(0)
+
+
+def test_bloom_filter():
+    bloom = BloomFilter(1000, error_rate=0.01)
+    bloom.update(('key', i) for i in range(1000))
+    assert all(('key', i) in bloom for i in range(1000))
+    false_positives = sum(('other', i) in bloom for i in range(10000))
+    assert false_positives < 300
+    with pytest.raises(ValueError):
+        BloomFilter(10, error_rate=1)
+
+
+def test_semi_join(monkeypatch):
+    big = [{'key': i % 500, 'value': i} for i in range(2000)]
+    small = [{'key': key * 10, 'name': 'name{}'.format(key)} for key in range(20)]
+    sorted_lengths = []
+
+    def sort_rows(rows, *args, **kwargs):
+        rows = list(rows)
+        sorted_lengths.append(len(rows))
+        return original(rows, *args, **kwargs)
+
+    original = plan.sort_rows
+    monkeypatch.setattr(plan, 'sort_rows', sort_rows)
+    # keys of small table are kept in set or in Bloom filter
+    for (join_type, big_filtered), exact_keys in itertools.product(
+            (('inner', True), ('left', False), ('right', True), ('outer', False)), (100, 0)):
+        monkeypatch.setattr(plan, 'SEMI_JOIN_MAX_EXACT_KEYS', exact_keys)
+        for strategy in ('merge', 'auto'):
+            etalon = ComputeGraph('small').join('big', keys='key', type=join_type, strategy=strategy)\
+                .run(big=big, small=small)
+            del sorted_lengths[:]
+            result = ComputeGraph('small').join('big', keys='key', type=join_type, strategy=strategy,
+                                                bloom_filter=True).run(big=big, small=small)
+            assert result == etalon
+            if strategy == 'merge':
+                # only lines of big table with keys of small table (and few false positives) are sorted
+                assert (sorted_lengths[0] < 200) == big_filtered
+        etalon = ComputeGraph('big').join('small', keys='key', type=join_type).run(big=big, small=small)
+        assert ComputeGraph('big').join('small', keys='key', type=join_type, bloom_filter=True)\
+            .run(big=big, small=small) == etalon
+        assert ComputeGraph('big').join('small', keys='key', type=join_type, bloom_filter=True)\
+            .run(big=big, small=small, parallelism=2) == etalon
+
+
+def test_skewed_join(monkeypatch):
+    big = [{'key': 0 if i % 3 else i % 40, 'value': i} for i in range(600)]
+    small = [{'key': key, 'name': 'name{}'.format(key)} for key in range(-5, 30)] + [{'key': 0, 'name': 'zero'}]
+    big2 = [{'key': row['key'], 'other': row['value']} for row in big[:100]]
+    for join_type in ('inner', 'left', 'right', 'outer'):
+        graph = ComputeGraph('big').join('small', keys='key', type=join_type)
+        etalon = graph.run(big=big, small=small)
+        # hot key is spread among partitions, lines of other table with same key are copied to all of them,
+        # result keeps order of serial join
+        assert graph.run(big=big, small=small, parallelism=3) == etalon
+        graph = ComputeGraph('small').join('big', keys='key', type=join_type)
+        assert graph.run(big=big, small=small, parallelism=3) == graph.run(big=big, small=small)
+        graph = ComputeGraph('big').join('big2', keys='key', type=join_type)
+        etalon_big = graph.run(big=big[:100], big2=big2)
+        # pairs of one key come in order of itertools.product of left and right table
+        assert etalon_big == sorted(({**left, 'value': right['value']} for left in big2 for right in big[:100]
+                                     if left['key'] == right['key']), key=itemgetter('key'))
+        assert graph.run(big=big[:100], big2=big2, parallelism=3) == etalon_big
+
+        monkeypatch.setattr(plan, 'JOIN_GROUP_MAX_ROWS', 4)
+        # groups of hot key are bigger than memory budget on one or both sides
+        assert ComputeGraph('big').join('small', keys='key', type=join_type).run(big=big, small=small) == etalon
+        assert graph.run(big=big[:100], big2=big2) == etalon_big
+        monkeypatch.undo()
+
+
+def test_hash_reduce():
+    docs = [{'doc_id': i % 3, 'word': 'w{}'.format(i % 11), 'count': 1} for i in range(200)]
+    etalon = ComputeGraph('docs').sort('word').reduce(algorithms.collect_counts, 'word').run(docs=docs)
+    key = itemgetter('text')
+    for max_rows in (None, 10, 1):
+        graph = ComputeGraph('docs').reduce(algorithms.collect_counts, 'word', presorted=False, max_rows=max_rows)
+        assert sorted(etalon, key=key) == sorted(graph.run(docs=docs), key=key)
+    graph = ComputeGraph('docs').reduce(algorithms.collect_counts, 'word', presorted=False)
+    assert [row['text'] for row in graph.run(docs=docs)] == ['w{}'.format(i) for i in range(11)]
+
+
+def test_reduce_with_combiner():
+    docs = [{'doc_id': i, 'text': 'hello little world ' * (i % 4) + 'little'} for i in range(5000)]
+    graph = ComputeGraph('docs').map(algorithms.emit_words).sort('word')\
+        .reduce(algorithms.collect_counts, 'word', combiner=algorithms.collect_words)
+    etalon = ComputeGraph('docs').map(algorithms.emit_words).sort('word')\
+        .reduce(algorithms.collect_counts, 'word').run(docs=docs)
+    assert etalon == graph.run(docs=docs)
+
+
+def test_parallel_map():
+    docs = [{'doc_id': i, 'text': 'hello, my little WORLD ' * (i % 3 + 1)} for i in range(300)]
+    etalon = ComputeGraph('docs').map(algorithms.emit_words).run(docs=docs)
+    ordered = ComputeGraph('docs').map(algorithms.emit_words, workers=2, chunk_size=7)
+    assert etalon == ordered.run(docs=docs)
+    unordered = ComputeGraph('docs').map(algorithms.emit_words, workers=2, ordered=False, chunk_size=7)
+    key = itemgetter('doc_id', 'word')
+    assert sorted(etalon, key=key) == sorted(unordered.run(docs=docs), key=key)
+
+
+def test_redundant_sorts():
+    docs = [{'a': i % 3, 'b': i % 5, 'c': i} for i in range(30)]
+    graph = ComputeGraph('docs').sort('a', 'b').sort('a').sort('a', 'b', 'c')\
+        .join('docs_other', keys=('a', 'b', 'c'), type='inner').sort('a', 'b')
+    assert [vertex['type'] for vertex in graph._plan()[0]] == ['input', 'sort', 'sort', 'join']
+    other = [{'a': i % 3, 'b': i % 5, 'c': i, 'd': -i} for i in range(30)]
+    etalon = sorted([dict(row, d=-row['c']) for row in docs], key=itemgetter('a', 'b', 'c'))
+    assert etalon == graph.run(docs=docs, docs_other=other)
+
+    # order of spilled hash reduce is unknown even if it keeps keys
+    def first(rows):
+        yield next(iter(rows))
+
+    rows = [{'k': i * 7 % 50} for i in range(200)]
+    graph = ComputeGraph('rows').sort('k').reduce(first, 'k', presorted=False, max_rows=20, preserves_keys=True)\
+        .sort('k')
+    assert [vertex['type'] for vertex in graph._plan()[0]] == ['input', 'sort', 'reduce', 'sort']
+    assert graph.run(rows=rows) == [{'k': k} for k in range(50)]
+
+
+def test_fused_maps():
+    def increment(record):
+        yield {'value': record['value'] + 1}
+
+    def duplicate(record):
+        yield record
+        yield record
+
+    docs = [{'value': i} for i in range(3)]
+    graph = ComputeGraph('docs').map(duplicate)
+    for _ in range(20):
+        graph.map(increment)
+    graph.map(duplicate)
+    etalon = [{'value': i + 20} for i in range(3) for _ in range(4)]
+    assert etalon == graph.run(docs=docs)
+    assert etalon == graph.run(docs=docs)
+
+
+def test_iter_run_and_sinks(tmpdir):
+    docs = [{'doc_id': i, 'text': 'hello, my little WORLD'} for i in range(10)]
+    graph = ComputeGraph('docs').map(algorithms.emit_words)
+    etalon = graph.run(docs=docs)
+    iterator = graph.iter_run(docs=docs)
+    assert not isinstance(iterator, list)
+    assert etalon == list(iterator)
+
+    path = str(tmpdir.join("result.jsonl"))
+    assert len(etalon) == graph.run_to(JsonLinesSink(path, buffer_size=100), docs=docs)
+    with open(path) as file:
+        assert etalon == [json.loads(line) for line in file]
+
+    batches = []
+    assert len(etalon) == graph.run_to(CallbackSink(batches.append, batch_size=7), docs=docs)
+    assert etalon == [row for batch in batches for row in batch]
+    assert all(len(batch) == 7 for batch in batches[:-1])
+
+
+class CountingStore(MaterializationStore):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.tables = []
+
+    def materialize(self, rows, consumers):
+        table = super().materialize(rows, consumers)
+        self.tables.append(table)
+        return table
+
+
+def test_shared_table():
+    store = CountingStore(buffer_rows=16)
+    table = store.share(iter(range(100)), 2)
+    pairs = list(zip(table.read(), table.read()))
+    assert pairs == [(i, i) for i in range(100)] and not store.tables
+
+    table = store.share(iter(range(100)), 3)
+    first, second = table.read(), table.read()
+    assert list(itertools.islice(first, 10)) == list(range(10))
+    assert list(second) == list(range(100))
+    assert table.materialized and len(store.tables) == 1
+    assert list(first) == list(range(10, 100))
+    assert not store.tables[0].released
+    assert list(table.read()) == list(range(100))
+    assert store.tables[0].released
+
+    table = store.share(iter(range(100)), 2)
+    first, second = table.read(), table.read()
+    next(first)
+    first.close()
+    assert list(second) == list(range(100)) and len(store.tables) == 1
+
+
+def test_schedule():
+    docs = [{'doc_id': i, 'text': ' '.join('word{}'.format(j * i % 11) for j in range(i % 5 + 2))}
+            for i in range(1, 50)]
+    graph = algorithms.build_inverted_index_graph('docs')
+    etalon = graph.run(docs=docs)
+    for _ in range(2):
+        store = CountingStore(buffer_rows=16)
+        assert graph.run(docs=iter(docs), store=store) == etalon
+        # input and words table are read once and released after their last consumers
+        assert len(store.tables) == 2 and all(table.released for table in store.tables)
+
+    first, second = graph.iter_run(docs=iter(docs)), graph.iter_run(docs=iter(docs))
+    assert list(zip(first, second)) == list(zip(etalon, etalon))
+
+    # consumers that read shared table in step do not store it
+    store = CountingStore(buffer_rows=16)
+    rows = [{'key': i, 'value': i % 3} for i in range(100)]
+    sorted_rows = ComputeGraph('rows').sort('key')
+    keys = ComputeGraph(sorted_rows).filter(lambda row: row['value']).project('key')
+    graph = ComputeGraph(sorted_rows).join(keys, 'key')
+    assert graph.run(rows=rows, store=store) == [row for row in rows if row['value']]
+    assert not store.tables
+
+
+def test_run_many():
+    calls = []
+
+    def count_calls(row):
+        calls.append(row['value'])
+        yield row
+
+    docs = [{'key': i % 10, 'value': i} for i in range(100)]
+    names = [{'key': i, 'name': str(i)} for i in range(10)]
+
+    def build():
+        return ComputeGraph('docs').map(count_calls)
+
+    graphs = {'rows': build(),
+              'sorted': build().sort('value', reverse=True),
+              'joined': build().join(ComputeGraph('names'), 'key', strategy='hash'),
+              'odd': build().filter(lambda row: row['value'] % 2, columns='value'),
+              'even': build().filter(lambda row: row['value'] % 2 == 0, columns='value'),
+              'same': build().sort('value', reverse=True)}
+    merged = merge_graphs(list(graphs.values()))
+    assert merged[1] is merged[5] and merged[3] is not merged[4]
+    assert all(graph._inputs[0] is merged[0] for graph in merged[1:])
+
+    etalon = {name: graph.run(docs=docs, names=names) for name, graph in graphs.items()}
+    del calls[:]
+    assert run_many(graphs, docs=iter(docs), names=names) == etalon
+    assert sorted(calls) == list(range(100))
+
+    # methods of different objects and callables that cannot be identified are not merged
+    double = Scale(2)
+    graphs = {'double': ComputeGraph('docs').map(double.map), 'triple': ComputeGraph('docs').map(Scale(3).map),
+              'double_again': ComputeGraph('docs').map(double.map),
+              'first': ComputeGraph('docs').map(Offset(1)), 'second': ComputeGraph('docs').map(Offset(2))}
+    merged = merge_graphs(list(graphs.values()))
+    assert merged[0] is merged[2] and merged[0] is not merged[1] and merged[3] is not merged[4]
+    etalon = {name: graph.run(docs=docs) for name, graph in graphs.items()}
+    assert run_many(graphs, docs=docs) == etalon
+    assert etalon['triple'][:3] == [{'key': 0, 'value': 0}, {'key': 1, 'value': 3}, {'key': 2, 'value': 6}]
+
+    # closures are compared by values of their variables, not by their repr
+    def lookup(table):
+        def mapper(row):
+            yield {'key': row['key'], 'value': table.values[row['key']]}
+        return mapper
+
+    first, second = Table([0] * 10), Table([0] * 5 + [7] + [0] * 4)
+    assert repr(first) == repr(second)
+    graphs = {'first': ComputeGraph('docs').map(lookup(first)), 'second': ComputeGraph('docs').map(lookup(second)),
+              'first_again': ComputeGraph('docs').map(lookup(first))}
+    merged = merge_graphs(list(graphs.values()))
+    assert merged[0] is not merged[1] and merged[0] is merged[2]
+    result = run_many(graphs, docs=docs)
+    assert result == {name: graph.run(docs=docs) for name, graph in graphs.items()}
+    assert result['second'][5] == {'key': 5, 'value': 7}
+
+
+def test_batch_operations():
+    pytest.importorskip("numpy")
+    docs = [{'doc_id': i % 3, 'word': 'w{}'.format(i % 2), 'count': i} for i in range(50)]
+
+    def double(batch):
+        batch['count'] = batch['count'] * 2
+        return batch
+
+    def total(state, batch):
+        return {'total': (state['total'] if state else 0) + int(batch['count'].sum())}
+
+    graph = ComputeGraph('docs').map_batch(double, batch_size=7)\
+        .aggregate(('doc_id', 'word'), {'sum': ('count', 'sum'), 'count': ('count', 'count'),
+                                        'mean': ('count', 'mean'), 'min': ('count', 'min'),
+                                        'max': ('count', 'max')}, batch_size=9)
+    etalon = []
+    for key in sorted({(row['doc_id'], row['word']) for row in docs}):
+        values = [2 * row['count'] for row in docs if (row['doc_id'], row['word']) == key]
+        etalon.append({'doc_id': key[0], 'word': key[1], 'sum': sum(values), 'count': len(values),
+                       'mean': sum(values) / len(values), 'min': min(values), 'max': max(values)})
+    assert etalon == graph.run(docs=docs)
+    assert [{'total': 2450}] == ComputeGraph('docs').map_batch(double).fold_batch(total, batch_size=8).run(docs=docs)
+
+
+def test_schema_records():
+    import pickle
+    docs = [{'doc_id': i % 5, 'text': 'word{}'.format(i % 3), 'count': i} for i in range(50)]
+    names = [{'doc_id': i, 'name': 'doc{}'.format(i)} for i in range(5)]
+
+    def build(schema, names_schema):
+        def total(rows):
+            rows = list(rows)
+            yield {'doc_id': rows[0]['doc_id'], 'text': rows[0]['text'], 'total': sum(row['count'] for row in rows)}
+
+        def identity(row):
+            yield row
+
+        names_graph = ComputeGraph('names', schema=names_schema).sort('doc_id')
+        return ComputeGraph('docs', schema=schema).sort('doc_id', 'text', max_rows=7)\
+            .reduce(total, ('doc_id', 'text')).map(identity, schema=schema and ('doc_id', 'text', 'total'))\
+            .join(names_graph, 'doc_id')
+
+    etalon = build(None, None).run(docs=docs, names=names)
+    result = build(('doc_id', 'text', 'count'), ('doc_id', 'name')).run(docs=docs, names=names)
+    assert etalon == result
+    assert result[0]['name'] == 'doc0' and result[0].keys() == ('doc_id', 'name', 'text', 'total')
+    assert pickle.loads(pickle.dumps(result[0])) == result[0]
+
+    with pytest.raises(KeyError):
+        ComputeGraph('docs', schema=('doc_id', 'count'))\
+            .join(ComputeGraph('other', schema=('doc_id', 'count')), 'doc_id')\
+            .run(docs=docs, other=docs)
+
+
+def test_profile():
+    docs = [{'doc_id': i, 'text': 'hello world {}'.format(i % 10)} for i in range(300)]
+
+    def split(row):
+        for word in row['text'].split():
+            yield {'doc_id': row['doc_id'], 'word': word}
+
+    def count(rows):
+        rows = list(rows)
+        yield {'word': rows[0]['word'], 'count': len(rows)}
+
+    graph = ComputeGraph('docs').map(split).sort('word', max_rows=100).reduce(count, 'word')
+    result, report = graph.run(profile=True, docs=docs)
+    assert result == graph.run(docs=docs)
+
+    stats = {operator['name']: operator for operator in report.as_dict()['operators']}
+    assert stats['input']['rows_out'] == 300
+    assert stats['map(split)']['rows_in'] == 300 and stats['map(split)']['rows_out'] == 900
+    assert stats['sort_reduce(count; word)']['rows_out'] == 12
+    assert stats['sort_reduce(count; word)']['peak_rows'] == 100
+    assert stats['sort_reduce(count; word)']['spilled_bytes'] > 0
+    assert stats['map(split)']['user_time'] > 0
+    assert json.loads(report.to_json()) == report.as_dict()
+    events = json.loads(report.to_chrome_trace())['traceEvents']
+    assert [event['name'] for event in events] == list(stats)
+
+    finished = []
+
+    class Collector(Observer):
+        def operator_finished(self, stats):
+            finished.append(stats.name)
+
+    assert result == graph.run(observer=Collector(), docs=docs)
+    assert set(finished) == set(stats)
+
+
+def test_file_inputs(tmpdir):
+    docs = [{'doc_id': i, 'text': 'hello, little world {}'.format(i % 7), 'extra': [i, {'nested': 'a\nb'}]}
+            for i in range(100)]
+    path = str(tmpdir.join('docs.jsonl'))
+    with open(path, 'w') as file:
+        file.write('\n'.join(json.dumps(row) for row in docs) + '\n\n')
+    projected = [{'doc_id': row['doc_id'], 'text': row['text']} for row in docs]
+    assert list(JsonLinesInput(path, block_size=64)) == docs
+    assert list(JsonLinesInput(path, ('doc_id', 'text'), block_size=100, use_mmap=True)) == projected
+
+    csv_path = str(tmpdir.join('docs.csv'))
+    with open(csv_path, 'w') as file:
+        file.write('doc_id,text,ignored\n')
+        file.writelines('{},"{}",x\n'.format(row['doc_id'], row['text']) for row in docs)
+    assert list(CsvInput(csv_path, ('doc_id', 'text'), types={'doc_id': int})) == projected
+    assert list(CsvInput(csv_path, ('text',)))[0] == {'text': docs[0]['text']}
+    tsv_path = str(tmpdir.join('docs.tsv'))
+    with open(tsv_path, 'w') as file:
+        file.write('text\tdoc_id\n')
+        file.writelines('{}\t{}\n'.format(row['text'], row['doc_id']) for row in docs)
+    assert list(TsvInput(tsv_path, ('doc_id', 'text'), types={'doc_id': int})) == projected
+    with pytest.raises(KeyError):
+        list(CsvInput(csv_path, ('missing',)))
+
+    class CountingStore(MaterializationStore):
+        materialized = 0
+
+        def materialize(self, rows, consumers):
+            CountingStore.materialized += 1
+            return super().materialize(rows, consumers)
+
+    etalon = algorithms.build_inverted_index_graph('docs').run(docs=projected)
+    graph = algorithms.build_inverted_index_graph('docs')
+    assert etalon == graph.run(docs=JsonLinesInput(path, ('doc_id', 'text')), store=CountingStore())
+    # only shared subgraph is stored, input is read from file by both consumers
+    assert CountingStore.materialized == 1
+
+
+def test_block_format(tmpdir):
+    import datetime
+    from compgraph.blocks import BlockReader, BlockWriter, PICKLED_ROWS
+    from compgraph.records import to_records
+
+    rows = [{'key': i, 'value': 'v{}'.format(i), 'list': [i, None, True]} for i in range(1000)]
+    records = list(to_records(rows, ('key', 'value')))
+    odd = [{'key': i, 'time': datetime.datetime(2017, 10, 9)} for i in range(10)]
+    for table, compress in ((rows, False), (records, True), (odd, False), (rows + records, True)):
+        path = str(tmpdir.join('table.bin'))
+        with open(path, 'wb') as file:
+            writer = BlockWriter(file, block_rows=64, compress=compress)
+            writer.extend(table[:10])
+            for row in table[10:]:
+                writer.write(row)
+            writer.close()
+        with open(path, 'rb') as file:
+            reader = BlockReader(file)
+            assert list(reader) == table and len(reader) == len(table)
+            if table is odd:
+                assert [entry.kind for entry in reader.index] == [PICKLED_ROWS]
+            reader.close()
+
+    broken = tmpdir.join('broken.bin')
+    broken.write_binary(tmpdir.join('table.bin').read_binary()[:-5])
+    with open(str(broken), 'rb') as file, pytest.raises(ValueError):
+        BlockReader(file)
+
+
+class CountingInput(JsonLinesInput):
+    reads = {'names': 0, 'docs': 0}
+
+    def __iter__(self):
+        for row in super().__iter__():
+            CountingInput.reads[os.path.basename(self.path).split('.')[0]] += 1
+            yield row
+
+
+def copy_row(row):
+    yield dict(row)
+
+
+def double_value(row):
+    yield {'key': row['key'], 'value': row['value'] * 2}
+
+
+def test_result_cache(tmpdir):
+    def write(name, rows):
+        tmpdir.join(name).write('\n'.join(json.dumps(row) for row in rows))
+        return CountingInput(str(tmpdir.join(name)))
+
+    def build():
+        names = ComputeGraph('names').map(copy_row)
+        return ComputeGraph('docs').map(double_value).join(names, 'key')
+
+    names = write('names.jsonl', [{'key': i, 'name': str(i)} for i in range(10)])
+    docs = write('docs.jsonl', [{'key': i % 10, 'value': i} for i in range(100)])
+    cache = ResultCache(str(tmpdir.join('cache')))
+    etalon = build().run(docs=docs, names=names)
+    assert build().run(docs=docs, names=names, cache=cache) == etalon
+    assert CountingInput.reads == {'names': 20, 'docs': 200}
+    assert len(cache.entries()) == 2
+
+    # nothing is computed again
+    assert build().run(docs=docs, names=names, cache=cache) == etalon
+    assert CountingInput.reads == {'names': 20, 'docs': 200}
+
+    # unchanged subgraph is read from cache
+    docs = write('docs.jsonl', [{'key': i % 10, 'value': i} for i in range(50)])
+    result = build().run(docs=docs, names=names, cache=cache)
+    assert result == build().run(docs=docs, names=names) and len(result) == 50
+    assert CountingInput.reads == {'names': 30, 'docs': 300}
+
+    # inputs without fingerprint are not cached
+    assert build().run(docs=list(docs), names=names, cache=cache) == result
+    assert CountingInput.reads == {'names': 30, 'docs': 350}
+
+    cache.max_bytes = max(size for _, size, _ in cache.entries())
+    cache.evict()
+    assert sum(size for _, size, _ in cache.entries()) <= cache.max_bytes
+    cache.invalidate()
+    assert cache.entries() == []
+
+
+class Scale(object):
+    def __init__(self, factor, column='value'):
+        self.factor = factor
+        self.column = column
+
+    def map(self, row):
+        yield {'key': row['key'], self.column: row['value'] * self.factor}
+
+
+class Table(object):
+    def __init__(self, values):
+        self.values = values
+
+    def __repr__(self):
+        return 'Table(...)'
+
+
+class Offset(object):
+    __slots__ = ('offset',)
+
+    def __init__(self, offset):
+        self.offset = offset
+
+    def __call__(self, row):
+        yield {'key': row['key'], 'value': row['value'] + self.offset}
+
+
+def test_result_cache_during_run(tmpdir):
+    def write(name, rows):
+        tmpdir.join(name).write('\n'.join(json.dumps(row) for row in rows))
+        return JsonLinesInput(str(tmpdir.join(name)))
+
+    def build():
+        names = ComputeGraph('names').map(Scale(1, 'weight').map)
+        return ComputeGraph('docs').map(Scale(2).map).join(names, 'key', strategy='hash', build_side='right')
+
+    names = write('names.jsonl', [{'key': i, 'value': i} for i in range(100)])
+    docs = write('docs.jsonl', [{'key': i % 100, 'value': i} for i in range(300)])
+    cache = ResultCache(str(tmpdir.join('cache')))
+    build().run(docs=docs, names=names, cache=cache)
+    entries = cache.entries()
+    assert len(entries) == 2
+    # results of names are least recently used, and there is space only for two results
+    for age, (fingerprint, _, _) in enumerate(sorted(entries, key=lambda entry: entry[1])):
+        path = os.path.join(cache.directory, fingerprint + '.blk')
+        os.utime(path, (os.path.getmtime(path) - 100 + age, os.path.getmtime(path) - 100 + age))
+    cache.max_bytes = sum(size for _, size, _ in entries) + 1000
+
+    # result that run reads is not evicted by results that it writes
+    docs = write('docs.jsonl', [{'key': i % 100, 'value': i} for i in range(301)])
+    etalon = build().run(docs=docs, names=names)
+    assert build().run(docs=docs, names=names, cache=cache) == etalon
+    assert len(cache.entries()) == 2
+
+    # result removed after run is scheduled is computed again
+    iterator = build().iter_run(docs=docs, names=names, cache=cache)
+    cache.invalidate()
+    assert list(iterator) == etalon
+
+    # bound methods differ by their objects
+    assert function_fingerprint(Scale(2).map) == function_fingerprint(Scale(2).map)
+    assert function_fingerprint(Scale(2).map) != function_fingerprint(Scale(3).map)
+    assert function_fingerprint(object.__new__) == function_fingerprint(object.__new__)
+
+
+FACTOR = 2
+
+
+def scale_by_factor(row):
+    yield {'key': row['key'], 'value': row['value'] * FACTOR}
+
+
+def read_merge_runs(row):
+    yield {'key': row['key'], 'value': spill.MAX_MERGE_RUNS}
+
+
+def test_result_cache_keys(tmpdir, monkeypatch):
+    # values of global names and of attributes of modules that functions read are parts of fingerprints
+    fingerprint = function_fingerprint(scale_by_factor)
+    monkeypatch.setattr(sys.modules[__name__], 'FACTOR', 3)
+    assert function_fingerprint(scale_by_factor) != fingerprint
+    fingerprint = function_fingerprint(read_merge_runs)
+    monkeypatch.setattr(spill, 'MAX_MERGE_RUNS', 5)
+    assert function_fingerprint(read_merge_runs) != fingerprint
+
+    tmpdir.join('docs.jsonl').write('\n'.join(json.dumps({'key': i, 'value': 1}) for i in range(10)))
+    docs = JsonLinesInput(str(tmpdir.join('docs.jsonl')))
+    cache = ResultCache(str(tmpdir.join('cache')))
+    graph = ComputeGraph('docs').map(scale_by_factor)
+    assert graph.run(docs=docs, cache=cache)[0] == {'key': 0, 'value': 3}
+    monkeypatch.setattr(sys.modules[__name__], 'FACTOR', 4)
+    assert graph.run(docs=docs, cache=cache)[0] == {'key': 0, 'value': 4}
+    assert len(cache.entries()) == 2
+
+    # values which repr may omit their state are not cached
+    def lookup_table(table):
+        def mapper(row):
+            yield {'key': row['key'], 'value': table.values[row['key']]}
+        return mapper
+
+    assert plan_fingerprint([{'mapper': lookup_table(Table([0] * 10))}], []) is None
+    assert ComputeGraph('docs').map(lookup_table(Table([5] * 10))).run(docs=docs, cache=cache)[0]['value'] == 5
+    assert len(cache.entries()) == 2
+
+    # arrays are identified by their content
+    numpy = pytest.importorskip('numpy')
+
+    def lookup(values):
+        def mapper(row):
+            yield {'key': row['key'], 'value': float(values[row['key']])}
+        return mapper
+
+    first = numpy.zeros(5000)
+    second = first.copy()
+    second[500] = 7
+    assert repr(first) == repr(second)
+    assert function_fingerprint(lookup(first)) != function_fingerprint(lookup(second))
+    assert function_fingerprint(lookup(first)) == function_fingerprint(lookup(first.copy()))
+    assert function_fingerprint(lookup(first[::2])) == function_fingerprint(lookup(first[::2].copy()))
+    assert plan_fingerprint([{'mapper': lookup(numpy.array([None, 1]))}], []) is None
+
+
+def test_top_k():
+    rows = [{'group': i % 7, 'value': (i * 37) % 11, 'id': i} for i in range(500)]
+
+    def etalon(table, reverse):
+        return sorted(table, key=itemgetter('value'), reverse=reverse)
+
+    for reverse in (False, True):
+        graph = ComputeGraph('rows').sort('value', reverse=reverse).limit(5)
+        assert [vertex['type'] for vertex in graph._plan()[0]] == ['input', 'top_k']
+        assert graph.run(rows=rows) == etalon(rows, reverse)[:5]
+        assert ComputeGraph('rows').top_k(5, 'value', reverse=reverse).run(rows=rows, parallelism=2) == \
+            etalon(rows, reverse)[:5]
+
+        groups = [[row for row in rows if row['group'] == group] for group in range(7)]
+        expected = [row for group in groups for row in etalon(group, reverse)[:3]]
+        assert ComputeGraph('rows').top_k(3, 'value', keys='group', reverse=reverse).run(rows=rows) == expected
+        assert ComputeGraph('rows').sort('group').top_k(3, 'value', keys='group', reverse=reverse)\
+            .run(rows=rows) == expected
+
+    assert ComputeGraph('rows').limit(3).run(rows=rows) == rows[:3]
+
+
+def test_filter_project():
+    rows = [{'id': i, 'group': i % 5, 'value': (i * 13) % 17, 'payload': 'x' * i} for i in range(100)]
+    other = [{'group': group, 'name': 'group {}'.format(group)} for group in range(4)]
+
+    def even_group(row):
+        return row['group'] % 2 == 0
+
+    def max_value(rows):
+        rows = list(rows)
+        yield {'group': rows[0]['group'], 'value': max(row['value'] for row in rows)}
+
+    graph = ComputeGraph('rows').sort('value').filter(even_group, columns='group')
+    assert [vertex['type'] for vertex in graph._plan()[0]] == ['input', 'filter', 'sort']
+    assert graph.run(rows=rows) == sorted([row for row in rows if even_group(row)], key=itemgetter('value'))
+
+    graph = ComputeGraph('rows').sort('group').reduce(max_value, 'group', preserves_keys=True)\
+        .filter(even_group, columns='group')
+    assert [vertex['type'] for vertex in graph._plan()[0]] == ['input', 'filter', 'sort', 'reduce']
+    assert graph.run(rows=rows) == [{'group': group, 'value': 16} for group in (0, 2, 4)]
+    graph = ComputeGraph('rows').sort('group').reduce(max_value, 'group').filter(even_group, columns='group')
+    assert [vertex['type'] for vertex in graph._plan()[0]] == ['input', 'sort', 'reduce', 'filter']
+    # columns of filter are not known, so it is moved only before sort
+    graph = ComputeGraph('rows').sort('group').reduce(max_value, 'group', preserves_keys=True)\
+        .sort('value').filter(even_group)
+    assert [vertex['type'] for vertex in graph._plan()[0]] == ['input', 'sort', 'reduce', 'filter', 'sort']
+
+    for type in ('inner', 'left'):
+        graph = ComputeGraph('rows').join('other', keys='group', type=type, strategy='hash')
+        expected = sorted(graph.run(rows=rows, other=other), key=itemgetter('group'))
+        expected = [{'group': row['group'], 'name': row['name']} for row in expected if even_group(row)]
+        graph = ComputeGraph('rows').join('other', keys='group', type=type, strategy='hash')\
+            .filter(even_group, columns='group').project(('group', 'name')).sort('group')
+        plan = graph._plan()[0]
+        assert [vertex['type'] for vertex in plan] == ['input', 'project', 'filter', 'join', 'project', 'sort']
+        assert plan[3]['left_filters'] == (even_group,) and plan[3]['left_columns'] == ('group', 'name')
+        assert graph.run(rows=rows, other=other) == expected
+
+    graph = ComputeGraph('rows', schema=('id', 'group', 'value', 'payload')).sort('value', 'id')\
+        .project(('id', 'value')).limit(3)
+    assert [vertex['type'] for vertex in graph._plan()[0]] == ['input', 'schema', 'project', 'top_k']
+    result = graph.run(rows=rows)
+    assert result == [{'id': 0, 'value': 0}, {'id': 17, 'value': 0}, {'id': 34, 'value': 0}]
+    assert list(result[0].keys()) == ['id', 'value']
+    with pytest.raises(KeyError):
+        ComputeGraph('rows').project('missing').run(rows=rows)
+
+    observer = Observer()
+    ComputeGraph('rows').map(lambda row: [row]).filter(even_group, columns='group').run(rows=rows, observer=observer)
+    assert [stats.name for stats in observer.operators] == ['input', 'map(<lambda>, filter:even_group)']